@@ -0,0 +1,254 @@
+# analytics.py — события прохождения маршрута: кольцевой буфер в памяти,
+# фоновая пакетная запись в сжатые JSONL-файлы и офлайн-отчёт
+#
+#   python analytics.py report [--dir data/analytics]
+#
+# Обработчики только добавляют событие в буфер (без ввода-вывода); запись идёт
+# фоновой задачей раз в flush_interval секунд в отдельном потоке. Файлы
+# events-<дата>-<pid>-<номер>.jsonl.gz ротируются по размеру и по дням;
+# отчёт читает их построчно и держит в памяти только агрегаты.
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = "events-"
+FILE_SUFFIX = ".jsonl.gz"
+
+# Корзины для времени на точке, в секундах
+DWELL_BUCKETS = (30, 60, 120, 180, 300, 420, 600, 900, 1200, 1800, 3600)
+
+
+class EventLog:
+    """Неблокирующий журнал событий: track() — O(1), без ожидания и ввода-вывода"""
+
+    def __init__(self, directory: Path, salt: str = "", buffer_size: int = 10_000,
+                 flush_interval: float = 5.0, rotate_bytes: int = 16 * 1024 * 1024):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self._salt = salt.encode()
+        self._buffer: Deque[Tuple[float, str, int, Dict[str, Any]]] = deque(maxlen=buffer_size)
+        self._walkers: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Пачка, которая пишется сейчас: её не прерывает отмена фоновой задачи
+        self._writing: Optional[asyncio.Future] = None
+        self._path: Optional[Path] = None
+        self._day = ""
+        self._seq = 0
+        self.dropped = 0
+        self.written = 0
+
+    def walker_id(self, chat_id: int) -> str:
+        """Псевдоним чата: в журнал не попадают настоящие chat_id"""
+        walker = self._walkers.get(chat_id)
+        if walker is None:
+            if len(self._walkers) > 100_000:
+                self._walkers.clear()
+            walker = hashlib.blake2b(
+                str(chat_id).encode(), digest_size=8, key=self._salt[:64]
+            ).hexdigest()
+            self._walkers[chat_id] = walker
+        return walker
+
+    def track(self, event: str, chat_id: int, **fields: Any) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            # Буфер полон — самое старое событие вытесняется
+            self.dropped += 1
+        self._buffer.append((time.time(), event, chat_id, fields))
+
+    # ---- Запись ----
+
+    def _target(self, now: float) -> Path:
+        day = time.strftime("%Y%m%d", time.gmtime(now))
+        path = self._path
+        if path is None or day != self._day or (path.exists() and path.stat().st_size >= self.rotate_bytes):
+            self._day = day
+            self._seq += 1
+            path = self._path = self.directory / f"{FILE_PREFIX}{day}-{os.getpid()}-{self._seq:04d}{FILE_SUFFIX}"
+        return path
+
+    def _write(self, lines: List[str]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Каждая запись — отдельный gzip-member, дописывается в конец файла
+        with gzip.open(self._target(time.time()), "at", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def _write_batch(self, lines: List[str]) -> None:
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.written += len(lines)
+        except OSError:
+            logger.exception("Не удалось записать %s событий аналитики", len(lines))
+
+    async def flush(self) -> None:
+        # Отменённый flush (stop() во время записи) оставляет поток дописывать
+        # пачку; следующая запись ждёт её, а не открывает тот же файл параллельно
+        while self._writing is not None and not self._writing.done():
+            await asyncio.shield(self._writing)
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        lines = []
+        for ts, event, chat_id, fields in batch:
+            record = {"t": round(ts, 3), "e": event, "w": self.walker_id(chat_id), **fields}
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._writing = asyncio.ensure_future(self._write_batch(lines))
+        await asyncio.shield(self._writing)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# ---- Отчёт ----
+
+def iter_events(directory: Path) -> Iterator[Dict[str, Any]]:
+    """Все события по порядку файлов, построчно; битые строки пропускаются"""
+    for path in sorted(directory.glob(f"{FILE_PREFIX}*{FILE_SUFFIX}")):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (OSError, EOFError):
+            # Файл, который пишется прямо сейчас, может оборваться на середине
+            logger.warning("Файл %s прочитан не полностью", path)
+
+
+class DwellStats:
+    """Время на точке без хранения всех значений: сумма, количество и корзины"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(DWELL_BUCKETS) + 1)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(DWELL_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q: float) -> str:
+        """Верхняя граница корзины, в которую попадает квантиль"""
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(DWELL_BUCKETS, self.buckets):
+            seen += n
+            if seen >= target:
+                return f"≤{bound // 60}м" if bound >= 60 else f"≤{bound}с"
+        return f">{DWELL_BUCKETS[-1] // 60}м"
+
+
+def aggregate(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    starts = Counter()
+    reached: Dict[str, int] = {}           # walker -> последняя точка, содержимое которой получено
+    finished = set()
+    prompt_choice: Dict[int, Counter] = defaultdict(Counter)
+    arrived: Dict[Tuple[str, int], float] = {}
+    dwell: Dict[int, DwellStats] = defaultdict(DwellStats)
+
+    for ev in events:
+        kind, walker = ev.get("e"), ev.get("w")
+        point = ev.get("p")
+        if kind == "start":
+            starts["start"] += 1
+        elif kind == "tap":
+            action = ev.get("a")
+            if action == "start_tour":
+                starts["start_tour"] += 1
+            elif action == "im_here" and point is not None:
+                arrived[(walker, point)] = ev["t"]
+            elif action == "yes" and point is not None:
+                prompt_choice[point]["yes"] += 1
+            elif action == "next" and point is not None:
+                if ev.get("prompt"):
+                    prompt_choice[point]["skip"] += 1
+                started = arrived.pop((walker, point), None)
+                if started is not None:
+                    dwell[point].add(ev["t"] - started)
+        elif kind == "delivered":
+            if ev.get("part") == "content" and point is not None:
+                reached[walker] = max(point, reached.get(walker, -1))
+            elif ev.get("part") == "final":
+                finished.add(walker)
+
+    furthest = Counter(reached.values())
+    return {
+        "starts": starts,
+        "furthest": furthest,
+        "walkers": len(reached),
+        "finished": len(finished),
+        "prompt_choice": prompt_choice,
+        "dwell": dwell,
+    }
+
+
+def print_report(r: Dict[str, Any]) -> None:
+    print(f"/start: {r['starts']['start']}, начали маршрут: {r['starts']['start_tour']}, "
+          f"дошли до финала: {r['finished']}")
+    points = sorted(set(r["furthest"]) | set(r["dwell"]) | set(r["prompt_choice"]))
+    total = r["walkers"]
+    print("\nВоронка (получили содержимое точки):")
+    remaining = total
+    for p in range(max(points) + 1 if points else 0):
+        share = remaining / total * 100 if total else 0
+        print(f"  точка {p + 1:>2}: {remaining:>6} ({share:5.1f}%)")
+        remaining -= r["furthest"].get(p, 0)
+
+    print("\nВыбор на вопросах точек (да / не сейчас):")
+    for p in sorted(r["prompt_choice"]):
+        c = r["prompt_choice"][p]
+        print(f"  точка {p + 1:>2}: {c['yes']:>6} / {c['skip']:<6}")
+
+    print("\nВремя на точке («Я тут» → «Следующая точка»):")
+    for p in sorted(r["dwell"]):
+        d = r["dwell"][p]
+        print(f"  точка {p + 1:>2}: n={d.count:<6} среднее {d.total / d.count / 60:5.1f} мин, "
+              f"медиана {d.quantile(0.5)}, p90 {d.quantile(0.9)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчёты по журналу событий маршрута")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_cmd = commands.add_parser("report", help="воронка, выбор на вопросах и время на точках")
+    report_cmd.add_argument("--dir", type=Path, default=Path(os.getenv("DATA_DIR", "data")) / "analytics")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print_report(aggregate(iter_events(args.dir)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# api_request.py — HTTP-запросы к Bot API с учётом вызовов, байтов и времени по методам
+#
+# Запросы идут через два пула соединений: короткие (ответы на нажатия, тексты,
+# клавиатуры, отправка по file_id) и загрузки файлов. Большой файл занимает
+# только соединение пула загрузок и не задерживает чужие ответы на кнопки.
+# Отправка путём file:// (свой сервер Bot API в режиме --local) байтов не
+# передаёт, но отвечает после загрузки файла в Telegram — она тоже идёт пулом загрузок.
+import asyncio
+import os
+import time
+from typing import Any, Optional, Tuple
+
+from telegram.request import HTTPXRequest, RequestData
+
+from metrics import BOOT, Counter, Gauge, Histogram
+
+API_REQUESTS = Counter(
+    "bot_api_requests_total", "Запросы к Bot API по методу и HTTP-статусу", ("method", "status")
+)
+API_REQUEST_BYTES = Counter(
+    "bot_api_request_bytes_total", "Отправлено байт в Bot API (параметры и файлы)", ("method",)
+)
+API_UPLOAD_BYTES = Counter(
+    "bot_api_upload_bytes_total", "Из них байт загруженных файлов", ("method",)
+)
+API_REQUEST_SECONDS = Histogram(
+    "bot_api_request_seconds", "Время запроса к Bot API", ("method",),
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_SIZE = Gauge("bot_api_pool_size", "Предел одновременных запросов пула", ("pool",))
+POOL_IN_FLIGHT = Gauge("bot_api_pool_in_flight", "Запросы пула, которые выполняются сейчас", ("pool",))
+POOL_WAITING = Gauge("bot_api_pool_waiting", "Запросы, ждущие свободного места в пуле", ("pool",))
+POOL_WAIT_SECONDS = Histogram(
+    "bot_api_pool_wait_seconds", "Ожидание места в пуле до начала запроса", ("pool",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+def _content_size(content: Any) -> int:
+    if hasattr(content, "__len__"):
+        # bytes, а также MappedReader из asset_store
+        return len(content)
+    try:
+        return os.fstat(content.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def request_size(request_data: Optional[RequestData]) -> Tuple[int, int]:
+    """(все байты, байты файлов) запроса — приблизительно, без учёта заголовков"""
+    if request_data is None:
+        return 0, 0
+    params = len(request_data.url_encoded_parameters().encode())
+    files = 0
+    if request_data.contains_files:
+        files = sum(_content_size(part[1]) for part in request_data.multipart_data.values())
+    return params + files, files
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest с метриками; pool — имя пула в метриках, max_concurrent —
+    предел одновременных запросов (по умолчанию — размер пула соединений)"""
+
+    def __init__(self, *args, pool: str = "default", max_concurrent: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+        self.max_concurrent = max_concurrent or kwargs.get("connection_pool_size") or 1
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._waiting = 0
+        self._in_flight = 0
+        POOL_SIZE.set(self.max_concurrent, pool=pool)
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        queued = time.perf_counter()
+        self._waiting += 1
+        POOL_WAITING.set(self._waiting, pool=self.pool)
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+            POOL_WAITING.set(self._waiting, pool=self.pool)
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - queued, pool=self.pool)
+        self._in_flight += 1
+        POOL_IN_FLIGHT.set(self._in_flight, pool=self.pool)
+        try:
+            return await self._metered_request(url, method, request_data, *args, **kwargs)
+        finally:
+            self._in_flight -= 1
+            POOL_IN_FLIGHT.set(self._in_flight, pool=self.pool)
+            self._slots.release()
+
+    async def _metered_request(self, url: str, method: str, request_data: Optional[RequestData],
+                               *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        total, files = request_size(request_data)
+        API_REQUEST_BYTES.inc(total, method=api_method)
+        if files:
+            API_UPLOAD_BYTES.inc(files, method=api_method)
+
+        started = time.perf_counter()
+        status = "error"
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            status = str(code)
+            if code == 200 and api_method.startswith("send"):
+                BOOT.first("first_send")
+            return code, payload
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
+            API_REQUESTS.inc(method=api_method, status=status)
+
+
+def has_local_files(request_data: RequestData) -> bool:
+    """Есть ли в запросе файлы, переданные путём file://"""
+    return any("file://" in value for value in request_data.json_parameters.values())
+
+
+class PooledRequest(MeteredRequest):
+    """Пул коротких запросов, который отдаёт загрузки файлов отдельному пулу uploads;
+    local_files=True — и отправки путём file://"""
+
+    def __init__(self, *args, uploads: MeteredRequest, local_files: bool = False, **kwargs):
+        kwargs.setdefault("pool", "control")
+        super().__init__(*args, **kwargs)
+        self.uploads = uploads
+        self.local_files = local_files
+
+    async def initialize(self) -> None:
+        await super().initialize()
+        await self.uploads.initialize()
+
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        await self.uploads.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        if request_data is not None and (
+            request_data.contains_files or (self.local_files and has_local_files(request_data))
+        ):
+            return await self.uploads.do_request(url, method, request_data, *args, **kwargs)
+        return await super().do_request(url, method, request_data, *args, **kwargs)
@@ -0,0 +1,115 @@
+# asset_manifest.py — неизменяемый манифест файлов маршрута, собирается при старте
+import json
+import mimetypes
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+from media_cache import file_sha256
+
+PHOTO_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+VOICE_SUFFIXES = {".ogg", ".oga", ".opus"}
+
+# Облегчённые копии файлов (см. build_assets.py)
+DERIVED_MANIFEST = "manifest.json"
+STANDARD = "standard"
+LOW_DATA = "lowdata"
+VARIANTS = (STANDARD, LOW_DATA)
+
+
+@dataclass(frozen=True)
+class AssetInfo:
+    path: Path
+    exists: bool
+    size: int = 0
+    mtime_ns: int = 0
+    sha256: Optional[str] = None
+    kind: str = "document"  # photo | voice | document — каким методом отправлять
+    mime_type: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple[str, int, str]:
+        """Ключ для кэша file_id: путь + размер + хэш"""
+        return (self.path.as_posix(), self.size, self.sha256 or "")
+
+
+def media_kind(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix in PHOTO_SUFFIXES:
+        return "photo"
+    if suffix in VOICE_SUFFIXES:
+        return "voice"
+    return "document"
+
+
+# digest(path, size, mtime_ns) -> sha256; по умолчанию файл читается целиком
+Digest = Callable[[Path, int, int], str]
+
+
+def describe_asset(path: Path, digest: Optional[Digest] = None) -> AssetInfo:
+    kind = media_kind(path)
+    mime_type = mimetypes.guess_type(path.name)[0]
+    try:
+        st = path.stat()
+    except OSError:
+        return AssetInfo(path=path, exists=False, kind=kind, mime_type=mime_type)
+    return AssetInfo(
+        path=path,
+        exists=True,
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        sha256=digest(path, st.st_size, st.st_mtime_ns) if digest else file_sha256(path),
+        kind=kind,
+        mime_type=mime_type,
+    )
+
+
+def update_manifest(previous: Mapping[Path, AssetInfo], paths: Iterable[Path],
+                    digest: Optional[Digest] = None) -> Mapping[Path, AssetInfo]:
+    """Манифест для новой версии маршрута: файлы с прежними размером и mtime
+    берутся из previous, остальные описываются заново. Старые записи остаются —
+    на них ещё ссылаются сессии прошлых версий."""
+    manifest = dict(previous)
+    for path in paths:
+        old = manifest.get(path)
+        try:
+            st = path.stat()
+        except OSError:
+            st = None
+        if old is not None and (
+            (st is None and not old.exists)
+            or (st is not None and old.exists and (old.size, old.mtime_ns) == (st.st_size, st.st_mtime_ns))
+        ):
+            continue
+        manifest[path] = describe_asset(path, digest)
+    return MappingProxyType(manifest)
+
+
+@dataclass(frozen=True)
+class DerivedAsset:
+    """Собранная копия исходного файла"""
+    path: Path
+    source_sha256: str
+    size: int = 0
+    duration: Optional[int] = None  # секунды, для голосовых
+
+
+def load_derived_manifest(build_dir: Path, src_dir: Path) -> Dict[str, Mapping[Path, DerivedAsset]]:
+    """variant -> {путь исходного файла: собранная копия}; пусто, если сборки нет"""
+    try:
+        raw = json.loads((build_dir / DERIVED_MANIFEST).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    variants = {}
+    for variant, entries in raw.get("variants", {}).items():
+        variants[variant] = MappingProxyType({
+            src_dir / name: DerivedAsset(
+                path=build_dir / entry["file"],
+                source_sha256=entry["source_sha256"],
+                size=entry.get("size", 0),
+                duration=entry.get("duration"),
+            )
+            for name, entry in entries.items()
+        })
+    return variants
@@ -0,0 +1,121 @@
+# asset_store.py — байты файлов assets в памяти процесса для загрузок в Telegram
+#
+# Мелкие файлы (фото, короткие голосовые) держатся целиком в LRU с бюджетом
+# по байтам. Крупные (PDF, длинные аудио) отображаются в память только для
+# чтения: httpx читает их кусками по 64 КиБ прямо из страничного кэша, и
+# MappedReader отдаёт срезы mmap без копирования. Копия всё же есть — каждый
+# кусок один раз копирует h11, собирая тело запроса, — но память на загрузку
+# не зависит от размера файла (≈2 МиБ в пике и для 4, и для 128 МиБ).
+# Изменённый на диске файл (другие размер или mtime) перечитывается.
+import mmap
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+from telegram import InputFile
+
+# (размер, mtime_ns) — по ним видно, что файл на диске заменили
+_Stamp = Tuple[int, int]
+
+
+class MappedReader:
+    """Файловый объект поверх общего mmap со своей позицией чтения:
+    несколько загрузок одного файла не мешают друг другу"""
+
+    def __init__(self, view: memoryview, name: str):
+        self._view = view
+        self._pos = 0
+        self.name = name
+
+    def read(self, size: int = -1) -> memoryview:
+        """Срез mmap без копирования; httpx отправляет его как есть"""
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        chunk = self._view[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, min(base + offset, len(self._view)))
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+
+class AssetStore:
+    def __init__(self, budget_bytes: int = 32 * 1024 * 1024, mmap_threshold: int = 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.mmap_threshold = mmap_threshold
+        self._cache: "OrderedDict[Path, Tuple[_Stamp, bytes]]" = OrderedDict()
+        self._maps: Dict[Path, Tuple[_Stamp, mmap.mmap]] = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def mapped_bytes(self) -> int:
+        return sum(len(m) for _, m in self._maps.values())
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _evict(self, path: Path) -> None:
+        entry = self._cache.pop(path, None)
+        if entry is not None:
+            self.resident_bytes -= len(entry[1])
+        # Не закрываем mmap явно: на него ещё могут смотреть идущие загрузки,
+        # его закроет сборщик мусора вместе с последним MappedReader
+        self._maps.pop(path, None)
+
+    def get(self, path: Path) -> Union[bytes, MappedReader]:
+        """Содержимое файла: bytes из LRU или MappedReader для крупного файла"""
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+
+        mapped = self._maps.get(path)
+        if mapped is not None and mapped[0] == stamp:
+            self.hits += 1
+            return MappedReader(memoryview(mapped[1]), path.name)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            self.hits += 1
+            self._cache.move_to_end(path)
+            return cached[1]
+
+        self.misses += 1
+        self._evict(path)
+        if st.st_size >= self.mmap_threshold:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[path] = (stamp, mm)
+            return MappedReader(memoryview(mm), path.name)
+
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) <= self.budget_bytes:
+            self._cache[path] = (stamp, data)
+            self.resident_bytes += len(data)
+            while self.resident_bytes > self.budget_bytes:
+                _, (_, old) = self._cache.popitem(last=False)
+                self.resident_bytes -= len(old)
+        return data
+
+    def input_file(self, path: Path, attach: bool = False) -> InputFile:
+        """InputFile для отправки; attach=True — для файлов внутри альбома"""
+        content = self.get(path)
+        if isinstance(content, MappedReader):
+            # Не читать файл целиком: httpx сам прочитает его кусками при отправке
+            return InputFile(content, filename=path.name, attach=attach, read_file_handle=False)
+        return InputFile(content, filename=path.name, attach=attach)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._maps.clear()
+        self.resident_bytes = 0
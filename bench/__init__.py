@@ -0,0 +1 @@
+# bench — нагрузочные прогоны бота без сети: python -m bench.run
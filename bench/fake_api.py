@@ -0,0 +1,250 @@
+# bench/fake_api.py — локальный Bot API для нагрузочных прогонов
+#
+# Отвечает на методы, которые вызывает бот, правдоподобными объектами,
+# считает вызовы и байты, добавляет задержку сети и возвращает 429 с
+# retry_after, если чат или бот в целом превышает лимиты Telegram.
+# local=True — как свой сервер telegram-bot-api --local: принимает файлы
+# путём file:// и читает их с диска сам.
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from rate_limiter import TokenBucket
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+# Методы, которые загружают файл и возвращают его file_id
+MEDIA_FIELDS = {
+    "sendPhoto": "photo",
+    "sendVoice": "voice",
+    "sendDocument": "document",
+    "sendAudio": "audio",
+}
+
+
+class Keyboard:
+    """Сообщение с inline-кнопками, которое увидел бы пользователь"""
+    __slots__ = ("message_id", "buttons", "received")
+
+    def __init__(self, message_id: int, buttons: List[str]):
+        self.message_id = message_id
+        self.buttons = buttons
+        self.received = time.perf_counter()
+
+
+class FakeBotApi:
+    """Поддельный api.telegram.org; скорость лимитов и 429 умножается на speedup"""
+
+    def __init__(
+        self,
+        latency: float = 0.03,
+        jitter: float = 0.01,
+        bandwidth: float = 2_000_000,     # байт/с при загрузке файлов
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        group_rate: float = 20 / 60,
+        overall_rate: float = 30,
+        speedup: float = 1,
+        local: bool = False,
+    ):
+        self.local = local
+        self.latency = latency / speedup
+        self.jitter = jitter / speedup
+        self.bandwidth = bandwidth * speedup
+        self._chat_limits = (chat_rate * speedup, chat_burst)
+        self._group_limits = (group_rate * speedup, chat_burst)
+        self._overall = TokenBucket(overall_rate * speedup, overall_rate * speedup)
+        self._chats: Dict[str, TokenBucket] = {}
+        self._ids = itertools.count(1)
+        self._keyboards: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+
+        self.calls: Counter = Counter()
+        self.chat_calls: Counter = Counter()   # chat_id (строкой) -> вызовы; без chat_id не считаются
+        self.request_bytes = 0
+        self.upload_bytes = 0
+        self.uploads = 0
+        self.local_uploads = 0         # из них путём file://
+        self.local_bytes = 0
+        self.retry_after = 0
+
+    def reset_stats(self) -> None:
+        self.calls.clear()
+        self.chat_calls.clear()
+        self.request_bytes = self.upload_bytes = self.uploads = self.retry_after = 0
+        self.local_uploads = self.local_bytes = 0
+
+    async def next_keyboard(self, chat_id: int, timeout: float = 60) -> Keyboard:
+        return await asyncio.wait_for(self._keyboards[chat_id].get(), timeout)
+
+    # ---- Лимиты ----
+
+    def _limited(self, chat_id: Optional[str]) -> float:
+        """Через сколько секунд можно повторить; 0 — запрос проходит"""
+        buckets = [self._overall]
+        if chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                rate, burst = self._group_limits if chat_id.startswith("-") else self._chat_limits
+                bucket = self._chats[chat_id] = TokenBucket(rate, burst)
+            buckets.append(bucket)
+        delay = max(b.delay() for b in buckets)
+        if delay > 0:
+            return delay
+        for b in buckets:
+            b.take()
+        return 0
+
+    # ---- Ответы ----
+
+    def _message(self, chat_id: str, **fields) -> Dict[str, Any]:
+        chat_id = int(chat_id)
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+        }
+        message.update(fields)
+        return message
+
+    def _file(self, value: Optional[str], files: Dict[str, Any]) -> str:
+        """file_id для поля запроса: новый для загруженного файла, тот же для file_id"""
+        if value and value.startswith("attach://"):
+            value = value[len("attach://"):]
+        if value in files or value is None:
+            self.uploads += 1
+            return f"file{next(self._ids)}"
+        if value.startswith("file://"):
+            self.uploads += 1
+            self.local_uploads += 1
+            return f"file{next(self._ids)}"
+        return value
+
+    def _local_files(self, params: Dict[str, str]) -> Tuple[List[Path], Optional[str]]:
+        """Файлы file:// из параметров (и из media альбома); вторым — ошибка, если есть"""
+        uris = [u for v in params.values() for u in re.findall(r'file://[^"\s]+', v)]
+        if uris and not self.local:
+            return [], "Bad Request: file URIs are supported only by a local Bot API server"
+        paths = [Path(unquote(urlparse(u).path)) for u in uris]
+        for path in paths:
+            if not path.is_file():
+                return [], f"Bad Request: file {path} not found"
+        return paths, None
+
+    def _media(self, kind: str, file_id: str) -> Any:
+        unique = file_id[-16:]
+        if kind == "photo":
+            return [{"file_id": file_id, "file_unique_id": unique, "width": 1280, "height": 960}]
+        if kind == "voice":
+            return {"file_id": file_id, "file_unique_id": unique, "duration": 60}
+        return {"file_id": file_id, "file_unique_id": unique}
+
+    def _record_keyboard(self, message: Dict[str, Any], reply_markup: Optional[str]) -> None:
+        if not reply_markup:
+            return
+        markup = json.loads(reply_markup)
+        buttons = [
+            b.get("callback_data") or ""
+            for row in markup.get("inline_keyboard", ())
+            for b in row
+        ]
+        self._keyboards[message["chat"]["id"]].put_nowait(Keyboard(message["message_id"], buttons))
+
+    def respond(self, method: str, params: Dict[str, str], files: Dict[str, Any]) -> Any:
+        chat_id = params.get("chat_id")
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            message = self._message(chat_id, text=params.get("text", ""))
+        elif method in MEDIA_FIELDS:
+            field = MEDIA_FIELDS[method]
+            file_id = self._file(params.get(field), files)
+            message = self._message(chat_id, **{field: self._media(field, file_id)})
+            if params.get("caption"):
+                message["caption"] = params["caption"]
+        elif method == "sendMediaGroup":
+            messages = []
+            for item in json.loads(params["media"]):
+                file_id = self._file(item.get("media"), files)
+                messages.append(self._message(chat_id, photo=self._media("photo", file_id)))
+            return messages
+        elif method == "editMessageReplyMarkup":
+            message = self._message(chat_id)
+            message["message_id"] = int(params.get("message_id", 0))
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook и прочее
+            return True
+        self._record_keyboard(message, params.get("reply_markup"))
+        return message
+
+    async def handle(self, method: str, params: Dict[str, str], files: Dict[str, Any],
+                     body_size: int) -> Tuple[int, Dict[str, Any]]:
+        self.calls[method] += 1
+        if params.get("chat_id"):
+            self.chat_calls[params["chat_id"]] += 1
+        self.request_bytes += body_size
+        upload = sum(len(f[0]["body"]) for f in files.values())
+        self.upload_bytes += upload
+        local_files, error = self._local_files(params)
+        if error:
+            return 400, {"ok": False, "error_code": 400, "description": error}
+        # Сервер сам загружает файл в Telegram и отвечает после этого
+        local = sum(p.stat().st_size for p in local_files)
+        self.local_bytes += local
+        upload += local
+
+        await asyncio.sleep(
+            self.latency + random.uniform(0, self.jitter) + upload / self.bandwidth
+        )
+        if method.startswith(("send", "edit", "copy", "forward")):
+            retry_after = self._limited(params.get("chat_id"))
+            if retry_after:
+                self.retry_after += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after:.3f}",
+                    "parameters": {"retry_after": retry_after},
+                }
+        return 200, {"ok": True, "result": self.respond(method, params, files)}
+
+
+class _Handler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotApi):
+        self.api = api
+
+    async def post(self, method: str):
+        params = {k: v[-1].decode() for k, v in self.request.body_arguments.items()}
+        if not params and self.request.body and \
+                self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = {k: v if isinstance(v, str) else json.dumps(v)
+                      for k, v in json.loads(self.request.body).items()}
+        status, payload = await self.api.handle(
+            method, params, self.request.files, len(self.request.body)
+        )
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(payload))
+
+    get = post
+
+
+def start_fake_api(api: FakeBotApi, port: int) -> HTTPServer:
+    """Слушает 127.0.0.1:port; base_url бота — http://127.0.0.1:port/bot"""
+    web_app = tornado.web.Application(
+        [(r"/bot[^/]+/(\w+)", _Handler, {"api": api})],
+        log_function=lambda handler: None,
+    )
+    server = HTTPServer(web_app, max_body_size=100 * 1024 * 1024)
+    server.listen(port, "127.0.0.1")
+    return server
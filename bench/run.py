@@ -0,0 +1,396 @@
+# bench/run.py — нагрузочный прогон бота против локального Bot API
+#
+#   python -m bench.run --walkers 50 [--speedup 100] [--latency 0.03] [--local] [--json out.json]
+#   python -m bench.run --walkers 200 --workers 4
+#
+# Каждый «пешеход» — отдельный чат: /start → «Начать экскурсию» → «Я тут» /
+# «Да» / «Следующая точка» по всем точкам до финального меню. Апдейты идут
+# через очередь приложения, как из webhook. Паузы доставки идут по
+# виртуальным часам, поэтому двухчасовой маршрут проходит за доли секунды;
+# лимиты Telegram (у бота и у поддельного API) ускоряются в speedup раз.
+#
+# С --workers N запускается кластер, как в `bot.py cluster`: входной процесс и
+# N процессов-обработчиков в отдельных процессах, а пешеходы шлют апдейты
+# в webhook входного процесса. Отчёт дополняется пропускной способностью
+# каждого обработчика.
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.fake_api import FakeBotApi, start_fake_api
+
+BENCH_CHAT_BASE = 10_000
+
+
+class VirtualClock:
+    """Паузы не ждут, а только сдвигают виртуальное время"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = 0
+
+    async def sleep(self, seconds: float) -> None:
+        self.now += seconds
+        self.sleeps += 1
+        await asyncio.sleep(0)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Walker:
+    def __init__(self, bot_module, app, api: FakeBotApi, chat_id: int, latencies: Dict[str, List[float]]):
+        self.bot = bot_module
+        self.app = app
+        self.api = api
+        self.chat_id = chat_id
+        self.latencies = latencies
+        self.user = {"id": chat_id, "is_bot": False, "first_name": "walker"}
+        self.chat = {"id": chat_id, "type": "private"}
+        self.steps = 0
+
+    async def _push(self, data: dict) -> None:
+        data["update_id"] = next(_update_ids)
+        await self.app.update_queue.put(self.bot.Update.de_json(data, self.app.bot))
+
+    async def command(self, text: str) -> None:
+        await self._push({"message": {
+            "message_id": 1, "date": int(time.time()), "chat": self.chat, "from": self.user,
+            "text": text, "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        }})
+
+    async def tap(self, message_id: int, data: str) -> None:
+        await self._push({"callback_query": {
+            "id": str(next(_update_ids)), "chat_instance": "bench", "from": self.user, "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": self.chat},
+        }})
+
+    async def step(self, name: str, action) -> "object":
+        started = time.perf_counter()
+        await action
+        keyboard = await self.api.next_keyboard(self.chat_id)
+        self.latencies[name].append(keyboard.received - started)
+        self.steps += 1
+        return keyboard
+
+    async def walk(self) -> None:
+        b = self.bot
+        keyboard = await self.step("start", self.command("/start"))
+        while True:
+            first = next((d for d in keyboard.buttons if d), "")
+            if b.CB_RESTART in keyboard.buttons:
+                return  # финальное меню
+            action = b.decode_callback(first).action
+            name = {
+                b.CB_START_TOUR: "start_tour",
+                b.ACTION_IM_HERE: "im_here",
+                b.ACTION_YES: "yes",
+                b.ACTION_NEXT: "next",
+            }.get(action)
+            if name is None:
+                raise RuntimeError(f"Неожиданная клавиатура: {keyboard.buttons}")
+            keyboard = await self.step(name, self.tap(keyboard.message_id, first))
+
+
+class ClusterWalker(Walker):
+    """Пешеход, чьи апдейты приходят в webhook входного процесса, как от Telegram"""
+
+    def __init__(self, bot_module, client: httpx.AsyncClient, url: str, api: FakeBotApi,
+                 chat_id: int, latencies: Dict[str, List[float]]):
+        super().__init__(bot_module, None, api, chat_id, latencies)
+        self.client = client
+        self.url = url
+
+    async def _push(self, data: dict) -> None:
+        data["update_id"] = next(_update_ids)
+        response = await self.client.post(
+            self.url, json=data, headers={"X-Telegram-Bot-Api-Secret-Token": self.bot.WEBHOOK_SECRET}
+        )
+        response.raise_for_status()
+
+
+_update_ids = iter(range(1, 1 << 62))
+
+
+def configure(args, cluster: bool = False) -> str:
+    """Окружение для bot: он читает его при импорте, поэтому настраиваем заранее.
+    Процессы кластера наследуют его уже готовым."""
+    data_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("TELEGRAM_TOKEN", "1:bench")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.pop("WARMUP_CHAT_ID", None)
+    base = f"http://127.0.0.1:{args.port}"
+    if args.local or cluster:
+        # Как свой сервер Bot API в режиме --local: файлы уходят путём на диске.
+        # Процессы кластера находят поддельный API только через BOT_API_URL
+        os.environ["BOT_API_URL"] = base
+        os.environ["BOT_API_LOCAL"] = "1" if args.local else "0"
+    if cluster:
+        os.environ["PORT"] = str(args.port + 1)
+        os.environ["WORKER_BASE_PORT"] = str(args.port + 2)
+    for name, default in (("SEND_RATE_OVERALL", 30), ("SEND_RATE_PER_CHAT", 1), ("SEND_RATE_PER_GROUP", 20 / 60)):
+        os.environ[name] = str(float(os.getenv(name, default)) * args.speedup)
+    return base
+
+
+def summarize(args, walkers: List[Walker], results: list, latencies: Dict[str, List[float]],
+              api: FakeBotApi, elapsed: float, retry_after_seen: int) -> dict:
+    failed = [r for r in results if isinstance(r, BaseException)]
+    completed = max(1, len(walkers) - len(failed))
+    steps = sum(w.steps for w in walkers)
+    all_latencies = [v for values in latencies.values() for v in values]
+    return {
+        "walkers": len(walkers),
+        "failed": len(failed),
+        "errors": sorted({repr(e) for e in failed})[:5],
+        "speedup": args.speedup,
+        "wall_seconds": elapsed,
+        "steps": steps,
+        "steps_per_second": steps / elapsed if elapsed else 0.0,
+        "api_calls_per_second": sum(api.calls.values()) / elapsed if elapsed else 0.0,
+        "latency": {
+            name: {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p90": percentile(values, 0.9),
+                "p99": percentile(values, 0.99),
+                "max": max(values),
+            }
+            for name, values in sorted({**latencies, "all": all_latencies}.items()) if values
+        },
+        "calls_per_walk": {m: n / completed for m, n in sorted(api.calls.items())},
+        "api_calls_per_walk": sum(api.calls.values()) / completed,
+        "request_bytes_per_walk": api.request_bytes / completed,
+        "upload_bytes_per_walk": api.upload_bytes / completed,
+        "uploads": api.uploads,
+        "local_uploads": api.local_uploads,
+        "retry_after_returned": api.retry_after,
+        "retry_after_seen": retry_after_seen,
+    }
+
+
+async def run(args) -> dict:
+    base = configure(args)
+
+    import bot as bot_module
+    from telegram.ext import ApplicationBuilder
+
+    clock = VirtualClock()
+    bot_module.pause = clock.sleep
+    bot_module.load_tour()
+
+    api = FakeBotApi(latency=args.latency, jitter=args.latency / 3, speedup=args.speedup, local=args.local)
+    server = start_fake_api(api, args.port)
+    app = bot_module.build_application(
+        ApplicationBuilder().base_url(f"{base}/bot").base_file_url(f"{base}/file/bot")
+    )
+    await app.initialize()
+    await bot_module.post_init(app)
+    await app.start()
+    api.reset_stats()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    walkers = [
+        Walker(bot_module, app, api, BENCH_CHAT_BASE + i, latencies) for i in range(args.walkers)
+    ]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(w.walk() for w in walkers), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await app.shutdown()
+    await bot_module.post_shutdown(app)
+    server.stop()
+
+    result = summarize(args, walkers, results, latencies, api, elapsed,
+                       bot_module.SEND_SCHEDULER.retry_after_count)
+    completed = max(1, result["walkers"] - result["failed"])
+    result["virtual_pause_seconds_per_walk"] = clock.now / completed
+    return result
+
+
+def spawn(role: str, args, port: Optional[int] = None) -> subprocess.Popen:
+    command = [sys.executable, "-m", "bench.run", "--serve", role, "--workers", str(args.workers)]
+    if port is not None:
+        command += ["--serve-port", str(port)]
+    return subprocess.Popen(command)
+
+
+async def wait_ready(client: httpx.AsyncClient, procs: List[subprocess.Popen], ports: List[int],
+                     timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    for proc, port in zip(procs, ports):
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Процесс на порту {port} завершился с кодом {proc.returncode}")
+            try:
+                if (await client.get(f"http://127.0.0.1:{port}/healthz")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Процесс на порту {port} не ответил за {timeout:g} с")
+            await asyncio.sleep(0.1)
+
+
+async def scrape_counter(client: httpx.AsyncClient, port: int, name: str) -> int:
+    """Значение счётчика без меток из /metrics процесса; 0, если его нет"""
+    try:
+        text = (await client.get(f"http://127.0.0.1:{port}/metrics")).text
+    except httpx.HTTPError:
+        return 0
+    match = re.search(rf"^{name} (\S+)$", text, re.MULTILINE)
+    return int(float(match.group(1))) if match else 0
+
+
+async def run_workers(args) -> dict:
+    configure(args, cluster=True)
+
+    import bot as bot_module
+    from cluster import worker_for
+
+    api = FakeBotApi(latency=args.latency, jitter=args.latency / 3, speedup=args.speedup, local=args.local)
+    server = start_fake_api(api, args.port)
+    ingress_port = bot_module.PORT
+    worker_ports = [bot_module.WORKER_BASE_PORT + i for i in range(args.workers)]
+    procs = [spawn("worker", args, port) for port in worker_ports]
+    procs.append(spawn("ingress", args))
+    client = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=None))
+    try:
+        await wait_ready(client, procs, worker_ports + [ingress_port])
+        api.reset_stats()
+
+        latencies = [defaultdict(list) for _ in worker_ports]
+        walkers = []
+        for i in range(args.walkers):
+            chat_id = BENCH_CHAT_BASE + i
+            walkers.append(ClusterWalker(
+                bot_module, client, f"http://127.0.0.1:{ingress_port}/webhook", api,
+                chat_id, latencies[worker_for(chat_id, args.workers)],
+            ))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(w.walk() for w in walkers), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        retry_after = [await scrape_counter(client, port, "bot_retry_after_total") for port in worker_ports]
+    finally:
+        await client.aclose()
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        server.stop()
+
+    merged: Dict[str, List[float]] = defaultdict(list)
+    for per_worker in latencies:
+        for name, values in per_worker.items():
+            merged[name].extend(values)
+    result = summarize(args, walkers, results, merged, api, elapsed, sum(retry_after))
+    result["workers"] = []
+    for idx, port in enumerate(worker_ports):
+        own = [(w, r) for w, r in zip(walkers, results) if worker_for(w.chat_id, args.workers) == idx]
+        steps = sum(w.steps for w, _ in own)
+        calls = sum(api.chat_calls[str(w.chat_id)] for w, _ in own)
+        values = [v for values in latencies[idx].values() for v in values]
+        result["workers"].append({
+            "port": port,
+            "walkers": len(own),
+            "failed": sum(isinstance(r, BaseException) for _, r in own),
+            "steps": steps,
+            "steps_per_second": steps / elapsed if elapsed else 0.0,
+            "api_calls": calls,
+            "api_calls_per_second": calls / elapsed if elapsed else 0.0,
+            "p50": percentile(values, 0.5),
+            "p90": percentile(values, 0.9),
+            "retry_after_seen": retry_after[idx],
+        })
+    return result
+
+
+def serve(args) -> None:
+    """Процесс кластера, запущенный run_workers; окружение уже настроено"""
+    import bot as bot_module
+
+    if args.serve == "ingress":
+        ports = [bot_module.WORKER_BASE_PORT + i for i in range(args.workers)]
+        asyncio.run(bot_module.run_ingress(ports))
+        return
+    bot_module.pause = VirtualClock().sleep
+    bot_module.load_tour()
+    asyncio.run(bot_module.run_worker(args.serve_port, args.workers))
+
+
+def print_report(r: dict) -> None:
+    print(f"Пешеходов: {r['walkers']} (ошибок: {r['failed']}), ускорение лимитов ×{r['speedup']:g}")
+    for e in r["errors"]:
+        print(f"  ошибка: {e}")
+    print(f"Время: {r['wall_seconds']:.2f} с, шагов: {r['steps']} "
+          f"({r['steps_per_second']:.1f}/с), вызовов API: {r['api_calls_per_second']:.1f}/с")
+    print("Задержка шага (нажатие → следующая клавиатура), мс:")
+    for name, s in r["latency"].items():
+        print(f"  {name:>10}: n={s['count']:<6} p50={s['p50'] * 1000:8.1f} p90={s['p90'] * 1000:8.1f} "
+              f"p99={s['p99'] * 1000:8.1f} max={s['max'] * 1000:8.1f}")
+    print(f"На одну прогулку: {r['api_calls_per_walk']:.1f} вызовов API, "
+          f"{r['request_bytes_per_walk'] / 1024:.0f} КБ запросов, "
+          f"из них файлов {r['upload_bytes_per_walk'] / 1024:.0f} КБ")
+    for method, n in r["calls_per_walk"].items():
+        print(f"  {method:>22}: {n:.1f}")
+    print(f"Загрузок файлов: {r['uploads']} (путём на диске: {r['local_uploads']}), "
+          f"429 от API: {r['retry_after_returned']}, "
+          f"повторов после RetryAfter: {r['retry_after_seen']}")
+    if "virtual_pause_seconds_per_walk" in r:
+        print(f"Виртуальные паузы на прогулку: {r['virtual_pause_seconds_per_walk'] / 60:.1f} мин")
+    if "workers" in r:
+        print(f"Процессов-обработчиков: {len(r['workers'])}, всего {r['steps_per_second']:.1f} шагов/с, "
+              f"{r['api_calls_per_second']:.1f} вызовов API/с")
+        for idx, w in enumerate(r["workers"]):
+            print(f"  #{idx} (порт {w['port']}): пешеходов {w['walkers']} (ошибок: {w['failed']}), "
+                  f"{w['steps_per_second']:.1f} шагов/с, {w['api_calls_per_second']:.1f} вызовов API/с, "
+                  f"шаг p50={w['p50'] * 1000:.1f} p90={w['p90'] * 1000:.1f} мс, "
+                  f"повторов после RetryAfter: {w['retry_after_seen']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против локального Bot API")
+    parser.add_argument("--walkers", type=int, default=50)
+    parser.add_argument("--speedup", type=float, default=100, help="во сколько раз ускорить лимиты Telegram")
+    parser.add_argument("--latency", type=float, default=0.03, help="задержка ответа API, с (до ускорения)")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--local", action="store_true", help="как свой сервер Bot API: файлы путём file://")
+    parser.add_argument("--json", help="записать результат в файл")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="запустить входной процесс и столько процессов-обработчиков")
+    # Роль процесса кластера, который запускает сам прогон
+    parser.add_argument("--serve", choices=("ingress", "worker"), help=argparse.SUPPRESS)
+    parser.add_argument("--serve-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    result = asyncio.run(run_workers(args) if args.workers else run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,75 @@
 # bot_webhook.py — версия для webhook (Render) с 9 локациями
+import time
+# Начало отсчёта времени запуска (см. BOOT ниже)
+_BOOT_STARTED = time.perf_counter()
+
 from pathlib import Path
-from typing import Set, List, Optional
+from typing import Dict, Set, List, Optional, Mapping, Tuple
+from functools import lru_cache
+from types import MappingProxyType
 
 from telegram import (
+    Bot,
+    Chat,
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     InputMediaPhoto,
 )
+from telegram.error import BadRequest, Forbidden, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
+    ApplicationHandlerStop,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
 
 import os
+import sys
+import json
+import hashlib
+import signal
 import asyncio
+import argparse
+import logging
+from collections import OrderedDict
+from functools import partial
 from dotenv import load_dotenv
 
+from delivery import Op, format_ops, media_op, pause_op, text_op
+from delivery_journal import Cursor, DeliveryJournal
+from entities import MarkupError
+import httpx
+import metrics
+import webhook
+from analytics import EventLog
+from api_request import MeteredRequest, PooledRequest
+from asset_store import AssetStore
+from broadcast import BroadcastDb, Broadcaster, format_status
+from callbacks import decode_callback, encode_callback
+from content import Content, ContentError, content_version, parse_content
+from tour import CompiledTour, Keyboards, compile_tour, point_fence
+from geofence import Arrivals, GridIndex, LocationGate
+from group_tour import GroupDb, normalize_code
+from asset_manifest import (
+    LOW_DATA,
+    STANDARD,
+    AssetInfo,
+    DerivedAsset,
+    describe_asset,
+    load_derived_manifest,
+    update_manifest,
+)
+from media_cache import AssetKey, FileIdCache
+from metrics import BOOT, Counter, FuncMetric, Histogram, LoopLagMonitor
+from rate_limiter import SendScheduler
+from session_store import SessionStore, SqliteSessionBackend
+from update_processor import ChatOrderedUpdateProcessor
+
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
@@ -28,261 +77,154 @@ if not TELEGRAM_TOKEN:
 
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://long-time.onrender.com")
 PORT = int(os.getenv("PORT", 8080))
-
-# ---- Контент ----
-PROJECT_NAME = "СПб: Женские истории репрессий"
-
-WELCOME_TEXT = (
-    "Готовы ли вы услышать и сохранить в истории их голоса?"
+# Секрет, который Telegram присылает в заголовке каждого webhook-запроса;
+# по умолчанию выводится из токена, чтобы совпадать во всех процессах
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TELEGRAM_TOKEN.encode()).hexdigest()
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+# Служебный чат, куда при старте заранее загружаются все файлы (необязательно)
+WARMUP_CHAT_ID = os.getenv("WARMUP_CHAT_ID")
+# Первый порт процессов-обработчиков в режиме cluster
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", PORT + 1))
+# Сколько апдейтов (из разных чатов) обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", 1024))
+# Как часто (в секундах) изменившиеся сессии сбрасываются на диск
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", 2))
+# Как часто (в секундах) курсоры доставки точек сбрасываются на диск; после
+# падения процесса шаги за последний интервал уйдут повторно
+DELIVERY_JOURNAL_INTERVAL = float(os.getenv("DELIVERY_JOURNAL_INTERVAL", 0.5))
+# Доставку, прерванную раньше этого (секунды), перезапуск не продолжает
+DELIVERY_RESUME_MAX_AGE = float(os.getenv("DELIVERY_RESUME_MAX_AGE", 3600))
+# Лимиты Telegram на отправку сообщений (в секунду)
+SEND_RATE_OVERALL = float(os.getenv("SEND_RATE_OVERALL", 30))
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", 1))
+SEND_RATE_PER_GROUP = float(os.getenv("SEND_RATE_PER_GROUP", 20 / 60))
+# Скорость рассылки /broadcast на процесс: ниже общего лимита, чтобы прогулкам
+# оставался запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 20))
+# Токен для /debug/tasks и /debug/profile; без него отладочные страницы выключены
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+# Как часто (в секундах) дёргать Bot API, чтобы соединения не закрылись за простой
+KEEP_WARM_INTERVAL = float(os.getenv("KEEP_WARM_INTERVAL", 30))
+# Сколько соединений с Bot API открыть сразу после запуска
+WARM_CONNECTIONS = int(os.getenv("WARM_CONNECTIONS", 4))
+# Пул коротких запросов к Bot API: ответы на нажатия, тексты, клавиатуры
+CONTROL_POOL_SIZE = int(os.getenv("CONTROL_POOL_SIZE", 128))
+CONTROL_TIMEOUT = float(os.getenv("CONTROL_TIMEOUT", 5))
+# Пул загрузок файлов: меньше соединений, дольше таймауты
+UPLOAD_POOL_SIZE = int(os.getenv("UPLOAD_POOL_SIZE", 8))
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", 60))
+# Свой сервер Bot API (telegram-bot-api) вместо api.telegram.org, например
+# http://127.0.0.1:8081. В режиме --local (BOT_API_LOCAL, по умолчанию вместе
+# с BOT_API_URL) файлы из assets отправляются путём на диске: сервер на той же
+# машине читает их сам, бот не кодирует и не передаёт байты
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+BOT_API_LOCAL = os.getenv("BOT_API_LOCAL", "1" if BOT_API_URL else "0") == "1"
+# Предел размера загружаемого файла: у своего сервера в режиме --local он больше
+UPLOAD_LIMIT = (2000 if BOT_API_LOCAL else 50) * 1024 * 1024
+# Сколько байт мелких файлов держать в памяти и с какого размера файл отображается через mmap
+ASSET_STORE_BUDGET = int(os.getenv("ASSET_STORE_BUDGET", 32 * 1024 * 1024))
+ASSET_MMAP_THRESHOLD = int(os.getenv("ASSET_MMAP_THRESHOLD", 1024 * 1024))
+
+logger = logging.getLogger(__name__)
+
+BOOT.restart(_BOOT_STARTED)
+BOOT.mark("imports")
+
+# ---- Метрики (/metrics) ----
+CALLBACK_SECONDS = Histogram(
+    "bot_callback_seconds", "Обработка нажатия кнопки вместе с доставкой", ("handler",)
 )
-
-ABOUT_TEXT = (
-    "📍 *О проекте*\n\n"
-    "Этот маршрут создан, чтобы напомнить о женщинах, чьи истории были стёрты репрессиями. "
-    "Мы проходим мимо этих мест каждый день, но редко задумываемся о том, что здесь происходило.\n\n"
-    "Маршрут включает 9 домов в Санкт-Петербурге.\n\n"
-    "Команда проекта «Это было давно»"
+POINT_DELIVERY_SECONDS = Histogram(
+    "bot_point_delivery_seconds", "Доставка части точки", ("part", "point")
 )
-
-HELP_TEXT = (
-    "ℹ️ *Как пользоваться ботом:*\n\n"
-    "• *Начать экскурсию* — бот проведёт вас последовательно по 9 точкам\n"
-    "• *Карта маршрута* — посмотрите все точки на карте\n"
-    "• *О проекте* — узнайте больше о замысле\n"
-    "• *Обратная связь* — поделитесь впечатлениями\n\n"
-    "Команды: /start, /menu, /help"
+MEDIA_SENDS = Counter(
+    "bot_media_sends_total", "Отправки файлов: по file_id, с загрузкой, устаревший file_id", ("kind", "via")
 )
-
-FINAL_MESSAGE = (
-    "Спасибо, что прошли маршрут. 🙏\n\n"
-    "Память держится на конкретных историях.\n\n"
-    "💬 *Поделитесь впечатлениями* — нам важно ваше мнение."
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("error",))
+GROUP_SENDS = Counter(
+    "bot_group_sends_total", "Отправки участникам групповых экскурсий: sent, blocked, failed", ("result",)
 )
-
-FINAL_TEXT = (
-    "Спасибо большое, что были с нами, мы будем очень рады фидбеку. "
-    "Также мы собрали для вас дополнительные материалы и тексты писем, которые зачитывали."
+DELIVERIES_RESUMED = Counter(
+    "bot_deliveries_resumed_total", "Доставки, продолженные после перезапуска", ("result",)
 )
-
-ASSETS = Path("assets")
-MAP_IMAGE = ASSETS / "map.jpg"
-MAP_CAPTION = (
-    "🗺️ *Карта маршрута*\n\n"
-    "9 точек памяти в Санкт-Петербурге. "
-    "Вы можете начать с первой — бот проведёт вас шаг за шагом."
+GROUP_FANOUT_SECONDS = Histogram(
+    "bot_group_fanout_seconds", "Отправка одного сообщения гида всем участникам группы",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
 )
+# Значения ниже считываются из живых объектов в момент запроса
+FuncMetric("bot_sessions_active", "Чаты, чьё состояние загружено в память",
+           lambda: SESSION_STORE.active)
+FuncMetric("bot_deliveries_in_progress", "Доставки частей маршрута с курсором в журнале",
+           lambda: JOURNAL.active)
+FuncMetric("bot_delivery_journal_writes_total", "Пакетные записи журнала доставки на диск",
+           lambda: JOURNAL.writes, type="counter")
+FuncMetric("bot_updates_running", "Апдейты, которые обрабатываются сейчас",
+           lambda: UPDATE_PROCESSOR.active)
+FuncMetric("bot_updates_pending", "Апдейты в обработке и в очередях чатов",
+           lambda: UPDATE_PROCESSOR.pending)
+FuncMetric("bot_duplicate_taps_total", "Повторные нажатия, пропущенные во время доставки",
+           lambda: UPDATE_PROCESSOR.duplicates, type="counter")
+FuncMetric("bot_cancelled_updates_total", "Доставки, прерванные переходом в меню",
+           lambda: UPDATE_PROCESSOR.cancelled, type="counter")
+FuncMetric("bot_send_queue_depth", "Запросы, ждущие лимита отправки",
+           lambda: SEND_SCHEDULER.queue_depth)
+FuncMetric("bot_retry_after_total", "Ответы RetryAfter от Telegram",
+           lambda: SEND_SCHEDULER.retry_after_count, type="counter")
+FuncMetric("bot_analytics_dropped_total", "События аналитики, вытесненные из переполненного буфера",
+           lambda: ANALYTICS.dropped, type="counter")
+FuncMetric("bot_webhook_duplicates_total", "Повторные апдейты от Telegram, отброшенные на входе",
+           lambda: WEBHOOK_RECENT.duplicates, type="counter")
+FuncMetric("bot_location_updates_total", "Апдейты геопозиции, дошедшие до обработчика",
+           lambda: LOCATION_GATE.passed, type="counter")
+FuncMetric("bot_location_throttled_total", "Апдейты трансляции, отброшенные по частоте",
+           lambda: LOCATION_GATE.throttled, type="counter")
+FuncMetric("bot_location_far_total", "Апдейты трансляции вдали от всех точек",
+           lambda: LOCATION_GATE.far, type="counter")
+FuncMetric("bot_geofence_arrivals_total", "Точки, открытые по геопозиции",
+           lambda: ARRIVALS.triggered, type="counter")
+FuncMetric("bot_asset_store_hits_total", "Загрузки файлов, байты которых уже были в памяти",
+           lambda: ASSET_STORE.hits, type="counter")
+FuncMetric("bot_asset_store_misses_total", "Загрузки файлов, прочитанных с диска",
+           lambda: ASSET_STORE.misses, type="counter")
+FuncMetric("bot_asset_store_hit_ratio", "Доля загрузок без чтения с диска",
+           lambda: ASSET_STORE.hit_rate)
+FuncMetric("bot_asset_store_resident_bytes", "Байты мелких файлов в памяти процесса",
+           lambda: ASSET_STORE.resident_bytes)
+FuncMetric("bot_asset_store_mapped_bytes", "Байты крупных файлов, отображённых в память",
+           lambda: ASSET_STORE.mapped_bytes)
+FuncMetric("bot_broadcast_sent_total", "Сообщения рассылки, доставленные в чаты",
+           lambda: BROADCASTS.sent, type="counter")
+FuncMetric("bot_broadcast_blocked_total", "Чаты, исключённые из рассылок: бот заблокирован или чат удалён",
+           lambda: BROADCASTS.blocked, type="counter")
+FuncMetric("bot_broadcast_failed_total", "Сообщения рассылки, не отправленные по другим причинам",
+           lambda: BROADCASTS.failed, type="counter")
 
-# Приветственные аудио
-AUDIO1 = ASSETS / "audio1.ogg"
-AUDIO2 = ASSETS / "audio2.ogg"
-
-# Финальные файлы
-FINAL_AUDIO = ASSETS / "final_audio.ogg"
-FINAL_MATERIALS = ASSETS / "final_materials.pdf"
-
-# ---- Структура точек маршрута ----
-POINTS = [
-    # ===== ЛОКАЦИЯ 1 (БЕЗ навигации, с двумя аудио) =====
-    {
-        "photo": ASSETS / "loc1_photo.jpg",
-        "texts": [
-            "Ленинград. Лето 1937 года. Это было давно.\n\n"
-            "Историческая справка — начало «Большого террора» - приказ НКВД № 00447 — установление категорий мер наказания.\n\n"
-            "Из приказа. Все репрессируемые кулаки, уголовники и др. антисоветские элементы разбиваются на две категории:\n"
-            "а) к первой категории относятся все наиболее враждебные из перечисленных выше элементов. Они подлежат немедленному аресту и РАССТРЕЛУ.\n"
-            "б) ко второй категории относятся все остальные менее активные, но все же враждебные элементы. Они подлежат аресту и заключению в лагеря на срок от 8 до 10 лет.",
-            
-            "«Реквием» Анны Ахматовой был написан в 1935-1940-е годы, период террора. Это поэма о скорби, о личной трагедии Анны Ахматовой, о трагедии каждой женщины.\n\n"
-            "В августе 1921 году по обвинению в «контрреволюционной деятельности» был арестован и расстрелян первый муж писательницы, Гумилев Николай Степанович. 30 сентября 1991 года посмертно реабилитирован, установлено, что уголовное дело было полностью сфальсифицировано.\n\n"
-            "В октябре 1935 год был совершен первый арест сына Анны Ахматовой, Льва Николаевича Гумилева, дело было прекращено в том же году. В сентябре 1938 году Лев Гумилев был осужден по обвинению в контрреволюционной террористической деятельности на 10 лет исправительно-трудового лагеря, срок сокращен до 5 лет ИТЛ. Последний арест Льва Гумилева произошел в ноябре 1949 года, за антисоветскую агитацию и террористические намерения он был осужден на 10 лет исправительно- трудовой деятельности.\n\n"
-            "Анна Ахматова провела 17 месяцев своей жизни в тюремных очередях, рядом с такими же матерями, женами и дочерьми.",
-        ],
-        "audio1": ASSETS / "loc1_audio1.ogg",
-        "audio1_description": "🎧 «Реквием» Анны Ахматовой (часть 1)",
-        "audio2": ASSETS / "loc1_audio2.ogg",
-        "audio2_description": "🎧 «Реквием» Анны Ахматовой (часть 2)",
-    },
-    
-    # ===== ЛОКАЦИЯ 2 =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – Виленский переулок, 5\n",
-        "nav_photo": ASSETS / "loc2_nav.jpg",
-        "transition_text": "Пока вы идете на следующую локацию, предлагаем вам послушать аудио",
-        "transition_audio": ASSETS / "transition_1to2.ogg",
-        "photo": ASSETS / "loc2_photo.jpg",
-        "texts": [
-            "Габбе Тамара Юрьевна\n\n",
-            "Родилась 3/16 марта 1903 года в Петрограде. Тамара Григорьевна училась в Выборгской женской гимназии, где изучала иностранные языки.\n\n"
-            "В 1924 году Тамара поступила на литературный факультет Ленинградского института истории искусств, где зимой 1924–1925 года произошло её знакомство со студентками Лидией Чуковской, Александрой Любарской и Зоей Задунайской. Начавшаяся тогда дружба продолжалась всю их жизнь.", 
-
-            "После окончания института в 1930 году, Тамара некоторое время работала учительницей, затем перешла на работу редактором в детский отдел госиздата, которым руководил Маршак.\n\n"
-            "Габбе Тамара была арестована весной 1937 года, когда ленинградская редакция Детского издательства была объявлена контрреволюционной группой Маршака, обвинена во вредительстве в детской литературе и расформирована.\n\n" 
-            "Тогда же уволили Чуковскую и Задунайскую, а осенью арестовали и Любарскую.",
-
-            "Супруг Тамары, Гинзбург Иосиф Израилевич,  и друзья добивались освобождения Тамары Григорьевны. Самуил Яковлевич Маршак бросился на ее освобождение. Маршак даже ездил в Москву к прокурору СССР Андрею Вышинскому.\n\n" 
-            "Эти хлопоты неожиданно завершились удачей – Габбе и Любарская вышли на свободу в конце декабря 1937 года.\n\n"
-            "Относительно спокойная  жизнь продолжалась 4 года. Весной 1941 года Гинзбург Иосиф Израилевич был арестован после доноса сослуживца. Он был осужден на пять лет, погиб летом 1945, так и не покинув заключения",
-        ],
-        "audio": ASSETS / "loc2_audio.ogg",
-        "audio_description": "🎧 История Тамары Габбе",
-    },
-    
-    # ===== ЛОКАЦИЯ 3 (с кнопкой "узнать больше") =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – 8-я Советская, 4\n",
-        "nav_photo": ASSETS / "loc3_nav.jpg",
-        "photo": ASSETS / "loc3_photo.jpg",
-        "texts": [
-            "Маторина Нина Михайловна\n\n"
-            "8 Советская 42 – адрес, где жила с мужем и тремя дочерьми Маторина Нина Михайловна до ареста в 1936 году.", 
-
-            "Нина Михайловна Маторина родилась в 1904 году в родовой усадьбе Первитино Тверской губернии в дворянской семье Хвостовых-Маториных.\n\n"
-            "Получила среднее образование, окончила курсы Гороно по подготовке педагогов дошкольников. Работала управляющей делами «Кооптруда» и Ленпищепромсоюза, секретарем райисполкома на станции Плюсса. В 1924 году вступила в ВКП(б).",
-
-            "В 1935 году после ареста брата, этнографа Николая Маторина, Нину исключили из партии за сокрытие дворянского происхождения и «связи с оппозиционерами».\n\n"
-            "В 1936 году она была арестована и осуждена на пять лет лагерей за «контрреволюционную троцкистскую деятельность». Срок отбывала на Соловках, где работала в свинарнике Троицкого скита на острове Анзер.", 
-
-            "Осенью 1937 года Маторину вместе с другими заключёнными вывезли на материк; 2 ноября она была расстреляна в урочище Сандармох (Карелия). В 1956 году реабилитирована за отсутствием состава преступления.",
-        ],
-        "audio": ASSETS / "loc3_audio.ogg",
-        "audio_description": "🎧 История Нины Маториной",
-    },
-    
-    # ===== ЛОКАЦИЯ 4 (БЕЗ АУДИО) =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – 4-я Советская, 8\n",
-        "nav_photo": ASSETS / "loc4_nav.jpg",
-        "transition_text": "Пока вы идете на следующую локацию, предлагаем вам послушать аудио",
-        "transition_audio": ASSETS / "transition_3to4.ogg",
-        "photo": ASSETS / "loc4_photo.jpg",
-        "texts": [
-            "Мительман Роза Яковлевна\n"
-            "В 1930-х годах в этом доме проживала семья – Мительман Роза Яковлевна с супругом Пинес Дмитрием Михайловичем. Роза Мительман работала врачом Института охраны материнства и младенчества в Ленинграде.", 
- 
-            "Зимой 1937 года в Архангельске было сфабриковано дело о «контрреволюционной эсеровской организации», по которому арестовали 16 человек, включая Дмитрия Пинеса.\n\n"
-            "17 апреля того же года задержали его жену, Розу Мительман, обвинив в связях с «эсеровским террористическим центром» во время приездов к сосланному мужу.",
-
-            "Семью расстреляли в один день – 27 октября 1937 года.", 
-
-            "В 1956 году при пересмотре дела было установлено, что дело было сфальсифицировано младшим лейтенантом Семеновым и никакой эсеровской организации в Архангельске не существовало. Дмитрий Пинес и Роза Мительман были реабилитированы.",
-        ],
-        "audio": None,
-        "audio_description": None,
-    },
-    
-    # ===== ЛОКАЦИЯ 5 (БЕЗ АУДИО, БЕЗ ФОТО ГЕРОИНИ) =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – Поварской пер., 3\n",
-        "nav_photo": ASSETS / "loc5_nav.jpg",
-        "photo": None,
-        "texts": [
-            "Беляева Любовь Сергеевна\n\n"
-            "(К сожалению, в архивах не сохранилось фотографии Любови.)", 
- 
-            "В этом доме в квартире № 20 жила до ареста 39-летняя Любовь Сергеевна Беляева.\n\n"
-            "Любовь Сергеевна родилась в Риге в 1898 году. Получила среднее образование. К моменту ареста была домохозяйкой.",
-
-            "Любовь Сергеевну Беляеву арестовали 3 декабря 1937 года по обвинению в шпионаже (ст. 58-6 УК РСФСР).\n\n"
-            "Ее дело рассматривалось в рамках одной из национальных операций НКВД и не проходило полноценного следствия — в Москву отправили лишь краткую справку. 30 декабря 1937 года Беляеву приговорили к расстрелу, приговор исполнили 5 января 1938 года в Ленинграде.", 
-
-            "В 1989 году она была реабилитирована решением Военной прокуратуры Ленинградского округа.",
-        ],
-        "audio": None,
-        "audio_description": None,
-    },
-    
-    # ===== ЛОКАЦИЯ 6 (с двумя аудио и кнопкой) =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – Загородный проспект, 11\n",
-        "nav_photo": ASSETS / "loc6_nav.jpg",
-        "photo": ASSETS / "loc6_photo.jpg",
-        "texts": [
-            "Чуковская Лидия Корнеевна\n\n" 
-            "Лидия Чуковская родилась 11/24 марта 1907 года в Петербурге в семье писателей Корнея Чуковского.\n\n"
-            "Лидия Корнеевна получила прекрасное образование в частной женской гимназии Таганцевой, позднее в 15-ой единой трудовой школе, а затем она поступила и окончила отделение курсов при Институте истории искусств.\n\n"
-            " Благодаря литературной деятельности отца, Чуковская с юности была знакома с выдающимися деятелями культуры: Ахматовой Мандельштамом, Блоком, Гумилёвым и другими.",
-            
-            "Летом 1926 года Лидия была арестована по подозрению в составлении антисоветской листовки, по приговору "
-            "суду была сослана в Саратов.\n\n"
-            "В 1933 она находит замуж за Матвея Бронштейна, физика-теоретика, занимавшегося научной деятельностью и популяризацией науки.\n\n"
-            "В начале 1935 года органы вызвали Лидию Корнееву с требованием и угпузы за досрочное освобождение на ссылку стать сотрудницей НКВД, несмотря угрозы, она не согласилась.",
-            
-            "В августе 1937 года был арестован Матвей Бронштейн. С ордером на арест Лидии Чуковской приходили на"
-            "Загородный проспект 11, но ей удалось скрыться.",
-        ],
-        "audio": ASSETS / "loc6_audio.ogg",
-        "audio_description": "🎧 История Лидии Чуковской",
-        "extra_audio": ASSETS / "loc6_voice.ogg",
-        "extra_audio_description": "🎧 Голос Лидии Чуковской",
-    },
-    
-    # ===== ЛОКАЦИЯ 7 (Мулло) =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – Загородный проспект 24",
-        "nav_photo": ASSETS / "nav_6to7.jpg",
-        "photo": ASSETS / "loc7_photo.jpg",
-        "texts": [
-            "Мулло Елизавета Ивановна\n\n"
-            "Елизавета Ивановна Мулло родилась в 1902 году в Новой деревне в большой семье финнов Анны Ивановны и Ивана Ивановича Мулло. Елизавета была старшей дочерью в семье, у нее было четыре сестры и четыре брата.\n\n"
-            "Несмотря на то, что родители были крестьянами, Елизавета Ивановна получила высшее образование. Она окончила Педагогический институт им. Герцена по специальности «педагог» и с 1923 года работала в школе № 16 Володарского района Ленинграда.",
-            
-            "Из анкеты арестованной следует, что Елизавета Ивановна воспитывала сына Альберта, которому к моменту ее ареста было всего три года.\n\n"
-            "В начале учебного года 5 сентября 1937 года Елизавета Ивановна была арестована ленинградским НКВД.\n\n"
-            "Ее обвинили в «шпионаже, антисоветской пропаганде и организованной контрреволюционной деятельности». Комиссией НКВД и прокуратуры СССР 10 ноября 1937 года она была приговорена к расстрелу и 15 ноября 1937 года расстреляна в Ленинграде. Ей было 35 лет.\n\n"
-            "Елизавета Ивановна Мулло была реабилитирована в 1989 году.",
-        ],
-        "audio": None,
-    },
-    
-    # ===== ЛОКАЦИЯ 8 (Одинцова) =====
-    {
-        "navigation": "📍 Теперь вам нужно добраться сюда – Загородный проспект, 28",
-        "nav_photo": ASSETS / "nav_7to8.jpg",
-        "transition_text": "Пока вы идете на следующую локацию, предлагаем вам послушать аудио:",
-        "transition_audio": ASSETS / "transition_7to8.ogg",
-        "photo": ASSETS / "loc8_photo.jpg",
-        "texts": [
-            "Одинцова Елена Андреевна\n\n"
-            "В квартире по этому адресу проживала большая семья Дитерихс-Одинцовых.\n\n"
-            "Воспоминания Ирины Кирилловны Одинцовой, дочери Елены Андреевной: «Моя мама была домохозяйкой и воспитывала меня. Мама рисовала, сама искусно изготавливала кукол, шила им платья, мастерила им шляпки из соломки и продавала, чтобы подработать»",
-            
-            "Елена Андреевна Одинцова была арестована в Ленинграде 26 октября 1937 года как член Российского общевоинского союза. Эту организацию, никогда не существовавшую, придумали сотрудники НКВД.\n\n"
-            "Елену Андреевну расстреляли 8 января 1938 года по так называемому списку № 2 шпионов – членов Российского общевоинского союза. В предписании на расстрел ее имя значится 41-м из 50 приговоренных к высшей мере наказания.\n\n"
-            "Помимо Елены Андреевны, четыре члена семьи Дитерихс-Одинцовых были убиты во времена советского государственного террора: Андрей Павлович Дитерихс, Дмитрий Павлович Дитерихс, Павел Андреевич Дитерихс, Кирилл Сергеевич Одинцов.\n\n"
-            "Дела членов семьи были пересмотрены по всем приговорам – вся семья Дитерихс (Одинцовых) была полностью реабилитирована.",
-        ],
-        "audio": None,
-        "optional_audio": ASSETS / "loc8_audio.ogg",
-        "optional_question": "Хотели бы вы услышать воспоминания дочери Елены Одинцовой об аресте мамы?",
-    },
-    
-    # ===== ЛОКАЦИЯ 9 (Любарская) =====
-    {
-        "navigation": "📍 Теперь тебе нужно добраться сюда – Набережная реки Фонтанки, 78",
-        "nav_photo": ASSETS / "nav_8to9.jpg",
-        "photo": ASSETS / "loc9_photo.jpg",
-        "texts": [
-            "Любарская Александра Иосифовна\n\n"
-            "Александра Иосифовна родилась в 1908 году в Ленинграде. В 1924 году окончила Петроградскую 10-ю Единую Трудовую школу имени Лидии Даниловны Лентовской, в этот же год поступила на Высшие государственные курсы искусствоведения, которые окончила в 1930-м году и получила звание литературоведа.\n\n"
-            "В Леногизе начала работать в 1930 году редактором детского отдела, возглавляемого С.Я. Маршаком. Этот отдел позднее развился в издательство – Ленинградское отделение Детгиза.\n\n"
-            "В 1935-1937 годах многие сотрудники редакции были арестованы, включая Александру Любарскую и Тамару Габбе.",
-            
-            "Александра Иосифовна была арестована 5 сентября 1937 г. и внесена в список № 10 «Харбинцы» с ходатайством о высшей мере наказания как участнице «троцкистской шпионской группы, связанной с японской разведкой».\n\n"
-            "Комиссией НКВД и Прокуратуры СССР 3 декабря 1937 г. принято решение предать Любарскую суду Военной коллегии Верховного суда СССР. Дело готовили для рассмотрения Военным трибуналом ЛВО, затем Особым совещанием при НКВД СССР.\n\n"
-            "Благодаря упорству Любарской и ее заявлениям в Прокуратуру о действиях следователя П. А. Слепнева осуждение не состоялось. Благодаря заступничеству К. И. Чуковского и С. Я. Маршака в декабре 1938 г. Александара Иосифовна была освобождена 14 января 1939 г.\n\n"
-            "Александра Любарская в своих воспоминаниях \"За тюремной стеной\" описала опыт нахождения в Большом Доме. Так называли здание Управления НКВД на Литейном проспекте, 4. Писательница провела в нем почти полтора года. В воспоминаниях она рассказывала не только о своем опыты, но и опыте своих сокамерниц.",
-        ],
-        "audio": None,
-        "optional_audio": ASSETS / "loc9_audio.ogg",
-        "optional_question": "Хотели бы вы услышать отрывок из воспоминаний Александры Любарской?",
-    },
-]
+# ---- Контент ----
+PROJECT_NAME = "СПб: Женские истории репрессий"
+
+ASSETS = Path("assets")
+# Облегчённые копии файлов (python build_assets.py); без них отправляются исходники
+ASSETS_BUILD = Path(os.getenv("ASSETS_BUILD_DIR", ASSETS / "build"))
+# Тексты и точки маршрута (пути к файлам — относительно ASSETS); см. content.py
+TOUR_FILE = Path(os.getenv("TOUR_FILE", "tour.json"))
+# Как часто проверять, не изменился ли файл маршрута (0 — только по /reload)
+TOUR_RELOAD_INTERVAL = float(os.getenv("TOUR_RELOAD_INTERVAL", 5))
+# Сколько прошлых версий маршрута держать для сессий, начатых на них
+TOUR_VERSIONS_KEPT = int(os.getenv("TOUR_VERSIONS_KEPT", 8))
+# Кто может вызывать служебные команды (/reload): user_id через запятую
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+# Радиус зоны точки по умолчанию (в tour.json — points[].location.radius), метры
+GEOFENCE_RADIUS = float(os.getenv("GEOFENCE_RADIUS", 60))
+# Трансляция геопозиции учитывается не чаще раза в столько секунд на чат
+LOCATION_MIN_INTERVAL = float(os.getenv("LOCATION_MIN_INTERVAL", 3))
 
 # ---- callback_data для кнопок ----
 CB_START_TOUR = "start_tour"
 CB_SHOW_MAP = "show_map"
 CB_ABOUT = "about"
 CB_FEEDBACK = "feedback"
+CB_LOW_DATA = "low_data"
 
 CB_IM_HERE = "im_here"
 CB_NEXT = "nav_next"
@@ -296,20 +238,56 @@ CB_SKIP_AUDIO = "skip_audio_no"
 CB_HEAR_VOICE_YES = "hear_voice_yes"
 CB_HEAR_VOICE_NO = "hear_voice_no"
 
+CB_LEAVE_GROUP = "leave_group"
+
+# Кнопки точек кодируют действие, номер точки и версию контента:
+# "h:3:1a2b3c" — «Я тут» на точке 4. Так нажатие не зависит от состояния
+# сессии, а кнопки прошлой версии маршрута отклоняются.
+# Константы CB_IM_HERE, CB_NEXT, ... выше остаются для старых сообщений.
+ACTION_IM_HERE = "h"
+ACTION_YES = "y"
+ACTION_NEXT = "n"
+
+STALE_BUTTON_TEXT = "Маршрут обновился. Откройте главное меню: /menu"
+LIVE_LOCATION_TEXT = (
+    "📍 Вижу вашу геопозицию. Когда вы подойдёте к точке, рассказ начнётся сам — "
+    "кнопка «✅ Я тут» тоже работает."
+)
+
+GROUP_CREATED_TEXT = (
+    "👥 Группа создана. Код для участников: *{code}*\n"
+    "Участники отправляют боту /join {code}. Всё, что вы откроете на маршруте, "
+    "придёт и им. /leave — завершить групповую экскурсию."
+)
+GROUP_STATUS_TEXT = "👥 Ваша группа: код *{code}*, участников: {members}. /leave — завершить."
+GROUP_JOINED_TEXT = (
+    "👥 Вы присоединились к группе гида. Рассказ о точках будет приходить сюда сам, "
+    "кнопки нажимать не нужно."
+)
+GROUP_NOT_FOUND_TEXT = "Группа с таким кодом не найдена или уже завершилась. Проверьте код: /join КОД"
+GROUP_SOLO_TEXT = "🚶 Вы продолжаете прогулку самостоятельно — с того места, где сейчас группа."
+GROUP_FINISHED_TEXT = "👥 Гид завершил групповую экскурсию. Дальше можно идти самостоятельно."
+GROUP_NOT_MEMBER_TEXT = "Вы не в группе. Присоединиться к гиду: /join КОД"
+
 FEEDBACK_URL = "https://t.me/lisaleksa"
 
 # ---- Разметка кнопок ----
+# Клавиатуры неизменяемы, поэтому каждая строится один раз и переиспользуется
 
-def main_menu_inline() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def main_menu_inline(low_data: bool = False) -> InlineKeyboardMarkup:
+    low_data_text = "📉 Экономия трафика: вкл" if low_data else "📶 Экономия трафика: выкл"
     return InlineKeyboardMarkup(
         [
             [InlineKeyboardButton("▶️ Начать экскурсию", callback_data=CB_START_TOUR)],
             [InlineKeyboardButton("🗺️ Карта маршрута", callback_data=CB_SHOW_MAP)],
             [InlineKeyboardButton("ℹ️ О проекте", callback_data=CB_ABOUT)],
+            [InlineKeyboardButton(low_data_text, callback_data=CB_LOW_DATA)],
             [InlineKeyboardButton("💬 Обратная связь", url=FEEDBACK_URL)],
         ]
     )
 
+@lru_cache(maxsize=None)
 def help_menu_inline() -> InlineKeyboardMarkup:
     """Меню после приветствия"""
     return InlineKeyboardMarkup(
@@ -319,41 +297,45 @@ def help_menu_inline() -> InlineKeyboardMarkup:
         ]
     )
 
-def im_here_button() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def im_here_button(idx: int, version: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton("✅ Я тут", callback_data=CB_IM_HERE)],
+            [InlineKeyboardButton("✅ Я тут", callback_data=encode_callback(ACTION_IM_HERE, idx, version))],
             [InlineKeyboardButton("🗺️ Карта", callback_data=CB_BACK_TO_MAP)],
             [InlineKeyboardButton("🏠 Главное меню", callback_data=CB_BACK_TO_MENU)],
         ]
     )
 
-def want_more_buttons() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def prompt_buttons(idx: int, yes_label: str, no_label: str, version: str) -> InlineKeyboardMarkup:
+    """Кнопки вопроса точки: «да» — ветка с аудио, «нет» — следующая точка"""
     return InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton("✅ Да", callback_data=CB_WANT_MORE)],
-            [InlineKeyboardButton("➡️ Не сейчас", callback_data=CB_SKIP_AUDIO)],
+            [InlineKeyboardButton(yes_label, callback_data=encode_callback(ACTION_YES, idx, version))],
+            [InlineKeyboardButton(no_label, callback_data=encode_callback(ACTION_NEXT, idx, version))],
         ]
     )
 
-def hear_voice_buttons() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("✅ Да, хочу услышать", callback_data=CB_HEAR_VOICE_YES)],
-            [InlineKeyboardButton("➡️ Не сейчас", callback_data=CB_HEAR_VOICE_NO)],
-        ]
-    )
-
-def point_nav_inline(is_last: bool) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def point_nav_inline(idx: int, is_last: bool, version: str) -> InlineKeyboardMarkup:
     first_row_text = "✅ Завершить маршрут" if is_last else "Следующая точка →"
     return InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton(first_row_text, callback_data=CB_NEXT)],
+            [InlineKeyboardButton(first_row_text, callback_data=encode_callback(ACTION_NEXT, idx, version))],
             [InlineKeyboardButton("🗺️ Карта", callback_data=CB_BACK_TO_MAP)],
             [InlineKeyboardButton("🏠 Главное меню", callback_data=CB_BACK_TO_MENU)],
         ]
     )
 
+@lru_cache(maxsize=None)
+def group_member_inline() -> InlineKeyboardMarkup:
+    """Вместо кнопок точек у участников группы: точки открывает гид"""
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("🚶 Дальше самостоятельно", callback_data=CB_LEAVE_GROUP)]]
+    )
+
+@lru_cache(maxsize=None)
 def final_menu_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -363,482 +345,1435 @@ def final_menu_inline() -> InlineKeyboardMarkup:
         ]
     )
 
+# ---- Отправка файлов ----
+
+MEDIA_CACHE = FileIdCache(DATA_DIR / "media_cache.sqlite3")
+# Байты файлов для загрузок: первая отправка, устаревший file_id, облегчённые копии
+ASSET_STORE = AssetStore(ASSET_STORE_BUDGET, ASSET_MMAP_THRESHOLD)
+
+# Признаки ответа Telegram о том, что сохранённый file_id больше не действителен
+STALE_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file_id",
+    "file reference",
+    "wrong type of the web page content",
+    "failed to get http url content",
+)
+
+# Заполняются в load_manifest() при каждой загрузке маршрута
+ASSET_MANIFEST: Mapping[Path, AssetInfo] = MappingProxyType({})
+# variant -> {исходный файл: собранная копия}
+DERIVED_ASSETS: Mapping[str, Mapping[Path, DerivedAsset]] = MappingProxyType({})
+
+def _current_derived(sources: Mapping[Path, AssetInfo]) -> Mapping[str, Mapping[Path, DerivedAsset]]:
+    """Копии, собранные из текущих версий исходников; устаревшие не используются"""
+    result = {}
+    for variant, derived in load_derived_manifest(ASSETS_BUILD, ASSETS).items():
+        current = {}
+        for path, d in derived.items():
+            info = sources.get(path)
+            if info is not None and info.sha256 != d.source_sha256:
+                logger.warning("Копия %s устарела, запустите build_assets.py", d.path)
+                continue
+            current[path] = d
+        result[variant] = MappingProxyType(current)
+    return MappingProxyType(result)
+
+def load_manifest(content: Content) -> None:
+    """Дополняет манифест файлами версии маршрута; заново описываются только
+    новые и изменившиеся на диске файлы"""
+    global ASSET_MANIFEST, DERIVED_ASSETS
+    paths = list(content.asset_paths())
+    manifest = update_manifest(ASSET_MANIFEST, paths, MEDIA_CACHE.sha256)
+    for path in dict.fromkeys(paths):
+        if not manifest[path].exists:
+            logger.warning("Файл не найден: %s", path)
+        elif manifest[path].size > UPLOAD_LIMIT:
+            logger.warning("Файл %s больше предела загрузки (%s МБ)%s", path, UPLOAD_LIMIT >> 20,
+                           "" if BOT_API_LOCAL else "; без него можно через свой сервер Bot API (BOT_API_URL)")
+    derived = _current_derived(manifest)
+    derived_paths = [d.path for variant in derived.values() for d in variant.values()]
+    ASSET_MANIFEST = update_manifest(manifest, derived_paths, MEDIA_CACHE.sha256)
+    DERIVED_ASSETS = derived
+
+def asset_info(path: Path) -> AssetInfo:
+    info = ASSET_MANIFEST.get(path)
+    if info is None:
+        # Файл вне манифеста — описываем на месте
+        info = describe_asset(path)
+    return info
+
+def asset_exists(path: Optional[Path]) -> bool:
+    return bool(path) and asset_info(path).exists
+
+def resolve_asset(path: Path, low_data: bool = False) -> Tuple[Path, Optional[int]]:
+    """Файл, который реально отправляется: собранная копия нужного варианта
+    (или стандартная), иначе исходник; вторым значением — длительность голосового"""
+    for variant in ((LOW_DATA, STANDARD) if low_data else (STANDARD,)):
+        derived = DERIVED_ASSETS.get(variant, {}).get(path)
+        if derived and asset_exists(derived.path):
+            return derived.path, derived.duration
+    return path, None
+
+def upload_source(path: Path, attach: bool = False):
+    """Что передать в send_* вместо file_id: путь к файлу для своего сервера
+    Bot API в режиме --local, иначе байты из ASSET_STORE"""
+    if BOT_API_LOCAL:
+        return path.resolve()
+    return ASSET_STORE.input_file(path, attach=attach)
+
+def _message_file_id(message, kind: str) -> Optional[str]:
+    if kind == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    media = getattr(message, kind, None)
+    return media.file_id if media else None
+
+# Загрузки, которые идут сейчас: ключ файла -> future с его file_id (None —
+# загрузка не удалась). Остальные отправки того же файла ждут её, а не
+# загружают те же байты: в пик первые пешеходы приходят к точке одновременно
+UPLOADS_IN_FLIGHT: Dict[AssetKey, asyncio.Future] = {}
+
+async def _shared_file_id(key: AssetKey) -> Optional[str]:
+    """file_id из кэша; если файл сейчас загружает другая отправка — после неё"""
+    file_id = await MEDIA_CACHE.get(key)
+    while not file_id and key in UPLOADS_IN_FLIGHT:
+        # shield: отмена ждущего не отменяет общий future
+        file_id = await asyncio.shield(UPLOADS_IN_FLIGHT[key])
+    return file_id
+
+def _start_upload(key: AssetKey) -> Optional[asyncio.Future]:
+    """Отмечает загрузку файла; None — его уже загружает другая отправка"""
+    if key in UPLOADS_IN_FLIGHT:
+        return None
+    upload = UPLOADS_IN_FLIGHT[key] = asyncio.get_running_loop().create_future()
+    return upload
+
+def _finish_upload(key: AssetKey, upload: Optional[asyncio.Future], file_id: Optional[str]) -> None:
+    if upload is not None:
+        del UPLOADS_IN_FLIGHT[key]
+        upload.set_result(file_id)
+
+async def _send_cached(send, kind: str, path: Path, **kwargs):
+    info = asset_info(path)
+
+    # Второй круг — если сохранённый file_id устарел, а файл тем временем
+    # загружает другая отправка
+    for _ in range(2):
+        file_id = await _shared_file_id(info.key)
+        if not file_id:
+            break
+        try:
+            message = await send(file_id, **kwargs)
+            MEDIA_SENDS.inc(kind=kind, via="file_id")
+            return message
+        except BadRequest as e:
+            if not any(m in str(e).lower() for m in STALE_FILE_ID_ERRORS):
+                raise
+            MEDIA_SENDS.inc(kind=kind, via="stale")
+            await MEDIA_CACHE.invalidate(info.key)
+
+    upload, file_id = _start_upload(info.key), None
+    try:
+        message = await send(upload_source(path), **kwargs)
+        MEDIA_SENDS.inc(kind=kind, via="upload")
+        file_id = _message_file_id(message, kind)
+        if file_id:
+            await MEDIA_CACHE.put(info.key, file_id)
+        return message
+    finally:
+        _finish_upload(info.key, upload, file_id)
+
+async def send_asset(chat, kind: str, path: Path, low_data: bool = False, **kwargs):
+    """Отправляет файл из assets: сначала по сохранённому file_id, иначе загружает байты"""
+    path, duration = resolve_asset(path, low_data)
+    if kind == "voice" and duration:
+        kwargs.setdefault("duration", duration)
+    return await _send_cached(getattr(chat, f"send_{kind}"), kind, path, **kwargs)
+
+async def warm_up_assets(bot, chat_id) -> None:
+    """Загружает в служебный чат все файлы, для которых ещё нет file_id"""
+    for info in ASSET_MANIFEST.values():
+        if not info.exists or await MEDIA_CACHE.get(info.key):
+            continue
+        send = partial(getattr(bot, f"send_{info.kind}"), chat_id)
+        try:
+            await _send_cached(send, info.kind, info.path)
+        except Exception:
+            logger.exception("Не удалось заранее загрузить %s", info.path)
+
+# ---- Сессии ----
+
+# Ключи user_data, которые переживают перезапуск
+SESSION_KEYS = ("idx", "visited", "waiting_optional", "low_data", "version", "guiding")
+
+SESSION_STORE = SessionStore(
+    SqliteSessionBackend(DATA_DIR / "sessions.sqlite3"),
+    keys=SESSION_KEYS,
+    flush_interval=SESSION_FLUSH_INTERVAL,
+)
+
+# Курсоры доставок частей маршрута: после перезапуска доставка продолжается
+# со следующего шага (см. resume_deliveries). Сессии сбрасываются раньше
+# курсоров: продолженная доставка опирается на idx и visited, с которыми начата
+JOURNAL = DeliveryJournal(
+    DATA_DIR / "delivery_journal.sqlite3", DELIVERY_JOURNAL_INTERVAL, before_write=SESSION_STORE.flush
+)
+
+async def restore_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перед обработчиками: поднимает сохранённое состояние при первом апдейте чата"""
+    if update.effective_chat and context.user_data is not None:
+        await settle_resumed(update)
+        await SESSION_STORE.restore(update.effective_chat.id, context.user_data)
+
+async def remember_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """После обработчиков: помечает состояние чата для фоновой записи"""
+    if update.effective_chat and context.user_data is not None:
+        SESSION_STORE.mark_dirty(update.effective_chat.id, context.user_data)
+
 def _state(context: ContextTypes.DEFAULT_TYPE) -> dict:
     if "idx" not in context.user_data:
         context.user_data["idx"] = 0
-    if "visited" not in context.user_data:
-        context.user_data["visited"] = set()
+    if not isinstance(context.user_data.get("visited"), set):
+        # После восстановления из хранилища visited приходит списком
+        context.user_data["visited"] = set(context.user_data.get("visited") or ())
     if "waiting_optional" not in context.user_data:
         context.user_data["waiting_optional"] = False
     return context.user_data
 
-async def send_map(chat, reply_markup=None):
-    if MAP_IMAGE.exists():
-        with open(MAP_IMAGE, "rb") as f:
-            await chat.send_photo(
-                photo=f, 
-                caption=MAP_CAPTION,
-                parse_mode="Markdown",
-                reply_markup=reply_markup or main_menu_inline()
+def _low_data(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    return bool(context.user_data and context.user_data.get("low_data"))
+
+def _main_menu(context: ContextTypes.DEFAULT_TYPE) -> InlineKeyboardMarkup:
+    return main_menu_inline(_low_data(context))
+
+# ---- Аналитика ----
+
+# События прохождения: python analytics.py report
+ANALYTICS = EventLog(DATA_DIR / "analytics", salt=WEBHOOK_SECRET)
+
+# ---- Рассылка ----
+
+# Типы файлов, которые можно разослать ответом /broadcast на сообщение
+BROADCAST_KINDS = ("photo", "voice", "audio", "video", "animation", "document")
+
+async def send_broadcast(bot: Bot, chat_id: int, payload: dict):
+    """Одно сообщение рассылки; в планировщике отправки — низший приоритет"""
+    bulk = {"priority": "bulk"}
+    caption = payload.get("caption")
+    if "file_id" in payload:
+        send = getattr(bot, f"send_{payload['kind']}")
+        return await send(chat_id, payload["file_id"], caption=caption, rate_limit_args=bulk)
+    if "asset" in payload:
+        path, _ = resolve_asset(ASSETS / payload["asset"])
+        kind = asset_info(path).kind
+        send = partial(getattr(bot, f"send_{kind}"), chat_id, rate_limit_args=bulk)
+        return await _send_cached(send, kind, path, caption=caption)
+    return await bot.send_message(chat_id, payload["text"], rate_limit_args=bulk)
+
+# Таблицы рядом с сессиями: список чатов для рассылки пополняется из них
+BROADCASTS = Broadcaster(
+    BroadcastDb(DATA_DIR / "sessions.sqlite3"), send_broadcast, rate=BROADCAST_RATE,
+)
+# Продолжать ли прерванные рассылки при запуске; в кластере — только первый обработчик
+RESUME_BROADCASTS = True
+
+# ---- Экскурсии с гидом ----
+
+# Группы — в той же базе, что и сессии: гида и участников в кластере
+# обрабатывают разные процессы. Гид помнит код своей группы в user_data["guiding"].
+GROUPS = GroupDb(DATA_DIR / "sessions.sqlite3")
+
+# ---- Программа маршрута ----
+
+# Текущая версия маршрута и прошлые, на которых ещё могут идти сессии;
+# переключаются в load_tour() одним присваиванием
+CONTENT: Optional[Content] = None
+CURRENT_TOUR: Optional[CompiledTour] = None
+TOURS: "OrderedDict[str, CompiledTour]" = OrderedDict()
+
+def _intro_ops(content: Content) -> List[Op]:
+    ops = [text_op(content.texts["intro"]), pause_op(1)]
+    for audio in content.intro_audio:
+        if asset_exists(audio):
+            ops += [media_op("voice", audio), pause_op(1)]
+    ops.append(text_op(content.texts["welcome"], parse_mode="Markdown", reply_markup=help_menu_inline()))
+    return ops
+
+def _final_ops(content: Content) -> List[Op]:
+    ops: List[Op] = []
+
+    # 1. Финальное аудио
+    if asset_exists(content.final_audio):
+        ops += [
+            text_op("Наш маршрут подошел к завершению. Прослушайте финальные записи"),
+            pause_op(1),
+            media_op("voice", content.final_audio),
+            pause_op(1),
+        ]
+
+    # 2. Финальный текст
+    ops += [text_op(content.texts["final"], parse_mode="Markdown"), pause_op(1)]
+
+    # 3. Файл с материалами
+    if asset_exists(content.final_materials):
+        ops += [
+            media_op("document", content.final_materials, caption="📎 Дополнительные материалы и тексты писем"),
+            pause_op(1),
+        ]
+
+    # 4. Меню
+    ops.append(text_op("Команда проекта, это было давно!", reply_markup=final_menu_inline()))
+    return ops
+
+def compile_version(content: Content) -> CompiledTour:
+    version = content.version
+    keyboards = Keyboards(
+        im_here=lambda idx: im_here_button(idx, version),
+        nav=lambda idx, is_last: point_nav_inline(idx, is_last, version),
+        prompt=lambda idx, yes, no: prompt_buttons(idx, yes, no, version),
+    )
+    return CompiledTour(
+        version=version,
+        points=compile_tour(content.points, keyboards, asset_exists),
+        intro=tuple(format_ops(_intro_ops(content))),
+        final=tuple(format_ops(_final_ops(content))),
+        content=content,
+        fences=tuple(point_fence(p, GEOFENCE_RADIUS) for p in content.points),
+    )
+
+def _prepare_tour(force: bool = False) -> Optional[CompiledTour]:
+    """Читает и собирает TOUR_FILE, не переключая на него бота; читает файлы
+    с диска, поэтому во время работы вызывается в потоке (см. reload_tour).
+    Манифест дополняется сразу: прежние записи в нём остаются."""
+    raw = TOUR_FILE.read_bytes()
+    if CURRENT_TOUR is not None and not force and content_version(raw) == CURRENT_TOUR.version:
+        return None
+    content = parse_content(raw, ASSETS)
+    load_manifest(content)
+    try:
+        return compile_version(content)
+    except MarkupError as e:
+        raise ContentError(f"разметка: {e}") from None
+
+def _switch_tour(tour: CompiledTour) -> None:
+    global CONTENT, CURRENT_TOUR
+    TOURS[tour.version] = tour
+    TOURS.move_to_end(tour.version)
+    while len(TOURS) > max(TOUR_VERSIONS_KEPT, 1):
+        TOURS.popitem(last=False)
+    LOCATION_GATE.index = GridIndex(f for t in TOURS.values() for f in t.fences if f)
+    CONTENT, CURRENT_TOUR = tour.content, tour
+    logger.info("Маршрут %s: %s точек", tour.version, len(tour.points))
+
+def load_tour(force: bool = False) -> Optional[CompiledTour]:
+    """Читает TOUR_FILE и переключает бота на новую версию маршрута.
+    None — файл не изменился; ошибка в файле (ContentError, OSError) оставляет
+    в работе прежнюю версию."""
+    tour = _prepare_tour(force)
+    if tour is not None:
+        _switch_tour(tour)
+    return tour
+
+# Перезагрузки из /reload и watch_tour_file идут по одной
+RELOAD_LOCK = asyncio.Lock()
+
+async def reload_tour(force: bool = False) -> Optional[CompiledTour]:
+    """load_tour во время работы: чтение и хэширование файлов — в потоке,
+    чтобы не задерживать пешеходов; переключение — в цикле событий"""
+    async with RELOAD_LOCK:
+        tour = await asyncio.to_thread(_prepare_tour, force)
+        if tour is not None:
+            _switch_tour(tour)
+        return tour
+
+async def watch_tour_file():
+    """Перезагружает маршрут, когда файл на диске меняется"""
+    def stamp():
+        try:
+            st = TOUR_FILE.stat()
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return None
+
+    last = stamp()
+    while True:
+        await asyncio.sleep(TOUR_RELOAD_INTERVAL)
+        current = stamp()
+        if current is None or current == last:
+            continue
+        last = current
+        try:
+            await reload_tour()
+        except (ContentError, OSError) as e:
+            logger.error("Файл маршрута %s не загружен, работает версия %s: %s",
+                         TOUR_FILE, CURRENT_TOUR.version, e)
+
+# Трансляции геопозиции: отсев до разбора апдейта и вход в зоны точек
+LOCATION_GATE = LocationGate(LOCATION_MIN_INTERVAL)
+ARRIVALS = Arrivals()
+
+def _tour(context: ContextTypes.DEFAULT_TYPE) -> CompiledTour:
+    """Версия маршрута, на которой идёт сессия; если её уже нет — текущая"""
+    return TOURS.get(context.user_data.get("version")) or CURRENT_TOUR
+
+# ---- Доставка ----
+
+async def send_asset_group(chat, paths, caption=None, parse_mode=None, caption_entities=(),
+                           low_data: bool = False):
+    """Отправляет несколько фото одним альбомом, по возможности через file_id"""
+    infos = [asset_info(resolve_asset(p, low_data)[0]) for p in paths]
+
+    def build(cached: dict, uploaded: list):
+        media = []
+        for n, info in enumerate(infos):
+            file_id = cached.get(info.key)
+            if not file_id:
+                uploaded.append(info)
+            media.append(InputMediaPhoto(
+                file_id or upload_source(info.path, attach=True),
+                caption=caption if n == 0 else None,
+                parse_mode=parse_mode if n == 0 else None,
+                caption_entities=caption_entities if n == 0 and caption_entities else None,
+            ))
+        return media
+
+    for use_cache in (True, False):
+        cached: dict = {}
+        if use_cache:
+            # Фото, которые сейчас загружает другая отправка, уйдут по её file_id
+            for info in infos:
+                cached[info.key] = await _shared_file_id(info.key)
+        uploaded: list = []
+        media = build(cached, uploaded)
+        uploads: dict = {}
+        for info in uploaded:
+            if info.key not in uploads:
+                uploads[info.key] = _start_upload(info.key)
+        file_ids: dict = {}
+        try:
+            messages = await chat.send_media_group(media)
+        except BadRequest as e:
+            if not use_cache or not any(m in str(e).lower() for m in STALE_FILE_ID_ERRORS):
+                raise
+            for info in infos:
+                await MEDIA_CACHE.invalidate(info.key)
+            continue
+        else:
+            MEDIA_SENDS.inc(len(uploaded), kind="photo", via="upload")
+            MEDIA_SENDS.inc(len(infos) - len(uploaded), kind="photo", via="file_id")
+            for info, message in zip(infos, messages):
+                file_ids[info.key] = _message_file_id(message, "photo")
+                if file_ids[info.key]:
+                    await MEDIA_CACHE.put(info.key, file_ids[info.key])
+            return messages
+        finally:
+            for key, upload in uploads.items():
+                _finish_upload(key, upload, file_ids.get(key))
+
+# Чем выдерживаются паузы между сообщениями; bench/ подменяет виртуальными часами
+pause = asyncio.sleep
+
+async def send_op(chat, op: Op, low_data: bool = False):
+    """Одна отправка плана; возвращает отправленное сообщение (у альбома — список)"""
+    if op.kind == "text":
+        return await chat.send_message(
+            text=op.text,
+            parse_mode=op.parse_mode,
+            entities=op.entities or None,
+            reply_markup=op.reply_markup,
+        )
+    if op.kind == "media_group":
+        return await send_asset_group(
+            chat, op.paths, caption=op.text, parse_mode=op.parse_mode, caption_entities=op.entities,
+            low_data=low_data,
+        )
+    return await send_asset(
+        chat, op.kind, op.path,
+        low_data=low_data,
+        caption=op.text,
+        parse_mode=op.parse_mode,
+        caption_entities=op.entities or None,
+        reply_markup=op.reply_markup,
+    )
+
+async def deliver(chat, ops: List[Op], low_data: bool = False, start: int = 0, progress=None):
+    """Выполняет план доставки по порядку; low_data — облегчённые копии файлов.
+    start — с какого шага начать, progress(n) — вызывается, когда выполнены n шагов"""
+    for step in range(start, len(ops)):
+        op = ops[step]
+        if op.kind == "pause":
+            await pause(op.seconds)
+        else:
+            await send_op(chat, op, low_data)
+            if progress:
+                progress(step + 1)
+
+async def send_formatted(chat, op: Op, low_data: bool = False):
+    """Отправка вне программы маршрута (справка, карта): разметка через format_ops,
+    разбор каждого текста кэшируется, длинный текст делится на сообщения"""
+    await deliver(chat, format_ops([op]), low_data)
+
+def _member_markup(markup):
+    """Кнопки точек (с номером точки) ведут группу — участникам вместо них «дальше самостоятельно»"""
+    if markup is None:
+        return None
+    for row in markup.inline_keyboard:
+        for button in row:
+            if button.callback_data and decode_callback(button.callback_data).idx is not None:
+                return group_member_inline()
+    return markup
+
+def _member_send(op: Op, sent):
+    """Отправка участнику, собранная один раз по сообщению гида: файлы — по его file_id"""
+    markup = _member_markup(op.reply_markup)
+    if op.kind == "text":
+        return lambda chat: chat.send_message(
+            op.text, parse_mode=op.parse_mode, entities=op.entities or None, reply_markup=markup
+        )
+    if op.kind == "media_group":
+        media = [
+            InputMediaPhoto(
+                _message_file_id(message, "photo"),
+                caption=op.text if n == 0 else None,
+                parse_mode=op.parse_mode if n == 0 else None,
+                caption_entities=op.entities if n == 0 and op.entities else None,
             )
+            for n, message in enumerate(sent)
+        ]
+        return lambda chat: chat.send_media_group(media)
+    kind, file_id = op.kind, _message_file_id(sent, op.kind)
+    return lambda chat: getattr(chat, f"send_{kind}")(
+        file_id, caption=op.text, parse_mode=op.parse_mode, caption_entities=op.entities or None,
+        reply_markup=markup,
+    )
+
+async def _fan_out(send, members: List[Chat]) -> List[int]:
+    """Одна отправка всем участникам сразу (темп задаёт SEND_SCHEDULER);
+    возвращает тех, кто заблокировал бота"""
+    with GROUP_FANOUT_SECONDS.time():
+        results = await asyncio.gather(*(send(chat) for chat in members), return_exceptions=True)
+    gone = []
+    for chat, result in zip(members, results):
+        if not isinstance(result, Exception):
+            GROUP_SENDS.inc(result="sent")
+        elif isinstance(result, Forbidden):
+            GROUP_SENDS.inc(result="blocked")
+            gone.append(chat.id)
+        else:
+            GROUP_SENDS.inc(result="failed")
+            logger.warning("Участнику группы %s не отправлено: %s", chat.id, result)
+    return gone
+
+async def deliver_group(chat, member_ids: List[int], ops: List[Op], low_data: bool = False,
+                        start: int = 0, progress=None) -> List[int]:
+    """План доставки гиду и участникам группы в такт гиду.
+
+    Каждая отправка сначала уходит гиду (файл без file_id загружается один раз),
+    затем по file_id из его сообщения — всем участникам параллельно. Пока идёт
+    пауза гида, рассылается предыдущая отправка; порядок у участника тот же.
+    start и progress — как у deliver, шаги считаются по гиду.
+    Возвращает участников, которые заблокировали бота."""
+    members = [Chat(chat_id, Chat.PRIVATE) for chat_id in member_ids]
+    for member in members:
+        member.set_bot(chat.get_bot())
+    gone: List[int] = []
+    fanout: Optional[asyncio.Task] = None
+    try:
+        for step in range(start, len(ops)):
+            op = ops[step]
+            if op.kind == "pause":
+                await pause(op.seconds)
+                continue
+            sent = await send_op(chat, op, low_data)
+            if progress:
+                progress(step + 1)
+            if fanout is not None:
+                gone += await fanout
+            fanout = asyncio.create_task(_fan_out(_member_send(op, sent), members))
+        if fanout is not None:
+            gone += await fanout
+    finally:
+        if fanout is not None and not fanout.done():
+            fanout.cancel()
+    return gone
+
+async def deliver_journaled(chat, cursor: Cursor, ops: List[Op],
+                            state: Optional[dict] = None) -> Tuple[List[int], List[int]]:
+    """Доставка части маршрута с курсором в JOURNAL, с шага cursor.step; если
+    чат ведёт группу — и её участникам. Возвращает участников и тех из них,
+    кто заблокировал бота. Курсор удаляется и при ошибке, и при отмене
+    (переход в меню): продолжать после перезапуска нужно только доставки,
+    которые оборвала смерть процесса.
+    state — сессия чата, уже изменённая обработчиком: она попадёт на диск
+    не позже курсора, а не только после всей доставки (remember_session)."""
+    if state is not None:
+        SESSION_STORE.mark_dirty(chat.id, state)
+    JOURNAL.begin(chat.id, cursor)
+    progress = partial(JOURNAL.advance, chat.id)
+    try:
+        if cursor.group is None:
+            await deliver(chat, ops, cursor.low_data, cursor.step, progress)
+            return [], []
+        member_ids = await asyncio.to_thread(GROUPS.members, cursor.group)
+        gone = await deliver_group(chat, member_ids, ops, cursor.low_data, cursor.step, progress)
+        if gone:
+            await asyncio.to_thread(GROUPS.remove, gone)
+        return member_ids, gone
+    finally:
+        JOURNAL.finish(chat.id)
+
+async def deliver_tour(update: Update, context: ContextTypes.DEFAULT_TYPE, ops: List[Op], **fields):
+    """Часть маршрута в чат; если чат ведёт группу — и всем её участникам.
+    fields — поля события delivered в аналитике: part и номер точки p"""
+    chat = update.effective_chat
+    code = context.user_data.get("guiding")
+    cursor = Cursor(
+        _tour(context).version, fields["part"], fields.get("p", -1), low_data=_low_data(context), group=code
+    )
+    member_ids, gone = await deliver_journaled(chat, cursor, ops, context.user_data)
+    ANALYTICS.track("delivered", chat.id, **fields)
+    if code is None:
+        return
+    for chat_id in set(member_ids) - set(gone):
+        ANALYTICS.track("delivered", chat_id, group=True, **fields)
+    st = _state(context)
+    await asyncio.to_thread(GROUPS.progress, code, st.get("version"), int(st["idx"]), st["visited"])
+
+async def send_map(chat, reply_markup=None, low_data: bool = False):
+    if asset_exists(CONTENT.map_image):
+        await send_formatted(chat, media_op(
+            "photo", CONTENT.map_image,
+            caption=CONTENT.texts["map_caption"],
+            parse_mode="Markdown",
+            reply_markup=reply_markup or main_menu_inline(low_data)
+        ), low_data)
     else:
         await chat.send_message(
-            "⚠️ Карта пока не загружена (assets/map.jpg)",
-            reply_markup=reply_markup or main_menu_inline()
+            f"⚠️ Карта пока не загружена ({CONTENT.map_image})",
+            reply_markup=reply_markup or main_menu_inline(low_data)
         )
 
 async def send_point_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: int):
     """Отправляет адрес точки, навигационное фото (если есть) и кнопку 'Я тут'"""
-    if not (0 <= idx < len(POINTS)):
+    tour = _tour(context)
+    if not (0 <= idx < len(tour.points)):
         return
 
     st = _state(context)
     st["idx"] = idx
     st["waiting_optional"] = False
 
-    point = POINTS[idx]
-    chat = update.effective_chat
-
-    # СПЕЦИАЛЬНАЯ ЛОГИКА ДЛЯ ЛОКАЦИИ 1
-    if idx == 0:
+    program = tour.points[idx]
+    # К первой точке идти не нужно — сразу показываем содержимое
+    if program.navigation is None:
         await send_point_content(update, context)
         return
 
-    # ДЛЯ ОСТАЛЬНЫХ ЛОКАЦИЙ
-    progress = f"\n\n_Точка {idx + 1} из {len(POINTS)}_"
-
-    nav_photo = point.get("nav_photo")
-    navigation_text = point.get("navigation", "📍 Следующая точка")
-
-    # 1. Навигационное фото с адресом
-    if nav_photo and nav_photo.exists():
-        with open(nav_photo, "rb") as f:
-            await chat.send_photo(
-                photo=f,
-                caption=navigation_text + progress,
-                parse_mode="Markdown"
-            )
-    else:
-        await chat.send_message(
-            text=navigation_text + progress,
-            parse_mode="Markdown"
-        )
-
-    await asyncio.sleep(1)
-
-    # 2. Переходное аудио (если есть)
-    transition_text = point.get("transition_text")
-    transition_audio = point.get("transition_audio")
-
-    if transition_text:
-        await chat.send_message(text=transition_text)
-        await asyncio.sleep(1)
-
-    if transition_audio and transition_audio.exists():
-        with open(transition_audio, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
-
-    # 3. Кнопка "Я тут"
-    await chat.send_message(
-        "Дайте знать, когда доберетесь:",
-        reply_markup=im_here_button()
-    )
+    with POINT_DELIVERY_SECONDS.time(part="navigation", point=str(idx)):
+        await deliver_tour(update, context, program.navigation, part="navigation", p=idx)
 
 async def send_point_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
     st = _state(context)
     idx = int(st.get("idx", 0))
-    
-    if not (0 <= idx < len(POINTS)):
+    tour = _tour(context)
+
+    if not (0 <= idx < len(tour.points)):
         return
     
     visited: Set[int] = st["visited"]
     visited.add(idx)
 
-    point = POINTS[idx]
-    chat = update.effective_chat
-    
-    # СПЕЦИАЛЬНАЯ ЛОГИКА ДЛЯ ЛОКАЦИИ 1
-    if idx == 0:
-        photo_path = point.get("photo")
-        if photo_path and photo_path.exists():
-            with open(photo_path, "rb") as f:
-                await chat.send_photo(photo=f)
-            await asyncio.sleep(1)
-
-        texts = point.get("texts", [])
-        if len(texts) > 0:
-            await chat.send_message(text=texts[0], parse_mode="Markdown")
-            await asyncio.sleep(5)
-
-        audio1 = point.get("audio1")
-        audio1_desc = point.get("audio1_description")
-        if audio1 and audio1.exists():
-            with open(audio1, "rb") as f:
-                await chat.send_voice(voice=f)
-            await asyncio.sleep(1)
-            if audio1_desc:
-                await chat.send_message(text=audio1_desc, parse_mode="Markdown")
-                await asyncio.sleep(1)
-
-        if len(texts) > 1:
-            await chat.send_message(text=texts[1], parse_mode="Markdown")
-            await asyncio.sleep(1)
-
-        audio2 = point.get("audio2")
-        audio2_desc = point.get("audio2_description")
-        if audio2 and audio2.exists():
-            with open(audio2, "rb") as f:
-                await chat.send_voice(voice=f)
-            await asyncio.sleep(1)
-            if audio2_desc:
-                await chat.send_message(text=audio2_desc, parse_mode="Markdown")
-                await asyncio.sleep(1)
-
-        await chat.send_message(
-            "👇 Навигация:",
-            reply_markup=point_nav_inline(is_last=False)
-        )
-        return
-    
-    # СТАНДАРТНАЯ ЛОГИКА ДЛЯ ОСТАЛЬНЫХ ЛОКАЦИЙ
-
-    photo_path = point.get("photo")
-    if photo_path and photo_path.exists():
-        with open(photo_path, "rb") as f:
-            await chat.send_photo(photo=f)
-        await asyncio.sleep(1)
-    elif photo_path:
-        await chat.send_message(f"⚠️ Фото не найдено: {photo_path}")
-        await asyncio.sleep(5)
-
-    texts: List[str] = point.get("texts", [])
-    for text in texts:
-        await chat.send_message(text=text, parse_mode="Markdown")
-        await asyncio.sleep(1)
-
-    # Логика для локации 3 (узнать больше)
-    if idx == 2:
-        await chat.send_message(
-            "Хотели бы вы узнать больше об этой героине?\n\n"
-            "Эта информация может быть эмоционально тяжелой.",
-            reply_markup=want_more_buttons()
-        )
-        return
-
-    # Логика для локации 6 (голос Лидии)
-    if idx == 5:
-        audio_path = point.get("audio")
-        audio_desc = point.get("audio_description")
+    program = tour.points[idx]
+    st["waiting_optional"] = program.has_prompt
+    with POINT_DELIVERY_SECONDS.time(part="content", point=str(idx)):
+        await deliver_tour(update, context, program.content, part="content", p=idx)
 
-        if audio_path and audio_path.exists():
-            with open(audio_path, "rb") as f:
-                await chat.send_voice(voice=f)
-            await asyncio.sleep(1)
-            if audio_desc:
-                await chat.send_message(text=audio_desc, parse_mode="Markdown")
-                await asyncio.sleep(1)
+async def send_point_branch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ветка «да» после вопроса точки: дополнительное аудио и навигация"""
+    st = _state(context)
+    idx = int(st.get("idx", 0))
+    tour = _tour(context)
 
-        await chat.send_message(
-            "Хотите услышать ее голос?",
-            reply_markup=hear_voice_buttons()
-        )
+    if not (0 <= idx < len(tour.points)):
         return
 
-    # Обычное аудио
-    audio_path = point.get("audio")
-    audio_desc = point.get("audio_description")
-
-    if audio_path and audio_path.exists():
-        with open(audio_path, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+    st["waiting_optional"] = False
+    program = tour.points[idx]
+    if program.branch:
+        with POINT_DELIVERY_SECONDS.time(part="branch", point=str(idx)):
+            await deliver_tour(update, context, program.branch, part="branch", p=idx)
 
-        if audio_desc:
-            await chat.send_message(text=audio_desc, parse_mode="Markdown")
-            await asyncio.sleep(1)
-    elif audio_path:
-        await chat.send_message(f"⚠️ Аудио не найдено: {audio_path}")
-        await asyncio.sleep(1)
+async def send_next_point(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    st = _state(context)
+    idx = int(st.get("idx", 0))
+    st["waiting_optional"] = False
 
-    # Проверка на опциональное аудио (для локаций 8 и 9)
-    optional_audio = point.get("optional_audio")
-    optional_question = point.get("optional_question")
+    if idx >= len(_tour(context).points) - 1:
+        await send_final(update, context)
+    else:
+        await send_point_navigation(update, context, idx + 1)
 
-    if optional_audio and optional_question:
-        st["waiting_optional"] = True
-        await chat.send_message(
-            optional_question,
-            reply_markup=want_more_buttons()
-        )
-        return
+async def send_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет финальное сообщение с аудио, текстом и файлом"""
+    await deliver_tour(update, context, _tour(context).final, part="final")
 
-    # Навигация
-    is_last = (idx == len(POINTS) - 1)
-    if is_last:
-        await asyncio.sleep(5)  # Пауза 5 секунд перед финальным сообщением
-        nav_text = "Это была последняя точка нашего маршрута, но у нас еще есть, что рассказать"
-    else:
-        nav_text = "👇 Навигация:"
+async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ANALYTICS.track("start", update.effective_chat.id)
+    run_in_background(BROADCASTS.remember_chat(update.effective_chat.id))
+    cursor = Cursor(CURRENT_TOUR.version, "intro", -1, low_data=_low_data(context))
+    await deliver_journaled(update.effective_chat, cursor, CURRENT_TOUR.intro, context.user_data)
 
-    await chat.send_message(
-        nav_text,
-        reply_markup=point_nav_inline(is_last),
+async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "🏠 Главное меню:",
+        reply_markup=_main_menu(context)
     )
 
-async def send_point3_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Для локации 3 - старая логика"""
-    chat = update.effective_chat
-    point = POINTS[2]
-
-    audio_path = point.get("audio")
-    audio_desc = point.get("audio_description")
+async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_formatted(update.effective_chat, text_op(
+        CONTENT.texts["help"],
+        parse_mode="Markdown",
+        reply_markup=_main_menu(context)
+    ))
 
-    if audio_path and audio_path.exists():
-        with open(audio_path, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+def _is_admin(update: Update) -> bool:
+    return update.effective_user is not None and update.effective_user.id in ADMIN_IDS
 
-        if audio_desc:
-            await chat.send_message(text=audio_desc, parse_mode="Markdown")
-            await asyncio.sleep(1)
+async def cmd_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перечитывает файл маршрута без перезапуска (только для ADMIN_IDS)"""
+    if not _is_admin(update):
+        await on_text(update, context)
+        return
+    try:
+        tour = await reload_tour()
+    except (ContentError, OSError) as e:
+        await update.message.reply_text(f"⚠️ Маршрут не загружен, работает версия {CURRENT_TOUR.version}:\n{e}")
+        return
+    if tour is None:
+        await update.message.reply_text(f"Файл не изменился, версия {CURRENT_TOUR.version}")
     else:
-        await chat.send_message(f"⚠️ Аудио не найдено: {audio_path}")
-        await asyncio.sleep(1)
+        await update.message.reply_text(f"✅ Загружена версия {tour.version}: {len(tour.points)} точек")
 
-    await chat.send_message(
-        "👇 Навигация:",
-        reply_markup=point_nav_inline(is_last=False)
+BROADCAST_USAGE = (
+    "/broadcast текст — всем, кто нажимал /start\n"
+    "/broadcast подпись — ответом на фото, голосовое, аудио, видео или файл\n"
+    "/broadcast asset:файл подпись — файл из assets\n"
+    "/broadcast_status N, /broadcast_cancel N — ход рассылки и её отмена"
+)
+
+def _broadcast_payload(message) -> Optional[dict]:
+    """Что разослать: текст команды, файл из сообщения, на которое она отвечает, или файл из assets"""
+    parts = message.text.split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    reply = message.reply_to_message
+    if reply is not None:
+        for kind in BROADCAST_KINDS:
+            file_id = _message_file_id(reply, kind)
+            if file_id:
+                return {"kind": kind, "file_id": file_id, "caption": text or reply.caption}
+    if text.startswith("asset:"):
+        parts = text[len("asset:"):].split(maxsplit=1)
+        name = Path(parts[0]) if parts else Path()
+        if not parts or name.is_absolute() or ".." in name.parts or not asset_exists(ASSETS / name):
+            return None
+        return {"asset": name.as_posix(), "caption": parts[1] if len(parts) > 1 else None}
+    return {"text": text} if text else None
+
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Рассылка всем известным чатам (только для ADMIN_IDS)"""
+    if not _is_admin(update):
+        await on_text(update, context)
+        return
+    payload = _broadcast_payload(update.message)
+    if payload is None:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    # Образец уходит автору первым: файл из assets загружается один раз,
+    # дальше вся рассылка идёт по file_id
+    try:
+        await send_broadcast(context.bot, update.effective_chat.id, payload)
+    except TelegramError as e:
+        await update.message.reply_text(f"⚠️ Рассылка не запущена: {e}")
+        return
+    broadcast_id, recipients = await BROADCASTS.create(update.effective_chat.id, payload)
+    await update.message.reply_text(
+        f"Рассылка {broadcast_id} запущена, получателей: {recipients}.\n"
+        f"/broadcast_status {broadcast_id} — ход, /broadcast_cancel {broadcast_id} — отмена"
     )
 
-async def send_optional_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет опциональное аудио для локаций 8 и 9"""
-    st = _state(context)
-    idx = int(st.get("idx", 0))
+def _broadcast_id(context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+    try:
+        return int(context.args[0])
+    except (IndexError, ValueError):
+        return None
 
-    if not (0 <= idx < len(POINTS)):
+async def cmd_broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _is_admin(update):
+        await on_text(update, context)
         return
+    broadcast_id = _broadcast_id(context)
+    row = await BROADCASTS.status(broadcast_id) if broadcast_id is not None else None
+    await update.message.reply_text(format_status(row) if row else BROADCAST_USAGE)
 
-    point = POINTS[idx]
+async def cmd_broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _is_admin(update):
+        await on_text(update, context)
+        return
+    broadcast_id = _broadcast_id(context)
+    row = await BROADCASTS.status(broadcast_id) if broadcast_id is not None else None
+    if row is None:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    if row["status"] == "running":
+        await BROADCASTS.cancel(broadcast_id)
+        row = await BROADCASTS.status(broadcast_id)
+    await update.message.reply_text(format_status(row))
+
+# ---- Экскурсия с гидом: команды ----
+
+def _solo_markup(group: dict) -> InlineKeyboardMarkup:
+    """Кнопка, с которой участник продолжает с места группы"""
+    tour = TOURS.get(group["version"])
+    if tour is None:
+        return main_menu_inline()
+    idx = group["idx"]
+    if idx in group["visited"]:
+        return point_nav_inline(idx, idx == len(tour.points) - 1, tour.version)
+    return im_here_button(idx, tour.version)
+
+async def cmd_guide(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Создаёт группу (или показывает уже созданную): дальше нажатия гида ведут и участников"""
+    code = context.user_data.get("guiding")
+    group = await asyncio.to_thread(GROUPS.get, code) if code else None
+    if group is not None and group["closed_at"] is None:
+        members = await asyncio.to_thread(GROUPS.members, code)
+        await send_formatted(update.effective_chat, text_op(
+            GROUP_STATUS_TEXT.format(code=code, members=len(members)), parse_mode="Markdown"
+        ))
+        return
+    # Гид сам не может быть участником чужой группы
+    await asyncio.to_thread(GROUPS.leave, update.effective_chat.id)
+    code = await asyncio.to_thread(GROUPS.create, update.effective_chat.id)
+    context.user_data["guiding"] = code
+    ANALYTICS.track("group", update.effective_chat.id, a="create")
+    await send_formatted(update.effective_chat, text_op(
+        GROUP_CREATED_TEXT.format(code=code), parse_mode="Markdown", reply_markup=help_menu_inline()
+    ))
+
+async def cmd_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text(GROUP_NOT_FOUND_TEXT)
+        return
+    chat_id = update.effective_chat.id
+    if context.user_data.get("guiding"):
+        await _finish_group(context)
+    group = await asyncio.to_thread(GROUPS.join, normalize_code("".join(context.args)), chat_id)
+    if group is None:
+        await update.message.reply_text(GROUP_NOT_FOUND_TEXT)
+        return
+    ANALYTICS.track("group", chat_id, a="join")
+    await update.message.reply_text(GROUP_JOINED_TEXT, reply_markup=group_member_inline())
+
+async def _finish_group(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Гид завершает группу: участники получают кнопку, чтобы идти дальше самим"""
+    code = context.user_data.pop("guiding")
+    group = await asyncio.to_thread(GROUPS.get, code)
+    member_ids = await asyncio.to_thread(GROUPS.finish, code)
+    if group is None or not member_ids:
+        return
+    members = [Chat(chat_id, Chat.PRIVATE) for chat_id in member_ids]
+    for member in members:
+        member.set_bot(context.bot)
+    markup = _solo_markup(group)
+    await _fan_out(lambda chat: chat.send_message(GROUP_FINISHED_TEXT, reply_markup=markup), members)
+
+async def cmd_leave(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Участник выходит из группы и продолжает с того же места сам; гид — завершает группу"""
     chat = update.effective_chat
+    if context.user_data.get("guiding"):
+        await _finish_group(context)
+        ANALYTICS.track("group", chat.id, a="finish")
+        await chat.send_message("👥 Групповая экскурсия завершена.", reply_markup=_main_menu(context))
+        return
+    group = await asyncio.to_thread(GROUPS.leave, chat.id)
+    if group is None:
+        await chat.send_message(GROUP_NOT_MEMBER_TEXT, reply_markup=_main_menu(context))
+        return
+    ANALYTICS.track("group", chat.id, a="leave")
+    if group["version"] in TOURS:
+        st = _state(context)
+        st["version"] = group["version"]
+        st["idx"] = group["idx"]
+        st["visited"] = set(group["visited"])
+    await chat.send_message(GROUP_SOLO_TEXT, reply_markup=_solo_markup(group))
 
-    optional_audio = point.get("optional_audio")
+# ---- Обработчики кнопок ----
+# Каждый получает номер точки из callback_data (None — у кнопок меню
+# и у старых кнопок без номера, тогда берётся точка из сессии)
 
-    if optional_audio and optional_audio.exists():
-        with open(optional_audio, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+def _point_idx(context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]) -> int:
+    st = _state(context)
+    if idx is None:
+        return int(st.get("idx", 0))
+    st["idx"] = idx
+    return idx
 
-    st["waiting_optional"] = False
+async def on_start_tour(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    st = _state(context)
+    st["idx"] = 0
+    st["visited"] = set()
+    # Новая прогулка идёт по текущей версии маршрута до конца
+    st["version"] = CURRENT_TOUR.version
+    await send_point_navigation(update, context, 0)
+
+async def on_show_map(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    await send_map(
+        update.callback_query.message.chat, reply_markup=_main_menu(context), low_data=_low_data(context)
+    )
 
-    is_last = (idx == len(POINTS) - 1)
-    if is_last:
-        await asyncio.sleep(5)  # Пауза 5 секунд перед финальным сообщением
-        nav_text = "Это была последняя точка нашего маршрута, но у нас еще есть, что рассказать"
-    else:
-        nav_text = "👇 Навигация:"
+async def on_about(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    await send_formatted(update.callback_query.message.chat, text_op(
+        CONTENT.texts["about"],
+        parse_mode="Markdown",
+        reply_markup=_main_menu(context)
+    ))
 
-    await chat.send_message(
-        nav_text,
-        reply_markup=point_nav_inline(is_last),
+async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    await update.callback_query.message.reply_text(
+        "🏠 Главное меню:",
+        reply_markup=_main_menu(context)
     )
 
-async def send_point6_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat = update.effective_chat
-    point = POINTS[5]
+async def on_low_data(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    """Переключает облегчённые копии фото, аудио и PDF; кнопка меню показывает состояние"""
+    st = _state(context)
+    st["low_data"] = not st.get("low_data", False)
+    await update.callback_query.edit_message_reply_markup(_main_menu(context))
+
+async def on_leave_group(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    await cmd_leave(update, context)
+
+async def on_im_here(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    _point_idx(context, idx)
+    await send_point_content(update, context)
+
+async def on_yes(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    _point_idx(context, idx)
+    await send_point_branch(update, context)
+
+async def on_next(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: Optional[int]):
+    _point_idx(context, idx)
+    await send_next_point(update, context)
+
+CALLBACK_HANDLERS = {
+    CB_START_TOUR: on_start_tour,
+    CB_RESTART: on_start_tour,
+    CB_SHOW_MAP: on_show_map,
+    CB_BACK_TO_MAP: on_show_map,
+    CB_ABOUT: on_about,
+    CB_BACK_TO_MENU: on_menu,
+    CB_LOW_DATA: on_low_data,
+    CB_LEAVE_GROUP: on_leave_group,
+    ACTION_IM_HERE: on_im_here,
+    ACTION_YES: on_yes,
+    ACTION_NEXT: on_next,
+    # Кнопки из сообщений, отправленных до версионированных callback_data
+    CB_IM_HERE: on_im_here,
+    CB_WANT_MORE: on_yes,
+    CB_HEAR_VOICE_YES: on_yes,
+    CB_NEXT: on_next,
+    CB_SKIP_AUDIO: on_next,
+    CB_HEAR_VOICE_NO: on_next,
+}
 
-    extra_audio = point.get("extra_audio")
-    extra_desc = point.get("extra_audio_description")
+async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    cb = decode_callback(q.data)
 
-    if extra_audio and extra_audio.exists():
-        with open(extra_audio, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+    handler = CALLBACK_HANDLERS.get(cb.action)
+    if handler is None:
+        await q.answer()
+        return
+    if cb.version is not None:
+        if cb.version not in TOURS:
+            # Кнопка из версии маршрута, которой уже нет: не проигрываем точку заново
+            await q.answer(STALE_BUTTON_TEXT, show_alert=True)
+            return
+        context.user_data["version"] = cb.version
 
-        if extra_desc:
-            await chat.send_message(text=extra_desc, parse_mode="Markdown")
-            await asyncio.sleep(1)
-    else:
-        await chat.send_message(f"⚠️ Аудио не найдено: {extra_audio}")
-        await asyncio.sleep(1)
+    await q.answer()
+    fields = {"a": handler.__name__[len("on_"):]}
+    point = cb.idx if cb.idx is not None else context.user_data.get("idx")
+    if point is not None:
+        fields["p"] = point
+    if context.user_data.get("waiting_optional"):
+        # «Следующая точка» при открытом вопросе — отказ от дополнительного аудио
+        fields["prompt"] = True
+    ANALYTICS.track("tap", update.effective_chat.id, **fields)
+    with CALLBACK_SECONDS.time(handler=handler.__name__):
+        await handler(update, context, cb.idx)
+
+# ---- Повторные нажатия ----
+# Действия, которые прерывают текущую доставку точки в этом чате
+PREEMPTING_ACTIONS = {CB_START_TOUR, CB_RESTART, CB_BACK_TO_MENU}
+PREEMPTING_COMMANDS = {"/start", "/menu"}
+
+def update_action_key(update: object) -> Optional[str]:
+    """Одинаковые callback_data подряд — это повторное нажатие той же кнопки"""
+    if isinstance(update, Update) and update.callback_query:
+        return update.callback_query.data
+    if isinstance(update, Update) and update.edited_message and update.edited_message.location:
+        # Пока чат занят доставкой, ждёт не больше одного апдейта трансляции
+        return "location"
+    return None
+
+def update_preempts(update: object) -> bool:
+    if not isinstance(update, Update):
+        return False
+    if update.callback_query:
+        return decode_callback(update.callback_query.data).action in PREEMPTING_ACTIONS
+    text = update.message.text if update.message else None
+    return bool(text) and text.split()[0].split("@")[0] in PREEMPTING_COMMANDS
+
+async def answer_dropped(update: object):
+    # Убираем «часики» с кнопки, ничего не отправляя повторно
+    if isinstance(update, Update) and update.callback_query:
+        try:
+            await update.callback_query.answer()
+        except TelegramError:
+            pass
+
+# ---- Продолжение доставок после перезапуска ----
+
+# Доставки, которые продолжаются сейчас: chat_id -> задача
+RESUMING: Dict[int, asyncio.Task] = {}
+# Какой процесс кластера продолжает доставки чата: (номер, всего процессов)
+WORKER_SHARD = (0, 1)
+
+def _journal_ops(cursor: Cursor) -> Optional[Tuple[Op, ...]]:
+    """План, который доставлялся по курсору; None — такой версии маршрута уже нет"""
+    tour = TOURS.get(cursor.version)
+    if tour is None:
+        return None
+    if cursor.part == "intro":
+        return tour.intro
+    if cursor.part == "final":
+        return tour.final
+    if cursor.part not in ("navigation", "content", "branch") or not 0 <= cursor.point < len(tour.points):
+        return None
+    return getattr(tour.points[cursor.point], cursor.part)
+
+async def resume_delivery(bot: Bot, chat_id: int, cursor: Cursor):
+    ops = _journal_ops(cursor)
+    if not ops or cursor.step >= len(ops):
+        DELIVERIES_RESUMED.inc(result="stale")
+        JOURNAL.finish(chat_id)
+        return
+    chat = Chat(chat_id, Chat.PRIVATE)
+    chat.set_bot(bot)
+    logger.info("Продолжаем доставку %s/%s в чат %s с шага %s", cursor.part, cursor.point, chat_id, cursor.step)
+    try:
+        await deliver_journaled(chat, cursor, ops)
+    except TelegramError as e:
+        DELIVERIES_RESUMED.inc(result="failed")
+        logger.warning("Доставка в чат %s не продолжена: %s", chat_id, e)
+        return
+    DELIVERIES_RESUMED.inc(result="resumed")
+    fields = {"part": cursor.part, **({"p": cursor.point} if cursor.point >= 0 else {})}
+    ANALYTICS.track("delivered", chat_id, resumed=True, **fields)
+
+async def resume_deliveries(app) -> None:
+    """Продолжает доставки, которые оборвал прошлый процесс. Задачи идут через
+    app.create_task: остановка приложения ждёт их, как ждёт обработчики."""
+    import cluster
+    index, workers = WORKER_SHARD
+    for chat_id, cursor in (await JOURNAL.interrupted(DELIVERY_RESUME_MAX_AGE)).items():
+        if cluster.worker_for(chat_id, workers) != index or chat_id in RESUMING:
+            continue
+        task = app.create_task(resume_delivery(app.bot, chat_id, cursor))
+        RESUMING[chat_id] = task
+        task.add_done_callback(lambda _, chat_id=chat_id: RESUMING.pop(chat_id, None))
+
+def _repeats_resumed(update: Update, cursor: Cursor) -> bool:
+    """Нажатие, которое запустило бы ту же часть маршрута, что сейчас продолжается:
+    пока бот лежал, пешеход мог нажать кнопку ещё раз"""
+    if not update.callback_query:
+        return False
+    cb = decode_callback(update.callback_query.data)
+    handler = CALLBACK_HANDLERS.get(cb.action)
+    if handler is on_next:
+        # «Дальше» ведёт к навигации следующей точки или к финалу
+        point = None if cb.idx is None else cb.idx + 1
+        return cursor.part == "final" or (cursor.part == "navigation" and point in (None, cursor.point))
+    part = {on_im_here: "content", on_yes: "branch"}.get(handler)
+    return part == cursor.part and cb.idx in (None, cursor.point)
+
+async def settle_resumed(update: Update):
+    """Апдейт чата, доставка которого продолжается, ждёт её конца, как ждал бы
+    прерванную доставку в очереди чата; /start и «В меню» её отменяют,
+    повторное нажатие той же кнопки пропускается"""
+    task = RESUMING.get(update.effective_chat.id)
+    if task is None:
+        return
+    cursor = JOURNAL.get(update.effective_chat.id)
+    if update_preempts(update):
+        task.cancel()
+    elif cursor is not None and _repeats_resumed(update, cursor):
+        await answer_dropped(update)
+        raise ApplicationHandlerStop
+    await asyncio.wait([task])
 
-    await chat.send_message(
-        "👇 Навигация:",
-        reply_markup=point_nav_inline(is_last=False)
+async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "🏠 Главное меню:",
+        reply_markup=_main_menu(context)
     )
 
-async def send_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет финальное сообщение с аудио, текстом и файлом"""
-    chat = update.effective_chat
-
-    # 1. Финальное аудио
-    if FINAL_AUDIO.exists():
-        await chat.send_message("Наш маршрут подошел к завершению. Прослушайте финальные записи")
-        await asyncio.sleep(1)
-        with open(FINAL_AUDIO, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Геопозиция или трансляция: открывает точку, к которой идёт пешеход, при входе в её зону"""
+    message = update.effective_message
+    tour = _tour(context)
+    if update.message and message.location.live_period and any(tour.fences):
+        await message.reply_text(LIVE_LOCATION_TEXT)
 
-    # 2. Финальный текст
-    await chat.send_message(
-        FINAL_TEXT,
-        parse_mode="Markdown"
+    st = _state(context)
+    idx = int(st.get("idx", 0))
+    # Только начатая прогулка и только точка, навигация к которой уже отправлена
+    if "version" not in st or idx in st["visited"] or not (0 <= idx < len(tour.fences)):
+        return
+    fence = tour.fences[idx]
+    location = message.location
+    if fence is None or not ARRIVALS.arrived(
+        update.effective_chat.id, (tour.version, idx), fence, location.latitude, location.longitude
+    ):
+        return
+    ANALYTICS.track("tap", update.effective_chat.id, a="im_here", p=idx, auto=True)
+    await send_point_content(update, context)
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    HANDLER_ERRORS.inc(error=type(context.error).__name__)
+    logger.error("Ошибка при обработке апдейта", exc_info=context.error)
+
+LOOP_LAG_MONITOR = LoopLagMonitor()
+# Фоновые задачи запуска: не задерживают первый ответ
+BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+async def keep_connections_warm(bot: Bot):
+    """Открывает несколько соединений с Bot API сразу и не даёт им закрыться за простой"""
+    await asyncio.gather(*(bot.get_me() for _ in range(WARM_CONNECTIONS)), return_exceptions=True)
+    while True:
+        await asyncio.sleep(KEEP_WARM_INTERVAL)
+        try:
+            await bot.get_me()
+        except TelegramError as e:
+            logger.debug("Пинг Bot API не прошёл: %s", e)
+
+async def post_init(app):
+    LOOP_LAG_MONITOR.start()
+    await SESSION_STORE.start()
+    await JOURNAL.start()
+    await ANALYTICS.start()
+    if KEEP_WARM_INTERVAL > 0:
+        run_in_background(keep_connections_warm(app.bot))
+    if WARMUP_CHAT_ID:
+        run_in_background(warm_up_assets(app.bot, int(WARMUP_CHAT_ID)))
+    if TOUR_RELOAD_INTERVAL > 0:
+        run_in_background(watch_tour_file())
+    await BROADCASTS.start(app.bot, resume=RESUME_BROADCASTS)
+
+async def post_shutdown(app):
+    for task in list(BACKGROUND_TASKS):
+        task.cancel()
+    await asyncio.gather(*BACKGROUND_TASKS, return_exceptions=True)
+    # Рассылки записывают курсор и продолжатся после перезапуска
+    await BROADCASTS.stop()
+    # Доставки к этому моменту закончены (app.stop ждёт обработчики): курсоры удаляются
+    await JOURNAL.stop()
+    await SESSION_STORE.stop()
+    await ANALYTICS.stop()
+    await LOOP_LAG_MONITOR.stop()
+
+def make_send_scheduler(workers: int = 1) -> SendScheduler:
+    # Общий лимит Telegram делится между процессами кластера
+    return SendScheduler(
+        overall_rate=SEND_RATE_OVERALL / workers,
+        private_chat_rate=SEND_RATE_PER_CHAT,
+        group_rate=SEND_RATE_PER_GROUP,
     )
-    await asyncio.sleep(1)
 
-    # 3. Файл с материалами
-    if FINAL_MATERIALS.exists():
-        with open(FINAL_MATERIALS, "rb") as f:
-            await chat.send_document(
-                document=f,
-                caption="📎 Дополнительные материалы и тексты писем"
-            )
-        await asyncio.sleep(1)
+# Все отправки бота проходят через этот планировщик
+SEND_SCHEDULER = make_send_scheduler()
 
-    # 4. Меню
-    await chat.send_message(
-        "Команда проекта, это было давно!",
-        reply_markup=final_menu_inline()
-    )
+UPDATE_PROCESSOR = ChatOrderedUpdateProcessor(
+    MAX_CONCURRENT_UPDATES,
+    MAX_PENDING_UPDATES,
+    action_key=update_action_key,
+    preempts=update_preempts,
+    on_dropped=answer_dropped,
+)
 
-async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat = update.effective_chat
+# Окно последних update_id на входе webhook
+WEBHOOK_RECENT = webhook.RecentIds()
+
+# Типы апдейтов, на которые есть обработчики; остальные Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.EDITED_MESSAGE, Update.CALLBACK_QUERY]
+
+def _pool_limits(size: int) -> dict:
+    # Соединения живут дольше интервала пинга, иначе пинг их не удержит
+    return {"limits": httpx.Limits(
+        max_connections=size,
+        max_keepalive_connections=size,
+        keepalive_expiry=max(KEEP_WARM_INTERVAL * 2, 5),
+    )}
+
+def api_server_kwargs() -> dict:
+    """Параметры Bot/ApplicationBuilder для своего сервера Bot API (пусто — api.telegram.org)"""
+    if not BOT_API_URL:
+        return {}
+    return {
+        "base_url": f"{BOT_API_URL}/bot",
+        "base_file_url": f"{BOT_API_URL}/file/bot",
+        "local_mode": BOT_API_LOCAL,
+    }
+
+def make_request() -> PooledRequest:
+    """Два пула соединений: загрузка большого файла не задерживает ответы на кнопки"""
+    uploads = MeteredRequest(
+        pool="upload",
+        connection_pool_size=UPLOAD_POOL_SIZE,
+        connect_timeout=CONTROL_TIMEOUT,
+        read_timeout=UPLOAD_TIMEOUT,
+        write_timeout=UPLOAD_TIMEOUT,
+        media_write_timeout=UPLOAD_TIMEOUT,
+        # Место в пуле ограничивает max_concurrent; ждать соединения httpx не приходится
+        pool_timeout=None,
+        httpx_kwargs=_pool_limits(UPLOAD_POOL_SIZE),
+    )
+    return PooledRequest(
+        uploads=uploads,
+        # Отправку по пути сервер Bot API отвечает после загрузки файла в Telegram
+        local_files=BOT_API_LOCAL,
+        connection_pool_size=CONTROL_POOL_SIZE,
+        connect_timeout=CONTROL_TIMEOUT,
+        read_timeout=CONTROL_TIMEOUT,
+        write_timeout=CONTROL_TIMEOUT,
+        pool_timeout=None,
+        httpx_kwargs=_pool_limits(CONTROL_POOL_SIZE),
+    )
 
-    # Сначала отправляем приветственный текст
-    intro_text = (
-        "Это аудиопрогулка по Санкт-Петербургу о женщинах, чьи истории были стёрты репрессиями.\n\n"
-        "Мы пройдем 9 домов, это займет около 2-х часов.\n\n"
-        "Не забудьте наушники — некоторые голоса долго ждали, чтобы быть услышанными."
+def build_application(builder: Optional[ApplicationBuilder] = None):
+    builder = builder or ApplicationBuilder()
+    for option, value in api_server_kwargs().items():
+        builder = getattr(builder, option)(value)
+    app = (
+        builder
+        .token(TELEGRAM_TOKEN)
+        .request(make_request())
+        .rate_limiter(SEND_SCHEDULER)
+        .concurrent_updates(UPDATE_PROCESSOR)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, restore_session), group=-1)
+    # edited_message нужен только для трансляции геопозиции: правки текста не обрабатываются
+    new = filters.UpdateType.MESSAGE
+    app.add_handler(CommandHandler("start", cmd_start, filters=new))
+    app.add_handler(CommandHandler("menu", cmd_menu, filters=new))
+    app.add_handler(CommandHandler("help", cmd_help, filters=new))
+    app.add_handler(CommandHandler("reload", cmd_reload, filters=new))
+    app.add_handler(CommandHandler("guide", cmd_guide, filters=new))
+    app.add_handler(CommandHandler("join", cmd_join, filters=new))
+    app.add_handler(CommandHandler("leave", cmd_leave, filters=new))
+    app.add_handler(CommandHandler("broadcast", cmd_broadcast, filters=new))
+    app.add_handler(CommandHandler("broadcast_status", cmd_broadcast_status, filters=new))
+    app.add_handler(CommandHandler("broadcast_cancel", cmd_broadcast_cancel, filters=new))
+    app.add_handler(CallbackQueryHandler(on_callback))
+    app.add_handler(MessageHandler(filters.LOCATION, on_location))
+    app.add_handler(MessageHandler(new & filters.TEXT & ~filters.COMMAND, on_text))
+    app.add_handler(TypeHandler(Update, remember_session), group=1)
+    app.add_error_handler(on_error)
+    return app
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+WEBHOOK_STATE = DATA_DIR / "webhook.json"
+
+def _webhook_fingerprint() -> str:
+    # Секрет Telegram не возвращает, поэтому сверяем его с тем, что регистрировали сами
+    # Свой сервер Bot API хранит webhook отдельно от api.telegram.org
+    raw = json.dumps([f"{WEBHOOK_URL}/webhook", WEBHOOK_SECRET, sorted(ALLOWED_UPDATES), BOT_API_URL])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+async def set_webhook(bot: Bot):
+    """Регистрирует webhook, только если в Telegram записано не то же самое"""
+    fingerprint = _webhook_fingerprint()
+    try:
+        saved = json.loads(WEBHOOK_STATE.read_text()).get("fingerprint")
+    except (OSError, ValueError):
+        saved = None
+    if saved == fingerprint:
+        info = await bot.get_webhook_info()
+        if info.url == f"{WEBHOOK_URL}/webhook" and \
+                sorted(info.allowed_updates or ()) == sorted(ALLOWED_UPDATES):
+            logger.info("Webhook уже зарегистрирован, setWebhook пропущен")
+            return
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}/webhook",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+    WEBHOOK_STATE.parent.mkdir(parents=True, exist_ok=True)
+    WEBHOOK_STATE.write_text(json.dumps({"fingerprint": fingerprint}))
+
+def queue_sink(app) -> webhook.Sink:
+    """Апдейт из webhook сразу в очередь приложения, без ожидания обработки"""
+    def sink(body: bytes, data: dict) -> None:
+        BOOT.first("first_update")
+        if not LOCATION_GATE.allow(data):
+            return
+        app.update_queue.put_nowait(Update.de_json(data, app.bot))
+    return sink
+
+async def serve_application(app, start_server, register_webhook: bool = False):
+    """Жизненный цикл приложения вокруг собственного HTTP-сервера (вместо run_webhook)"""
+    stop = _stop_event()
+
+    # Порт открывается первым: апдейт, разбудивший сервис, ждёт в очереди,
+    # пока приложение допускается
+    server = start_server(app)
+    BOOT.mark("listen")
+    await app.initialize()
+    BOOT.mark("initialize")
+    await post_init(app)
+    await app.start()
+    BOOT.mark("start")
+    await resume_deliveries(app)
+    logger.info(BOOT.report())
+    if register_webhook:
+        run_in_background(set_webhook(app.bot))
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await app.stop()
+        await app.shutdown()
+        await post_shutdown(app)
+
+async def run_single():
+    def start_server(app):
+        return webhook.start_webhook_server(
+            queue_sink(app), "0.0.0.0", PORT, "webhook", WEBHOOK_SECRET, WEBHOOK_RECENT,
+            extra_routes=metrics.metrics_routes(DEBUG_TOKEN, ready=lambda: app.running),
+        )
+    await serve_application(build_application(), start_server, register_webhook=True)
+
+async def run_worker(port: int, workers: int):
+    """Процесс кластера: получает апдейты от входного процесса, а не от Telegram"""
+    import cluster
+    global SEND_SCHEDULER, RESUME_BROADCASTS, WORKER_SHARD
+    SEND_SCHEDULER = make_send_scheduler(workers)
+    # Общий лимит делится между процессами, прерванные рассылки продолжает один
+    BROADCASTS.rate = BROADCAST_RATE / workers
+    RESUME_BROADCASTS = port == WORKER_BASE_PORT
+    # Прерванные доставки продолжает процесс, которому вход отдаёт апдейты чата
+    WORKER_SHARD = (port - WORKER_BASE_PORT, workers)
+    logger.info("Обработчик запущен на 127.0.0.1:%s", port)
+    await serve_application(
+        build_application(),
+        partial(cluster.start_worker_server, port=port, extra_routes=metrics.metrics_routes(DEBUG_TOKEN)),
     )
-    await chat.send_message(intro_text)
-    await asyncio.sleep(1)
 
-    if AUDIO1.exists():
-        with open(AUDIO1, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+async def run_ingress(worker_ports: List[int]):
+    """Входной процесс кластера: принимает webhook и раскладывает апдейты по chat_id"""
+    import cluster
+    ingress = cluster.Ingress([f"http://127.0.0.1:{port}/" for port in worker_ports])
+    stop = _stop_event()
 
-    if AUDIO2.exists():
-        with open(AUDIO2, "rb") as f:
-            await chat.send_voice(voice=f)
-        await asyncio.sleep(1)
+    await ingress.start()
+    LOOP_LAG_MONITOR.start()
+    # Маршрут входной процесс не загружает: трансляции отсеиваются только по частоте
+    gate = LocationGate(LOCATION_MIN_INTERVAL)
 
-    await chat.send_message(
-        WELCOME_TEXT,
-        parse_mode="Markdown",
-        reply_markup=help_menu_inline()
-    )
+    def sink(body: bytes, data: dict) -> None:
+        if gate.allow(data):
+            ingress.submit(body, data)
 
-async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "🏠 Главное меню:",
-        reply_markup=main_menu_inline()
+    server = webhook.start_webhook_server(
+        sink, "0.0.0.0", PORT, "webhook", WEBHOOK_SECRET, WEBHOOK_RECENT,
+        extra_routes=metrics.metrics_routes(DEBUG_TOKEN),
     )
+    async with Bot(TELEGRAM_TOKEN, **api_server_kwargs()) as bot:
+        await set_webhook(bot)
+    logger.info("Вход запущен на порту %s, обработчиков: %s", PORT, len(worker_ports))
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await ingress.stop()
+        await LOOP_LAG_MONITOR.stop()
+
+def run_cluster(workers: int):
+    import subprocess
+    ports = [WORKER_BASE_PORT + i for i in range(workers)]
+    procs = []
+    for i, port in enumerate(ports):
+        env = dict(os.environ)
+        if i:
+            # Заранее загружать файлы достаточно одному процессу
+            env.pop("WARMUP_CHAT_ID", None)
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker",
+             "--port", str(port), "--workers", str(workers)],
+            env=env,
+        ))
+    try:
+        asyncio.run(run_ingress(ports))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
 
-async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        HELP_TEXT,
-        parse_mode="Markdown",
-        reply_markup=main_menu_inline()
+def main():
+    parser = argparse.ArgumentParser(description=PROJECT_NAME)
+    commands = parser.add_subparsers(dest="command")
+    cluster_cmd = commands.add_parser("cluster", help="webhook + несколько процессов-обработчиков")
+    cluster_cmd.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    worker_cmd = commands.add_parser("worker", help="процесс-обработчик кластера (запускается cluster)")
+    worker_cmd.add_argument("--port", type=int, required=True)
+    worker_cmd.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        level=logging.INFO,
     )
 
-async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
-    data = q.data
-    
-    st = _state(context)
+    if args.command == "cluster":
+        run_cluster(args.workers)
+        return
 
-    if data == CB_START_TOUR:
-        st["idx"] = 0
-        st["visited"] = set()
-        await send_point_navigation(update, context, 0)
-    
-    elif data == CB_SHOW_MAP:
-        await send_map(q.message.chat, reply_markup=main_menu_inline())
-    
-    elif data == CB_ABOUT:
-        await q.message.reply_text(
-            ABOUT_TEXT,
-            parse_mode="Markdown",
-            reply_markup=main_menu_inline()
-        )
-    
-    elif data == CB_IM_HERE:
-        await send_point_content(update, context)
-    
-    elif data == CB_WANT_MORE:
-        idx = int(st.get("idx", 0))
-        
-        # Для локации 3 - старая логика
-        if idx == 2:
-            await send_point3_audio(update, context)
-        # Для локаций 8 и 9 - новая логика
-        else:
-            await send_optional_audio(update, context)
-    
-    elif data == CB_SKIP_AUDIO:
-        st = _state(context)
-        idx = int(st.get("idx", 0))
-        st["waiting_optional"] = False
-        
-        if idx >= len(POINTS) - 1:
-            await send_final(update, context)
-        else:
-            await send_point_navigation(update, context, idx + 1)
-    
-    elif data == CB_HEAR_VOICE_YES:
-        await send_point6_voice(update, context)
-    
-    elif data == CB_HEAR_VOICE_NO:
-        st = _state(context)
-        idx = int(st.get("idx", 0))
-        # Переход на следующую локацию (7-я)
-        await send_point_navigation(update, context, idx + 1)
-    
-    elif data == CB_NEXT:
-        st = _state(context)
-        idx = int(st.get("idx", 0))
-        if idx >= len(POINTS) - 1:
-            await send_final(update, context)
-        else:
-            await send_point_navigation(update, context, idx + 1)
-    
-    elif data == CB_RESTART:
-        st = _state(context)
-        st["idx"] = 0
-        st["visited"] = set()
-        await send_point_navigation(update, context, 0)
-    
-    elif data == CB_BACK_TO_MAP:
-        await send_map(q.message.chat, reply_markup=main_menu_inline())
-    
-    elif data == CB_BACK_TO_MENU:
-        await q.message.reply_text(
-            "🏠 Главное меню:",
-            reply_markup=main_menu_inline()
-        )
+    load_tour()
+    BOOT.mark("tour")
 
-async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "🏠 Главное меню:",
-        reply_markup=main_menu_inline()
-    )
+    if args.command == "worker":
+        asyncio.run(run_worker(args.port, args.workers))
+        return
 
-def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("menu", cmd_menu))
-    app.add_handler(CommandHandler("help", cmd_help))
-    app.add_handler(CallbackQueryHandler(on_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
-    
-    app.run_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        url_path="webhook",
-        webhook_url=f"{WEBHOOK_URL}/webhook"
-    )
+    asyncio.run(run_single())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,274 @@
+# broadcast.py — рассылка всем, кто когда-либо нажимал /start
+#
+# Рассылка идёт фоновой задачей пачками по chat_id в порядке возрастания.
+# После каждой пачки в базу записывается курсор (последний обработанный
+# chat_id), поэтому после перезапуска рассылка продолжается с него, а не
+# начинается заново. Чаты, которые заблокировали бота или удалены,
+# помечаются и больше не получают рассылок.
+#
+# Своя скорость (rate) ниже общего лимита отправки: у прогулок всегда
+# остаётся запас, а в общем планировщике рассылка идёт низшим приоритетом.
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Ошибки BadRequest, после которых писать в чат бессмысленно
+GONE_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+# send(bot, chat_id, payload) — отправка одного сообщения рассылки
+Send = Callable[[Bot, int, Dict[str, Any]], Awaitable[Any]]
+
+
+class BroadcastDb:
+    """Известные чаты и состояние рассылок. Методы синхронные — вызываются в потоке."""
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chats ("
+                " chat_id INTEGER PRIMARY KEY,"
+                " first_seen REAL NOT NULL,"
+                " blocked_at REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS broadcasts ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " created_at REAL NOT NULL,"
+                " admin_chat_id INTEGER NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL,"          # running | done | cancelled
+                " cursor INTEGER NOT NULL DEFAULT 0,"
+                " sent INTEGER NOT NULL DEFAULT 0,"
+                " blocked INTEGER NOT NULL DEFAULT 0,"
+                " failed INTEGER NOT NULL DEFAULT 0)"
+            )
+            # Чаты, которые нажимали /start до появления таблицы chats
+            has_sessions = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'"
+            ).fetchone()
+            if has_sessions:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO chats (chat_id, first_seen)"
+                    " SELECT chat_id, updated_at FROM sessions WHERE chat_id > 0"
+                )
+
+    def add_chat(self, chat_id: int) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO chats (chat_id, first_seen) VALUES (?, ?)"
+                " ON CONFLICT(chat_id) DO UPDATE SET blocked_at = NULL",
+                (chat_id, time.time()),
+            )
+
+    def chat_count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chats WHERE blocked_at IS NULL").fetchone()[0]
+
+    def next_chats(self, after: int, limit: int) -> List[int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chat_id FROM chats WHERE blocked_at IS NULL AND chat_id > ?"
+                " ORDER BY chat_id LIMIT ?",
+                (after, limit),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def create(self, admin_chat_id: int, payload: Dict[str, Any]) -> int:
+        with self._lock, self._db:
+            # Курсор ниже любого chat_id: у групп он отрицательный
+            cur = self._db.execute(
+                "INSERT INTO broadcasts (created_at, admin_chat_id, payload, status, cursor)"
+                " VALUES (?, ?, ?, 'running', ?)",
+                (time.time(), admin_chat_id, json.dumps(payload, ensure_ascii=False), -(1 << 62)),
+            )
+            return cur.lastrowid
+
+    def checkpoint(self, broadcast_id: int, cursor: int, sent: int, blocked: int, failed: int,
+                   gone: List[int]) -> None:
+        """Курсор, счётчики и заблокированные чаты пачки — одной транзакцией"""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE chats SET blocked_at = ? WHERE chat_id = ?", [(now, c) for c in gone]
+            )
+            self._db.execute(
+                "UPDATE broadcasts SET cursor = ?, sent = sent + ?, blocked = blocked + ?,"
+                " failed = failed + ? WHERE id = ?",
+                (cursor, sent, blocked, failed, broadcast_id),
+            )
+
+    def set_status(self, broadcast_id: int, status: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("UPDATE broadcasts SET status = ? WHERE id = ?", (status, broadcast_id))
+
+    def get(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._db.row_factory = sqlite3.Row
+            try:
+                row = self._db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+            finally:
+                self._db.row_factory = None
+        return dict(row) if row else None
+
+    def running(self) -> List[int]:
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()
+        return [r[0] for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class Broadcaster:
+    """Фоновые рассылки с курсором в базе; rate — сообщений в секунду на процесс"""
+
+    def __init__(self, db: BroadcastDb, send: Send, rate: float = 20, batch_size: int = 20):
+        self.db = db
+        self.send = send
+        self.bot: Optional[Bot] = None
+        self.rate = rate
+        self.batch_size = batch_size
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+
+    async def remember_chat(self, chat_id: int) -> None:
+        try:
+            await asyncio.to_thread(self.db.add_chat, chat_id)
+        except sqlite3.Error:
+            logger.exception("Не удалось запомнить чат %s", chat_id)
+
+    async def start(self, bot: Bot, resume: bool = True) -> None:
+        """resume — продолжить рассылки, прерванные перезапуском"""
+        self.bot = bot
+        if not resume:
+            return
+        for broadcast_id in await asyncio.to_thread(self.db.running):
+            logger.info("Продолжаем рассылку %s", broadcast_id)
+            self._spawn(broadcast_id)
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        # Задачи успевают записать курсор текущей пачки (см. _run)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def create(self, admin_chat_id: int, payload: Dict[str, Any]) -> Tuple[int, int]:
+        """Запускает рассылку; возвращает её номер и число получателей"""
+        broadcast_id = await asyncio.to_thread(self.db.create, admin_chat_id, payload)
+        recipients = await asyncio.to_thread(self.db.chat_count)
+        self._spawn(broadcast_id)
+        return broadcast_id, recipients
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        await asyncio.to_thread(self.db.set_status, broadcast_id, "cancelled")
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def status(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.db.get, broadcast_id)
+
+    def _spawn(self, broadcast_id: int) -> None:
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _send_one(self, chat_id: int, payload: Dict[str, Any]) -> str:
+        try:
+            await self.send(self.bot, chat_id, payload)
+            return "sent"
+        except Forbidden:
+            return "blocked"
+        except BadRequest as e:
+            if any(m in str(e).lower() for m in GONE_CHAT_ERRORS):
+                return "blocked"
+            logger.warning("Рассылка в чат %s не отправлена: %s", chat_id, e)
+            return "failed"
+        except TelegramError as e:
+            logger.warning("Рассылка в чат %s не отправлена: %s", chat_id, e)
+            return "failed"
+
+    async def _run(self, broadcast_id: int) -> None:
+        row = await asyncio.to_thread(self.db.get, broadcast_id)
+        if row is None or row["status"] != "running":
+            return
+        payload = json.loads(row["payload"])
+        cursor = row["cursor"]
+        bucket = TokenBucket(self.rate, max(self.rate, 1))
+        while True:
+            chats = await asyncio.to_thread(self.db.next_chats, cursor, self.batch_size)
+            if not chats:
+                break
+            row = await asyncio.to_thread(self.db.get, broadcast_id)
+            if row["status"] != "running":
+                # Отменена командой, возможно, в другом процессе
+                return
+            sends = []
+            try:
+                for chat_id in chats:
+                    await bucket.acquire()
+                    sends.append(asyncio.create_task(self._send_one(chat_id, payload)))
+                results = await asyncio.shield(asyncio.gather(*sends))
+            except asyncio.CancelledError:
+                # Отмена не прерывает уже начатые отправки: курсор должен встать
+                # после них, иначе после перезапуска они уйдут повторно
+                results = await asyncio.gather(*sends)
+                if results:
+                    started = chats[:len(results)]
+                    await self._checkpoint(broadcast_id, started[-1], started, results)
+                raise
+            await self._checkpoint(broadcast_id, chats[-1], chats, results)
+            cursor = chats[-1]
+
+        await asyncio.to_thread(self.db.set_status, broadcast_id, "done")
+        row = await asyncio.to_thread(self.db.get, broadcast_id)
+        logger.info("Рассылка %s завершена: %s", broadcast_id, row)
+        try:
+            await self.bot.send_message(row["admin_chat_id"], format_status(row))
+        except TelegramError:
+            logger.exception("Не удалось отправить отчёт о рассылке %s", broadcast_id)
+
+    async def _checkpoint(self, broadcast_id: int, cursor: int, chats: List[int], results: List[str]) -> None:
+        sent = results.count("sent")
+        blocked = [c for c, r in zip(chats, results) if r == "blocked"]
+        failed = results.count("failed")
+        self.sent += sent
+        self.blocked += len(blocked)
+        self.failed += failed
+        await asyncio.to_thread(
+            self.db.checkpoint, broadcast_id, cursor, sent, len(blocked), failed, blocked
+        )
+
+
+def format_status(row: Dict[str, Any]) -> str:
+    status = {"running": "идёт", "done": "завершена", "cancelled": "отменена"}.get(row["status"], row["status"])
+    return (
+        f"Рассылка {row['id']}: {status}\n"
+        f"Отправлено: {row['sent']}, заблокировали бота: {row['blocked']}, ошибок: {row['failed']}"
+    )
@@ -0,0 +1,224 @@
+# build_assets.py — офлайн-сборка облегчённых копий файлов из assets
+#
+#   python build_assets.py [--src assets] [--out assets/build] [--force]
+#
+# Для каждого файла собираются два варианта: standard (бот отправляет его по
+# умолчанию) и lowdata (режим «экономия трафика» в главном меню), а в
+# manifest.json записываются размеры и длительность голосовых. Внешние
+# инструменты необязательны: ffmpeg — аудио и фото, Pillow — фото, qpdf и
+# Ghostscript — PDF. Если нужного нет или копия вышла не меньше исходника,
+# файл копируется как есть. Неизменившиеся файлы повторно не собираются.
+# Сборка запускается локально, результат коммитится вместе с assets.
+import argparse
+import json
+import logging
+import shutil
+import struct
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from asset_manifest import DERIVED_MANIFEST, LOW_DATA, STANDARD, VARIANTS, media_kind
+from media_cache import file_sha256
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Голос: моно Opus в режиме voip
+VOICE_BITRATE = {STANDARD: "32k", LOW_DATA: "16k"}
+# Фото: Telegram всё равно показывает не больше 1280 px по длинной стороне
+PHOTO_MAX_SIDE = {STANDARD: 1280, LOW_DATA: 800}
+PHOTO_QUALITY = {STANDARD: 85, LOW_DATA: 70}       # Pillow
+PHOTO_FFMPEG_QSCALE = {STANDARD: 3, LOW_DATA: 6}   # ffmpeg -q:v
+# PDF: в lowdata картинки пережимаются Ghostscript
+PDF_GS_SETTINGS = {LOW_DATA: "/ebook"}
+
+OPUS_RATE = 48000
+
+
+def _run(cmd) -> bool:
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", b"") or b""
+        logger.warning("%s: %s %s", cmd[0], e, stderr.decode(errors="replace")[-300:])
+        return False
+
+
+def encode_voice(src: Path, dst: Path, variant: str) -> bool:
+    if not shutil.which("ffmpeg"):
+        return False
+    return _run([
+        "ffmpeg", "-y", "-loglevel", "error", "-i", str(src),
+        "-map_metadata", "-1", "-vn", "-ac", "1",
+        "-c:a", "libopus", "-b:a", VOICE_BITRATE[variant], "-application", "voip",
+        str(dst),
+    ])
+
+
+def optimize_photo(src: Path, dst: Path, variant: str) -> bool:
+    side = PHOTO_MAX_SIDE[variant]
+    if Image is not None:
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im).convert("RGB")
+            im.thumbnail((side, side))
+            im.save(dst, "JPEG", quality=PHOTO_QUALITY[variant], optimize=True, progressive=True)
+        return True
+    if shutil.which("ffmpeg"):
+        scale = f"scale='min({side},iw)':'min({side},ih)':force_original_aspect_ratio=decrease"
+        return _run([
+            "ffmpeg", "-y", "-loglevel", "error", "-i", str(src),
+            "-map_metadata", "-1", "-vf", scale, "-q:v", str(PHOTO_FFMPEG_QSCALE[variant]),
+            str(dst),
+        ])
+    return False
+
+
+def optimize_pdf(src: Path, dst: Path, variant: str) -> bool:
+    source = src
+    gs_settings = PDF_GS_SETTINGS.get(variant)
+    if gs_settings and shutil.which("gs"):
+        shrunk = dst.with_suffix(".gs.pdf")
+        if _run([
+            "gs", "-q", "-dBATCH", "-dNOPAUSE", "-dSAFER", "-sDEVICE=pdfwrite",
+            f"-dPDFSETTINGS={gs_settings}", f"-sOutputFile={shrunk}", str(src),
+        ]):
+            source = shrunk
+    ok = False
+    if shutil.which("qpdf"):
+        # Линеаризация: первая страница открывается до полной загрузки файла
+        ok = _run([
+            "qpdf", "--linearize", "--object-streams=generate",
+            "--recompress-flate", "--compression-level=9", str(source), str(dst),
+        ])
+    if not ok and source != src:
+        shutil.move(str(source), str(dst))
+        return True
+    if source != src:
+        source.unlink(missing_ok=True)
+    return ok
+
+
+def ogg_opus_duration(path: Path) -> Optional[int]:
+    """Длительность Ogg Opus по гранулам последней страницы, без внешних программ"""
+    with open(path, "rb") as f:
+        head = f.read(512)
+        pos = head.find(b"OpusHead")
+        if not head.startswith(b"OggS") or pos < 0:
+            return None
+        pre_skip = struct.unpack_from("<H", head, pos + 10)[0]
+        f.seek(0, 2)
+        f.seek(max(0, f.tell() - 65536))
+        tail = f.read()
+    last = tail.rfind(b"OggS")
+    if last < 0 or last + 14 > len(tail):
+        return None
+    granule = struct.unpack_from("<q", tail, last + 6)[0]
+    return max(0, round((granule - pre_skip) / OPUS_RATE))
+
+
+def voice_duration(path: Path) -> Optional[int]:
+    duration = ogg_opus_duration(path)
+    if duration is None and shutil.which("ffprobe"):
+        try:
+            out = subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                 "-of", "default=noprint_wrappers=1:nokey=1", str(path)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            duration = round(float(out))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    return duration
+
+
+def _optimizer(path: Path) -> Optional[Callable[[Path, Path, str], bool]]:
+    if path.suffix.lower() == ".pdf":
+        return optimize_pdf
+    kind = media_kind(path)
+    if kind == "voice":
+        return encode_voice
+    if kind == "photo":
+        return optimize_photo
+    return None
+
+
+def build(src_dir: Path, out_dir: Path, force: bool = False) -> dict:
+    manifest_path = out_dir / DERIVED_MANIFEST
+    try:
+        old = json.loads(manifest_path.read_text(encoding="utf-8")).get("variants", {})
+    except FileNotFoundError:
+        old = {}
+
+    variants: Dict[str, dict] = {v: {} for v in VARIANTS}
+    for variant in VARIANTS:
+        (out_dir / variant).mkdir(parents=True, exist_ok=True)
+
+    for src in sorted(src_dir.iterdir()):
+        if not src.is_file() or src.name.startswith("."):
+            continue
+        optimize = _optimizer(src)
+        if optimize is None:
+            continue
+        sha256 = file_sha256(src)
+        for variant in VARIANTS:
+            dst = out_dir / variant / src.name
+            rel = dst.relative_to(out_dir).as_posix()
+            prev = old.get(variant, {}).get(src.name)
+            if not force and prev and prev.get("source_sha256") == sha256 and dst.exists():
+                variants[variant][src.name] = prev
+                continue
+
+            if not optimize(src, dst, variant) or not dst.exists() or dst.stat().st_size >= src.stat().st_size:
+                shutil.copyfile(src, dst)
+            entry = {"file": rel, "source_sha256": sha256, "size": dst.stat().st_size}
+            if media_kind(src) == "voice":
+                entry["duration"] = voice_duration(dst)
+            variants[variant][src.name] = entry
+            logger.info("%s [%s]: %s → %s байт", src.name, variant, src.stat().st_size, entry["size"])
+
+    # Копии удалённых исходников больше не нужны
+    for variant in VARIANTS:
+        for stale in (out_dir / variant).iterdir():
+            if stale.name not in variants[variant]:
+                stale.unlink()
+
+    manifest = {"source_dir": src_dir.as_posix(), "variants": variants}
+    tmp = manifest_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    tmp.replace(manifest_path)
+    return manifest
+
+
+def report(src_dir: Path, manifest: dict) -> None:
+    for variant, entries in manifest["variants"].items():
+        before = sum((src_dir / name).stat().st_size for name in entries)
+        after = sum(e["size"] for e in entries.values())
+        share = after / before * 100 if before else 100
+        print(f"{variant:>9}: {len(entries)} файлов, {before / 1e6:.1f} МБ → {after / 1e6:.1f} МБ ({share:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка облегчённых копий файлов маршрута")
+    parser.add_argument("--src", type=Path, default=Path("assets"))
+    parser.add_argument("--out", type=Path, default=Path("assets/build"))
+    parser.add_argument("--force", action="store_true", help="пересобрать всё")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s %(message)s", level=logging.INFO)
+    for tool in ("ffmpeg", "qpdf", "gs"):
+        if not shutil.which(tool):
+            logger.warning("%s не найден — соответствующие файлы будут скопированы как есть", tool)
+    if Image is None and not shutil.which("ffmpeg"):
+        logger.warning("Нет ни Pillow, ни ffmpeg — фото будут скопированы как есть")
+
+    report(args.src, build(args.src, args.out, args.force))
+
+
+if __name__ == "__main__":
+    main()
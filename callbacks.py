@@ -0,0 +1,29 @@
+# callbacks.py — компактные callback_data: действие, номер точки и версия контента
+from typing import NamedTuple, Optional
+
+# Telegram принимает не больше 64 байт callback_data
+CALLBACK_DATA_LIMIT = 64
+SEP = ":"
+
+
+class Callback(NamedTuple):
+    action: str
+    idx: Optional[int] = None
+    version: Optional[str] = None
+
+
+def encode_callback(action: str, idx: int, version: str) -> str:
+    data = f"{action}{SEP}{idx}{SEP}{version}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data!r}")
+    return data
+
+
+def decode_callback(data: Optional[str]) -> Callback:
+    """Кнопки точек — «действие:точка:версия», остальные — просто имя действия"""
+    if not data:
+        return Callback("")
+    parts = data.split(SEP)
+    if len(parts) == 3 and parts[1].isdigit():
+        return Callback(parts[0], int(parts[1]), parts[2])
+    return Callback(data)
@@ -0,0 +1,126 @@
+# cluster.py — несколько процессов-обработчиков за одним webhook
+#
+# Входной процесс принимает апдейты от Telegram и пересылает каждый в процесс,
+# номер которого зависит только от chat_id, поэтому апдейты одного чата всегда
+# попадают в один процесс и обрабатываются по порядку. Сессии и кэш file_id
+# лежат в общей SQLite (WAL) в DATA_DIR, так что число процессов можно менять
+# перезапуском без потери прогресса.
+import asyncio
+import json
+import logging
+from typing import List, Optional, Sequence
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Ключи апдейта, в которых лежит сообщение/объект с чатом
+_CHAT_KEYS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "business_message",
+    "edited_business_message",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+
+
+def update_chat_id(data: dict) -> Optional[int]:
+    """chat_id из сырого JSON апдейта — без построения объектов telegram"""
+    for key in _CHAT_KEYS:
+        obj = data.get(key)
+        if obj:
+            chat = obj.get("chat") or obj.get("from")
+            return chat["id"] if chat else None
+    query = data.get("callback_query")
+    if query:
+        message = query.get("message")
+        if message and message.get("chat"):
+            return message["chat"]["id"]
+        return query["from"]["id"]
+    for obj in data.values():
+        if isinstance(obj, dict) and isinstance(obj.get("from"), dict):
+            return obj["from"]["id"]
+    return None
+
+
+def worker_for(chat_id: Optional[int], workers: int) -> int:
+    return (chat_id or 0) % workers
+
+
+class Ingress:
+    """Раскладывает апдейты по очередям процессов; каждая очередь пересылается по порядку"""
+
+    def __init__(self, worker_urls: List[str], retry_delay: float = 0.5):
+        self.worker_urls = worker_urls
+        self.retry_delay = retry_delay
+        self._queues: List[asyncio.Queue] = [asyncio.Queue() for _ in worker_urls]
+        self._tasks: List[asyncio.Task] = []
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def backlog(self) -> List[int]:
+        return [q.qsize() for q in self._queues]
+
+    def submit(self, body: bytes, data: dict) -> None:
+        idx = worker_for(update_chat_id(data), len(self.worker_urls))
+        self._queues[idx].put_nowait(body)
+
+    async def _forward(self, idx: int) -> None:
+        url = self.worker_urls[idx]
+        queue = self._queues[idx]
+        while True:
+            body = await queue.get()
+            # Повторяем, пока процесс не примет апдейт: иначе нарушится порядок чата
+            while True:
+                try:
+                    response = await self._client.post(
+                        url, content=body, headers={"Content-Type": "application/json"}
+                    )
+                    response.raise_for_status()
+                    break
+                except (httpx.HTTPError, OSError) as e:
+                    logger.warning("Процесс %s не принял апдейт: %s", idx, e)
+                    await asyncio.sleep(self.retry_delay)
+            queue.task_done()
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(timeout=10)
+        self._tasks = [asyncio.create_task(self._forward(i)) for i in range(len(self.worker_urls))]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client:
+            await self._client.aclose()
+
+
+class WorkerHandler(tornado.web.RequestHandler):
+    """Принимает апдейт от входного процесса и ставит его в очередь приложения"""
+
+    def initialize(self, ptb_app):
+        self.ptb_app = ptb_app
+
+    async def post(self):
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        update = Update.de_json(data, self.ptb_app.bot)
+        await self.ptb_app.update_queue.put(update)
+
+
+def start_worker_server(ptb_app, port: int, extra_routes: Sequence = ()) -> HTTPServer:
+    web_app = tornado.web.Application([(r"/", WorkerHandler, {"ptb_app": ptb_app}), *extra_routes])
+    server = HTTPServer(web_app)
+    server.listen(port, "127.0.0.1")
+    return server
@@ -0,0 +1,199 @@
+# content.py — тексты и точки маршрута из внешнего файла (tour.json)
+#
+# Файл читается и проверяется целиком до того, как бот на него переключится:
+# ошибка в файле оставляет в работе прошлую версию. Пути к файлам в нём —
+# относительно папки assets; в описании точек они превращаются в Path,
+# как того ждёт tour.compile_tour.
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator, List, Mapping, Optional, Tuple
+
+from entities import MarkupError, parse_markdown
+from tour import iter_paths
+
+REQUIRED_TEXTS = ("intro", "welcome", "about", "help", "final", "map_caption")
+# Тексты, которые уходят с разметкой Markdown (см. entities.py)
+MARKDOWN_TEXTS = ("welcome", "about", "help", "final", "map_caption")
+
+POINT_KEYS = {"navigation", "nav_photo", "transition_text", "transition_audio", "pacing", "steps", "location"}
+POINT_PATH_KEYS = ("nav_photo", "transition_audio")
+STEP_KINDS = ("photo", "voice", "text", "pause", "prompt")
+STEP_KEYS = {
+    "photo": {"photo"},
+    "voice": {"voice", "description"},
+    "text": {"text"},
+    "pause": {"pause"},
+    "prompt": {"prompt", "yes", "no", "then"},
+}
+
+
+class ContentError(ValueError):
+    """Файл маршрута не прошёл проверку; в тексте — где именно"""
+
+
+@dataclass(frozen=True)
+class Content:
+    version: str                  # хэш файла: кнопки помнят, из какой версии они пришли
+    texts: Mapping[str, str]
+    map_image: Path
+    intro_audio: Tuple[Path, ...]
+    final_audio: Optional[Path]
+    final_materials: Optional[Path]
+    points: Tuple[Mapping, ...]
+
+    def asset_paths(self) -> Iterator[Path]:
+        """Все файлы, на которые ссылается маршрут"""
+        yield self.map_image
+        yield from self.intro_audio
+        yield from iter_paths(self.points)
+        if self.final_audio:
+            yield self.final_audio
+        if self.final_materials:
+            yield self.final_materials
+
+
+def content_version(raw: bytes) -> str:
+    return hashlib.sha1(raw).hexdigest()[:6]
+
+
+class _Parser:
+    def __init__(self, assets: Path):
+        self.assets = assets
+
+    def fail(self, where: str, message: str) -> None:
+        raise ContentError(f"{where}: {message}")
+
+    def text(self, value: Any, where: str) -> str:
+        if not isinstance(value, str) or not value.strip():
+            self.fail(where, "нужна непустая строка")
+        return value
+
+    def markdown(self, value: Any, where: str) -> str:
+        text = self.text(value, where)
+        try:
+            parse_markdown(text)
+        except MarkupError as e:
+            self.fail(where, f"ошибка разметки: {e}")
+        return text
+
+    def path(self, value: Any, where: str) -> Path:
+        name = self.text(value, where)
+        path = Path(name)
+        if path.is_absolute() or ".." in path.parts:
+            self.fail(where, f"путь должен быть внутри {self.assets}: {name!r}")
+        return self.assets / path
+
+    def keys(self, value: Any, allowed: set, where: str) -> Mapping:
+        if not isinstance(value, dict):
+            self.fail(where, "нужен объект")
+        unknown = set(value) - allowed
+        if unknown:
+            self.fail(where, f"неизвестные поля {sorted(unknown)}")
+        return value
+
+    def steps(self, value: Any, where: str, allow_prompt: bool = True) -> List[Mapping]:
+        if not isinstance(value, list):
+            self.fail(where, "нужен список шагов")
+        steps = []
+        for n, step in enumerate(value):
+            at = f"{where}[{n}]"
+            if not isinstance(step, dict):
+                self.fail(at, "шаг должен быть объектом")
+            kinds = [k for k in STEP_KINDS if k in step]
+            if len(kinds) != 1:
+                self.fail(at, f"у шага должен быть ровно один тип из {list(STEP_KINDS)}")
+            kind = kinds[0]
+            self.keys(step, STEP_KEYS[kind], at)
+            if kind in ("photo", "voice"):
+                parsed = {**step, kind: self.path(step[kind], f"{at}.{kind}")}
+                if "description" in step:
+                    self.markdown(step["description"], f"{at}.description")
+            elif kind == "text":
+                parsed = {"text": self.markdown(step["text"], f"{at}.text")}
+            elif kind == "pause":
+                seconds = step["pause"]
+                if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or not 0 <= seconds <= 600:
+                    self.fail(f"{at}.pause", "нужно число секунд от 0 до 600")
+                parsed = {"pause": seconds}
+            else:
+                if not allow_prompt:
+                    self.fail(at, "вопрос внутри ветки вопроса не поддерживается")
+                if n != len(value) - 1:
+                    self.fail(at, "вопрос должен быть последним шагом точки")
+                parsed = {"prompt": self.text(step["prompt"], f"{at}.prompt")}
+                for label in ("yes", "no"):
+                    if label in step:
+                        parsed[label] = self.text(step[label], f"{at}.{label}")
+                parsed["then"] = self.steps(step.get("then", []), f"{at}.then", allow_prompt=False)
+            steps.append(parsed)
+        return steps
+
+    def location(self, value: Any, where: str) -> Mapping:
+        """Центр зоны точки и (необязательно) её радиус в метрах"""
+        self.keys(value, {"lat", "lon", "radius"}, where)
+        limits = {"lat": (-90, 90), "lon": (-180, 180), "radius": (10, 1000)}
+        for key, (low, high) in limits.items():
+            if key not in value and key == "radius":
+                continue
+            number = value.get(key)
+            if isinstance(number, bool) or not isinstance(number, (int, float)) or not low <= number <= high:
+                self.fail(f"{where}.{key}", f"нужно число от {low} до {high}")
+        return dict(value)
+
+    def point(self, value: Any, where: str) -> Mapping:
+        self.keys(value, POINT_KEYS, where)
+        point = dict(value)
+        if "navigation" in point:
+            self.markdown(point["navigation"], f"{where}.navigation")
+        if "transition_text" in point:
+            self.text(point["transition_text"], f"{where}.transition_text")
+        for key in POINT_PATH_KEYS:
+            if key in point:
+                point[key] = self.path(point[key], f"{where}.{key}")
+        if "location" in point:
+            point["location"] = self.location(point["location"], f"{where}.location")
+        if not isinstance(point.get("pacing", False), bool):
+            self.fail(f"{where}.pacing", "нужно true или false")
+        point["steps"] = self.steps(point.get("steps"), f"{where}.steps")
+        if not point["steps"]:
+            self.fail(f"{where}.steps", "у точки нет ни одного шага")
+        return point
+
+
+def parse_content(raw: bytes, assets: Path) -> Content:
+    """Проверяет и разбирает содержимое файла маршрута; ошибки — ContentError"""
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise ContentError(f"не JSON: {e}") from None
+    p = _Parser(assets)
+    p.keys(data, {"texts", "map", "intro_audio", "final_audio", "final_materials", "points"}, "файл")
+
+    texts = p.keys(data.get("texts"), set(REQUIRED_TEXTS), "texts")
+    for name in REQUIRED_TEXTS:
+        if name in MARKDOWN_TEXTS:
+            p.markdown(texts.get(name), f"texts.{name}")
+        else:
+            p.text(texts.get(name), f"texts.{name}")
+
+    intro = data.get("intro_audio", [])
+    if not isinstance(intro, list):
+        p.fail("intro_audio", "нужен список файлов")
+
+    points = data.get("points")
+    if not isinstance(points, list) or not points:
+        p.fail("points", "нужен непустой список точек")
+
+    return Content(
+        version=content_version(raw),
+        texts=dict(texts),
+        map_image=p.path(data.get("map"), "map"),
+        intro_audio=tuple(p.path(v, f"intro_audio[{n}]") for n, v in enumerate(intro)),
+        final_audio=p.path(data["final_audio"], "final_audio") if "final_audio" in data else None,
+        final_materials=(
+            p.path(data["final_materials"], "final_materials") if "final_materials" in data else None
+        ),
+        points=tuple(p.point(v, f"points[{n}]") for n, v in enumerate(points)),
+    )
@@ -0,0 +1,135 @@
+# delivery.py — план доставки точки: список отправок и склейка их в меньшее число запросов
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+from telegram import MessageEntity
+
+from entities import CAPTION_LIMIT, TEXT_LIMIT, Formatted, parse_markdown, split_formatted, utf16_len
+
+# Лимиты Telegram
+MEDIA_GROUP_LIMIT = 10
+
+
+@dataclass(frozen=True)
+class Op:
+    """Одна отправка: text | photo | voice | document | media_group | pause"""
+    kind: str
+    text: Optional[str] = None        # текст сообщения или подпись к файлу
+    path: Optional[Path] = None
+    paths: Tuple[Path, ...] = ()      # фото для media_group
+    parse_mode: Optional[str] = None
+    reply_markup: Any = None
+    seconds: float = 0                # для pause
+    entities: Tuple[MessageEntity, ...] = ()  # разметка text после format_ops
+
+
+def text_op(text: str, parse_mode: Optional[str] = None, reply_markup: Any = None) -> Op:
+    return Op("text", text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
+def media_op(kind: str, path: Path, caption: Optional[str] = None,
+             parse_mode: Optional[str] = None, reply_markup: Any = None) -> Op:
+    return Op(kind, text=caption, path=path, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
+def pause_op(seconds: float) -> Op:
+    return Op("pause", seconds=seconds)
+
+
+def format_ops(ops: Iterable[Op]) -> List[Op]:
+    """Markdown → текст и entities (см. entities.py); текст длиннее 4096 и подпись
+    длиннее 1024 делятся на несколько сообщений по абзацам, кнопки — у последнего.
+    Ошибка в разметке — MarkupError."""
+    result: List[Op] = []
+    for op in ops:
+        if op.kind == "pause" or op.text is None or op.parse_mode not in (None, "Markdown"):
+            result.append(op)
+            continue
+        formatted = parse_markdown(op.text) if op.parse_mode == "Markdown" else Formatted(op.text, op.entities)
+        first_limit = TEXT_LIMIT if op.kind == "text" else CAPTION_LIMIT
+        chunks = split_formatted(formatted, TEXT_LIMIT, first_limit=first_limit)
+        parts = [replace(op, text=chunks[0].text, entities=chunks[0].entities, parse_mode=None)]
+        parts += [Op("text", text=c.text, entities=c.entities) for c in chunks[1:]]
+        if len(parts) > 1:
+            parts[0] = replace(parts[0], reply_markup=None)
+            parts[-1] = replace(parts[-1], reply_markup=op.reply_markup)
+        result.extend(parts)
+    return result
+
+
+def _next_index(ops: List[Op], i: int) -> int:
+    """Индекс следующей не-паузы после i"""
+    j = i + 1
+    while j < len(ops) and ops[j].kind == "pause":
+        j += 1
+    return j
+
+
+def _can_take_caption(op: Op) -> bool:
+    return op.kind in ("photo", "voice", "document") and not op.text and op.reply_markup is None
+
+
+def _fits_caption(op: Op) -> bool:
+    return (
+        op.kind == "text"
+        and op.reply_markup is None
+        and op.text is not None
+        and utf16_len(op.text) <= CAPTION_LIMIT
+    )
+
+
+def coalesce(ops: Iterable[Op]) -> List[Op]:
+    """Склеивает соседние отправки, чтобы точка уходила меньшим числом запросов.
+
+    * текст сразу после фото/голосового без подписи становится подписью,
+      если помещается в 1024 символа;
+    * подряд идущие фото без подписей и кнопок уходят одним send_media_group
+      (подпись может быть только у первого).
+
+    Паузы между склеенными отправками выбрасываются, остальные сохраняются.
+    """
+    ops = list(ops)
+    result: List[Op] = []
+    i = 0
+    while i < len(ops):
+        op = ops[i]
+
+        if _can_take_caption(op):
+            j = _next_index(ops, i)
+            if j < len(ops) and _fits_caption(ops[j]):
+                op = replace(op, text=ops[j].text, parse_mode=ops[j].parse_mode, entities=ops[j].entities)
+                i = j
+
+        if op.kind == "photo" and op.reply_markup is None:
+            group = [op]
+            j = _next_index(ops, i)
+            while (
+                j < len(ops)
+                and len(group) < MEDIA_GROUP_LIMIT
+                and ops[j].kind == "photo"
+                and not ops[j].text
+                and ops[j].reply_markup is None
+            ):
+                group.append(ops[j])
+                i = j
+                j = _next_index(ops, i)
+            if len(group) > 1:
+                op = Op(
+                    "media_group",
+                    text=group[0].text,
+                    parse_mode=group[0].parse_mode,
+                    entities=group[0].entities,
+                    paths=tuple(g.path for g in group),
+                )
+
+        result.append(op)
+        i += 1
+    return result
+
+
+def plan(ops: Iterable[Op], pacing: bool = False) -> List[Op]:
+    """Разметка разбирается заранее; pacing=True — авторский темп: отправки
+    и паузы уходят как есть"""
+    ops = format_ops(ops)
+    return ops if pacing else coalesce(ops)
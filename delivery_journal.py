@@ -0,0 +1,163 @@
+# delivery_journal.py — на каком шаге остановилась доставка части маршрута в каждом чате
+#
+# Точка уходит десятком сообщений с паузами, и перезапуск процесса посреди
+# неё (деплой, OOM, пересоздание машины) оставляет пешехода с половиной
+# точки и без кнопок. Перед доставкой чат получает курсор: какая часть
+# маршрута и сколько её шагов уже выполнено; после каждой отправки курсор
+# сдвигается, по окончании — удаляется. После перезапуска незаконченные
+# доставки продолжаются со следующего шага.
+#
+# Сдвиг курсора — только запись в словарь. В SQLite изменения уходят фоновой
+# задачей раз в flush_interval секунд одной транзакцией, а доставка, которая
+# началась и закончилась между записями, на диск не попадает вовсе. Цена —
+# после падения шаги последних flush_interval секунд уйдут повторно.
+# before_write — запись, которая должна попасть на диск раньше курсоров
+# (состояние сессии, с которым начата доставка).
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Cursor(NamedTuple):
+    version: str                 # версия маршрута: шаги другой версии не совпадут
+    part: str                    # intro | navigation | content | branch | final
+    point: int                   # номер точки; -1 у intro и final
+    step: int = 0                # сколько шагов плана уже выполнено
+    low_data: bool = False
+    group: Optional[str] = None  # код группы, если чат ведёт её как гид
+    updated_at: float = 0
+
+
+class DeliveryJournal:
+    """Курсоры доставок в памяти и отложенная пакетная запись их в SQLite"""
+
+    def __init__(self, db_path: Path, flush_interval: float = 0.5,
+                 before_write: Optional[Callable[[], Awaitable[None]]] = None):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.before_write = before_write
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS delivery_cursors ("
+                " chat_id INTEGER PRIMARY KEY,"
+                " version TEXT NOT NULL,"
+                " part TEXT NOT NULL,"
+                " point INTEGER NOT NULL,"
+                " step INTEGER NOT NULL,"
+                " low_data INTEGER NOT NULL,"
+                " group_code TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+        self._cursors: Dict[int, Cursor] = {}
+        self._dirty: Set[int] = set()
+        # Чаты, у которых в базе есть строка: только их нужно удалять
+        self._stored: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.writes = 0
+
+    @property
+    def active(self) -> int:
+        return len(self._cursors)
+
+    def get(self, chat_id: int) -> Optional[Cursor]:
+        return self._cursors.get(chat_id)
+
+    def begin(self, chat_id: int, cursor: Cursor) -> None:
+        self._cursors[chat_id] = cursor._replace(updated_at=time.time())
+        self._dirty.add(chat_id)
+
+    def advance(self, chat_id: int, step: int) -> None:
+        cursor = self._cursors.get(chat_id)
+        if cursor is not None:
+            self._cursors[chat_id] = cursor._replace(step=step, updated_at=time.time())
+            self._dirty.add(chat_id)
+
+    def finish(self, chat_id: int) -> None:
+        if self._cursors.pop(chat_id, None) is not None or chat_id in self._stored:
+            self._dirty.add(chat_id)
+
+    def _write(self, upserts: List[Tuple[int, Cursor]], deletes: List[int]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO delivery_cursors"
+                " (chat_id, version, part, point, step, low_data, group_code, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(chat_id, *cursor) for chat_id, cursor in upserts],
+            )
+            self._db.executemany(
+                "DELETE FROM delivery_cursors WHERE chat_id = ?", [(c,) for c in deletes]
+            )
+
+    def _load(self, max_age: float) -> Dict[int, Cursor]:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM delivery_cursors WHERE updated_at < ?", (time.time() - max_age,)
+            )
+            rows = self._db.execute(
+                "SELECT chat_id, version, part, point, step, low_data, group_code, updated_at"
+                " FROM delivery_cursors"
+            ).fetchall()
+        return {
+            row[0]: Cursor(row[1], row[2], row[3], row[4], bool(row[5]), row[6], row[7])
+            for row in rows
+        }
+
+    async def interrupted(self, max_age: float) -> Dict[int, Cursor]:
+        """Доставки, которые прошлый процесс не закончил; курсоры старше
+        max_age секунд удаляются без продолжения"""
+        cursors = await asyncio.to_thread(self._load, max_age)
+        self._stored.update(cursors)
+        return cursors
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts = [(c, self._cursors[c]) for c in dirty if c in self._cursors]
+        deletes = [c for c in dirty if c not in self._cursors and c in self._stored]
+        if not upserts and not deletes:
+            return
+        try:
+            if upserts and self.before_write:
+                await self.before_write()
+            await asyncio.to_thread(self._write, upserts, deletes)
+        except Exception:
+            logger.exception("Не удалось записать %s курсоров доставки", len(upserts) + len(deletes))
+            self._dirty |= dirty
+            return
+        self.writes += 1
+        self._stored.difference_update(deletes)
+        self._stored.update(c for c, _ in upserts)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
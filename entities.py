@@ -0,0 +1,156 @@
+# entities.py — разбор Markdown один раз при загрузке маршрута: текст и MessageEntity
+#
+# Telegram разбирает parse_mode="Markdown" на своей стороне и отклоняет всё
+# сообщение, если разметка не сходится (незакрытая «*» или «_»), — и доставка
+# точки обрывается на середине. Здесь разметка разбирается заранее по тем же
+# правилам (устаревший Markdown Bot API), ошибка видна при загрузке маршрута,
+# а отправляются готовые текст и entities. Смещения entities — в единицах UTF-16,
+# как их считает Telegram.
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from telegram import MessageEntity
+
+# Лимиты Telegram, в единицах UTF-16
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+ESCAPABLE = "_*`["
+_URL_RE = re.compile(r"^(https?://|tg://)\S+$|^[\w-]+(\.[\w-]+)+(/\S*)?$")
+
+
+class MarkupError(ValueError):
+    """Разметка не сходится; в тексте — где именно"""
+
+
+class Formatted(NamedTuple):
+    text: str
+    entities: Tuple[MessageEntity, ...] = ()
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _context(text: str, pos: int) -> str:
+    return repr(text[max(0, pos - 15):pos + 25])
+
+
+@lru_cache(maxsize=1024)
+def parse_markdown(text: str) -> Formatted:
+    """*жирный*, _курсив_, `код`, ```блок```, [текст](url); «\\» экранирует _*`[ вне entity.
+    Вложенных entities нет: внутри одной другие символы разметки — обычный текст."""
+    out: List[str] = []
+    entities: List[MessageEntity] = []
+    offset = 0          # длина out в UTF-16
+    i, size = 0, len(text)
+    while i < size:
+        c = text[i]
+        if c == "\\" and i + 1 < size and text[i + 1] in ESCAPABLE:
+            out.append(text[i + 1])
+            offset += 1
+            i += 2
+            continue
+        if c not in ESCAPABLE:
+            out.append(c)
+            offset += utf16_len(c)
+            i += 1
+            continue
+
+        begin = i
+        end_char = "]" if c == "[" else c
+        i += 1
+        is_pre = False
+        language: Optional[str] = None
+        if text.startswith("``", i) and c == "`":
+            is_pre = True
+            i += 2
+            match = re.match(r"[^\s`]+", text[i:])
+            if match and i + match.end() < size and text[i + match.end()] != "`":
+                language = match.group()
+                i += match.end()
+            if text.startswith(("\r\n", "\n\r"), i):
+                i += 2
+            elif text.startswith(("\n", "\r"), i):
+                i += 1
+
+        start = offset
+        while i < size and (text[i] != end_char or (is_pre and not text.startswith("``", i + 1))):
+            out.append(text[i])
+            offset += utf16_len(text[i])
+            i += 1
+        if i == size:
+            raise MarkupError(f"не закрыт «{c}», открытый в позиции {begin}: {_context(text, begin)}")
+
+        length = offset - start
+        if c == "[":
+            label = text[begin + 1:i]
+            if not text.startswith("(", i + 1):
+                raise MarkupError(
+                    f"после [{label}] нет (ссылки); обычную «[» нужно писать как \\[: {_context(text, begin)}"
+                )
+            close = text.find(")", i + 2)
+            if close < 0:
+                raise MarkupError(f"не закрыта «(» ссылки [{label}]: {_context(text, begin)}")
+            url = text[i + 2:close]
+            if not _URL_RE.match(url):
+                raise MarkupError(f"неверная ссылка {url!r} у [{label}]")
+            i = close
+            if length:
+                entities.append(MessageEntity(MessageEntity.TEXT_LINK, start, length, url=url))
+        elif length:
+            if c == "*":
+                entities.append(MessageEntity(MessageEntity.BOLD, start, length))
+            elif c == "_":
+                entities.append(MessageEntity(MessageEntity.ITALIC, start, length))
+            elif is_pre:
+                entities.append(MessageEntity(MessageEntity.PRE, start, length, language=language))
+            else:
+                entities.append(MessageEntity(MessageEntity.CODE, start, length))
+        i += 3 if is_pre else 1
+    return Formatted("".join(out), tuple(entities))
+
+
+def _clip(entities: Sequence[MessageEntity], start: int, end: int) -> Tuple[MessageEntity, ...]:
+    """Entities, попавшие в [start, end) в UTF-16, со смещениями от start"""
+    clipped = []
+    for e in entities:
+        s, t = max(e.offset, start), min(e.offset + e.length, end)
+        if t > s:
+            clipped.append(MessageEntity(e.type, s - start, t - s, url=e.url, language=e.language))
+    return tuple(clipped)
+
+
+def _cut(text: str, limit: int) -> int:
+    """Где закончить кусок не длиннее limit: на границе абзаца, иначе строки, иначе слова"""
+    fits, used = 0, 0
+    for ch in text:
+        used += utf16_len(ch)
+        if used > limit:
+            break
+        fits += 1
+    head = text[:fits]
+    for sep in ("\n\n", "\n", " "):
+        pos = head.rfind(sep)
+        if pos > 0 and head[:pos].strip():
+            return pos
+    return fits
+
+
+def split_formatted(formatted: Formatted, limit: int, first_limit: Optional[int] = None) -> List[Formatted]:
+    """Делит текст на сообщения не длиннее limit (первое — first_limit, для подписи);
+    entities на границе делятся между кусками"""
+    text, base = formatted.text, 0
+    chunks: List[Formatted] = []
+    current = first_limit or limit
+    while utf16_len(text) > current:
+        cut = _cut(text, current)
+        head = text[:cut].rstrip()
+        rest = text[cut:].lstrip()
+        chunks.append(Formatted(head, _clip(formatted.entities, base, base + utf16_len(head))))
+        base += utf16_len(text[:len(text) - len(rest)])
+        text = rest
+        current = limit
+    chunks.append(Formatted(text, _clip(formatted.entities, base, base + utf16_len(text))))
+    return chunks
@@ -0,0 +1,145 @@
+# geofence.py — «Я тут» без кнопки: точка открывается, когда трансляция
+# геопозиции входит в круг вокруг неё
+#
+# Трансляция присылает edited_message каждые несколько секунд от каждого
+# пешехода, поэтому путь апдейта сделан дешёвым:
+#   LocationGate — до разбора апдейта: не чаще раза в min_interval на чат
+#                  и только если точка попала в ячейку сетки рядом с какой-то зоной;
+#   Arrivals     — в обработчике: проверяется только следующая точка сессии,
+#                  вход и выход разнесены (гистерезис), чтобы дрожание GPS
+#                  на границе не открывало точку повторно.
+import math
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+EARTH_RADIUS_M = 6_371_000
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+# Выход из зоны — на таком расстоянии от центра, в радиусах
+EXIT_FACTOR = 1.5
+
+
+class Fence(NamedTuple):
+    lat: float
+    lon: float
+    radius: float   # метры
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние в метрах; равнопромежуточное приближение, точное в пределах города"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def message_location(data: dict) -> Optional[Tuple[int, float, float]]:
+    """(chat_id, широта, долгота) из сырого апдейта с геопозицией, иначе None"""
+    message = data.get("edited_message") or data.get("message")
+    if not isinstance(message, dict):
+        return None
+    location = message.get("location")
+    chat = message.get("chat")
+    if not isinstance(location, dict) or not isinstance(chat, dict):
+        return None
+    try:
+        return int(chat["id"]), float(location["latitude"]), float(location["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class GridIndex:
+    """Ячейки сетки, которые задевает хотя бы одна зона (с запасом на выход).
+    Проверка «рядом ли какая-нибудь точка» — одно обращение к множеству."""
+
+    def __init__(self, fences: Iterable[Fence], cell_m: float = 250):
+        fences = list(fences)
+        self.cell_m = cell_m
+        self._lat_step = cell_m / METERS_PER_DEGREE
+        # Ячейки по долготе считаются для одной широты: маршрут — в пределах города
+        ref_lat = sum(f.lat for f in fences) / len(fences) if fences else 0.0
+        self._lon_step = self._lat_step / max(math.cos(math.radians(ref_lat)), 0.01)
+        self._cells: Set[Tuple[int, int]] = set()
+        for fence in fences:
+            self._add(fence)
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self._lat_step), math.floor(lon / self._lon_step)
+
+    def _add(self, fence: Fence) -> None:
+        reach = fence.radius * EXIT_FACTOR / METERS_PER_DEGREE
+        reach_lon = reach / max(math.cos(math.radians(fence.lat)), 0.01)
+        lat0, lon0 = self._cell(fence.lat - reach, fence.lon - reach_lon)
+        lat1, lon1 = self._cell(fence.lat + reach, fence.lon + reach_lon)
+        for i in range(lat0, lat1 + 1):
+            for j in range(lon0, lon1 + 1):
+                self._cells.add((i, j))
+
+    def near(self, lat: float, lon: float) -> bool:
+        return self._cell(lat, lon) in self._cells
+
+
+class LocationGate:
+    """Отсев апдейтов геопозиции до разбора: остальные апдейты пропускаются как есть"""
+
+    def __init__(self, min_interval: float = 3.0, max_chats: int = 100_000):
+        self.min_interval = min_interval
+        self.max_chats = max_chats
+        self.index: Optional[GridIndex] = None   # None — зоны неизвестны, только частота
+        self._last: Dict[int, float] = {}
+        self.passed = 0
+        self.throttled = 0
+        self.far = 0
+
+    def allow(self, data: dict, now: Optional[float] = None) -> bool:
+        found = message_location(data)
+        if found is None:
+            return True
+        chat_id, lat, lon = found
+        if "message" in data:
+            # Начало трансляции или разовая геопозиция — всегда доходят до бота
+            self.passed += 1
+            return True
+        now = time.monotonic() if now is None else now
+        if now - self._last.get(chat_id, -math.inf) < self.min_interval:
+            self.throttled += 1
+            return False
+        if len(self._last) >= self.max_chats:
+            self._last.clear()
+        self._last[chat_id] = now
+        if self.index is not None and not self.index.near(lat, lon):
+            self.far += 1
+            return False
+        self.passed += 1
+        return True
+
+
+class Arrivals:
+    """Внутри ли чат зоны ожидаемой точки; arrived() — True только в момент входа"""
+
+    def __init__(self, max_chats: int = 100_000):
+        self.max_chats = max_chats
+        # chat_id -> (ключ ожидаемой точки, внутри ли зоны)
+        self._state: Dict[int, Tuple[object, bool]] = {}
+        self.triggered = 0
+
+    def arrived(self, chat_id: int, key: object, fence: Fence, lat: float, lon: float) -> bool:
+        distance = distance_m(lat, lon, fence.lat, fence.lon)
+        state = self._state.get(chat_id)
+        inside = state is not None and state[0] == key and state[1]
+        if inside:
+            inside = distance <= fence.radius * EXIT_FACTOR
+            entered = False
+        else:
+            inside = entered = distance <= fence.radius
+        if state is None and len(self._state) >= self.max_chats:
+            self._state.clear()
+        self._state[chat_id] = (key, inside)
+        if entered:
+            self.triggered += 1
+        return entered
+
+    def forget(self, chat_id: int) -> None:
+        self._state.pop(chat_id, None)
@@ -0,0 +1,162 @@
+# group_tour.py — экскурсия с гидом: нажатия гида ведут группу участников
+#
+# Гид создаёт группу (/guide) и получает код, участники присоединяются
+# по нему (/join КОД). Всё, что бот отправляет гиду по ходу маршрута, в ту же
+# секунду уходит участникам; сами они кнопок точек не нажимают.
+# Состояние групп хранится в SQLite рядом с сессиями: в кластере гид
+# и участники обрабатываются разными процессами.
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Без похожих друг на друга символов: код диктуют вслух и пишут на табличке
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+CODE_LENGTH = 5
+# К группе старше этого (секунды) присоединиться уже нельзя
+MAX_AGE = 24 * 3600
+
+
+def new_code() -> str:
+    return "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+def normalize_code(text: str) -> str:
+    return text.strip().upper().replace("-", "").replace(" ", "")
+
+
+class GroupDb:
+    """Группы и их участники. Методы синхронные — вызываются в потоке."""
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tour_groups ("
+                " code TEXT PRIMARY KEY,"
+                " guide_chat_id INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " closed_at REAL,"
+                # Где сейчас группа: с этого места участник продолжает сам
+                " version TEXT,"
+                " idx INTEGER NOT NULL DEFAULT 0,"
+                " visited TEXT NOT NULL DEFAULT '[]')"
+            )
+            # Чат может быть участником только одной группы
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tour_group_members ("
+                " chat_id INTEGER PRIMARY KEY,"
+                " code TEXT NOT NULL,"
+                " joined_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS tour_group_members_code ON tour_group_members (code)"
+            )
+
+    def _row(self, code: str) -> Optional[Dict[str, Any]]:
+        self._db.row_factory = sqlite3.Row
+        try:
+            row = self._db.execute("SELECT * FROM tour_groups WHERE code = ?", (code,)).fetchone()
+        finally:
+            self._db.row_factory = None
+        if row is None:
+            return None
+        group = dict(row)
+        group["visited"] = json.loads(group["visited"])
+        return group
+
+    def create(self, guide_chat_id: int) -> str:
+        """Новая группа гида; прежние его группы закрываются"""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE tour_groups SET closed_at = ? WHERE guide_chat_id = ? AND closed_at IS NULL",
+                (now, guide_chat_id),
+            )
+            while True:
+                code = new_code()
+                try:
+                    self._db.execute(
+                        "INSERT INTO tour_groups (code, guide_chat_id, created_at) VALUES (?, ?, ?)",
+                        (code, guide_chat_id, now),
+                    )
+                    return code
+                except sqlite3.IntegrityError:
+                    continue
+
+    def get(self, code: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._row(code)
+
+    def join(self, code: str, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Группа, к которой присоединился чат; None — кода нет или группа закрыта"""
+        with self._lock, self._db:
+            group = self._row(code)
+            if (
+                group is None
+                or group["closed_at"] is not None
+                or group["created_at"] < time.time() - MAX_AGE
+                or group["guide_chat_id"] == chat_id
+            ):
+                return None
+            self._db.execute(
+                "INSERT OR REPLACE INTO tour_group_members (chat_id, code, joined_at) VALUES (?, ?, ?)",
+                (chat_id, code, time.time()),
+            )
+            return group
+
+    def leave(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Группа, из которой вышел чат; None — чат ни в какой группе не был"""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT code FROM tour_group_members WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM tour_group_members WHERE chat_id = ?", (chat_id,))
+            return self._row(row[0])
+
+    def members(self, code: str) -> List[int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chat_id FROM tour_group_members WHERE code = ? ORDER BY joined_at", (code,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def remove(self, chat_ids: List[int]) -> None:
+        """Участники, которые заблокировали бота"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM tour_group_members WHERE chat_id = ?", [(c,) for c in chat_ids]
+            )
+
+    def progress(self, code: str, version: str, idx: int, visited: List[int]) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE tour_groups SET version = ?, idx = ?, visited = ? WHERE code = ?",
+                (version, idx, json.dumps(sorted(visited)), code),
+            )
+
+    def finish(self, code: str) -> List[int]:
+        """Закрывает группу; возвращает бывших участников"""
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT chat_id FROM tour_group_members WHERE code = ?", (code,)
+            ).fetchall()
+            self._db.execute("DELETE FROM tour_group_members WHERE code = ?", (code,))
+            self._db.execute(
+                "UPDATE tour_groups SET closed_at = ? WHERE code = ? AND closed_at IS NULL",
+                (time.time(), code),
+            )
+        return [r[0] for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,117 @@
+# media_cache.py — постоянный кэш file_id Telegram для файлов из assets
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# (путь, размер, sha256)
+AssetKey = Tuple[str, int, str]
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileIdCache:
+    """Хранит file_id, который Telegram вернул после первой загрузки файла.
+
+    Ключ — путь + размер + sha256 содержимого, поэтому заменённый файл
+    с тем же именем будет загружен заново, а не отправлен старым file_id.
+    get/put/invalidate обращаются к SQLite в потоке: файл общий для процессов
+    кластера, и занятая другим процессом запись не должна держать цикл событий.
+    sha256() вызывается и из потока перезагрузки маршрута (см. bot.reload_tour).
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), isolation_level=None, timeout=5, check_same_thread=False)
+        # Файл может быть общим для нескольких процессов (см. cluster.py)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " PRIMARY KEY (path, size, sha256))"
+        )
+        # Хэши по (путь, размер, mtime): при запуске файлы не перечитываются
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL)"
+        )
+        self._ids: Dict[AssetKey, str] = {}
+        for path, size, sha256, file_id in self._db.execute(
+            "SELECT path, size, sha256, file_id FROM file_ids"
+        ):
+            self._ids[(path, size, sha256)] = file_id
+
+    def _select(self, key: AssetKey) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id FROM file_ids WHERE path = ? AND size = ? AND sha256 = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def _insert(self, key: AssetKey, file_id: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_ids (path, size, sha256, file_id) VALUES (?, ?, ?, ?)",
+                (*key, file_id),
+            )
+
+    def _delete(self, key: AssetKey) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM file_ids WHERE path = ? AND size = ? AND sha256 = ?", key
+            )
+
+    async def get(self, key: AssetKey) -> Optional[str]:
+        file_id = self._ids.get(key)
+        if file_id is None:
+            # Файл мог загрузить другой процесс
+            file_id = await asyncio.to_thread(self._select, key)
+            if file_id:
+                self._ids[key] = file_id
+        return file_id
+
+    async def put(self, key: AssetKey, file_id: str) -> None:
+        if self._ids.get(key) == file_id:
+            return
+        self._ids[key] = file_id
+        await asyncio.to_thread(self._insert, key, file_id)
+
+    async def invalidate(self, key: AssetKey) -> None:
+        self._ids.pop(key, None)
+        await asyncio.to_thread(self._delete, key)
+
+    def sha256(self, path: Path, size: int, mtime_ns: int) -> str:
+        """sha256 файла; пересчитывается, только если изменились размер или mtime"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path.as_posix(), size, mtime_ns),
+            ).fetchone()
+        if row:
+            return row[0]
+        digest = file_sha256(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path.as_posix(), size, mtime_ns, digest),
+            )
+        return digest
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
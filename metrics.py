@@ -0,0 +1,365 @@
+# metrics.py — метрики в формате Prometheus и отладочные страницы на порту webhook
+#
+#   /metrics                                — все метрики процесса
+#   /healthz                                — жив ли процесс и как прошёл запуск
+#   /debug/tasks?token=…                    — стеки всех asyncio-задач
+#   /debug/profile?token=…&seconds=10&top=40 — семплирующий профиль цикла событий
+#
+# Отладочные страницы включаются, только если задан DEBUG_TOKEN.
+import asyncio
+import hmac
+import io
+import json
+import math
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import tornado.web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, "_Metric"] = {}
+
+    def register(self, metric: "_Metric") -> None:
+        # Повторная регистрация (например, при повторном импорте) заменяет метрику
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def lines(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def lines(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+
+class FuncMetric(_Metric):
+    """Значение без меток, которое считывается в момент запроса /metrics"""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float], type: str = "gauge",
+                 registry: Registry = REGISTRY):
+        self.type = type
+        self.fn = fn
+        super().__init__(name, help, registry=registry)
+
+    def lines(self) -> Iterator[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # метки -> (счётчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[0][i] += 1
+                break
+        data[1] += value
+        data[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def lines(self) -> Iterator[str]:
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+# ---- Запуск ----
+
+BOOT_SECONDS = Gauge("bot_boot_seconds", "Этапы запуска процесса", ("phase",))
+
+
+class BootTimer:
+    """Время запуска по этапам (каждый — от конца предыдущего) и первые события
+    после запуска (от начала), например первый отправленный ответ"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.restart(started)
+
+    def restart(self, started: Optional[float] = None) -> None:
+        self.started = started if started is not None else time.perf_counter()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+        self.events: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+        BOOT_SECONDS.set(self.phases[phase], phase=phase)
+
+    def first(self, event: str) -> None:
+        if event not in self.events:
+            self.events[event] = time.perf_counter() - self.started
+            BOOT_SECONDS.set(self.events[event], phase=event)
+
+    def report(self) -> str:
+        parts = [f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.phases.items()]
+        parts += [f"{name} через {seconds * 1000:.0f} мс" for name, seconds in self.events.items()]
+        return "Запуск: " + ", ".join(parts)
+
+
+BOOT = BootTimer()
+
+
+# ---- Задержка цикла событий ----
+
+LOOP_LAG = Gauge("bot_event_loop_lag_seconds", "Последняя измеренная задержка цикла событий")
+LOOP_LAG_HISTOGRAM = Histogram(
+    "bot_event_loop_lag_hist_seconds", "Задержка цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+class LoopLagMonitor:
+    """Засыпает на interval и меряет, насколько позже цикл его разбудил"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# ---- Профилирование ----
+
+def dump_tasks() -> str:
+    out = io.StringIO()
+    tasks = sorted(asyncio.all_tasks(), key=lambda t: t.get_name())
+    out.write(f"{len(tasks)} задач\n\n")
+    for task in tasks:
+        out.write(f"--- {task.get_name()} {task.get_coro()!r}\n")
+        task.print_stack(limit=20, file=out)
+        out.write("\n")
+    return out.getvalue()
+
+
+def sample_profile(thread_id: int, seconds: float, interval: float = 0.005, top: int = 40) -> str:
+    """Семплирует стек потока thread_id; запускается в отдельном потоке"""
+    own: _Tally = _Tally()
+    total: _Tally = _Tally()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples += 1
+            code = frame.f_code
+            own[(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    total[key] += 1
+                frame = frame.f_back
+        time.sleep(interval)
+
+    def table(title: str, tally: _Tally) -> str:
+        rows = [f"{title}:"]
+        for (filename, line, name), n in tally.most_common(top):
+            rows.append(f"{n / max(samples, 1) * 100:6.1f}%  {name}  {filename}:{line}")
+        return "\n".join(rows)
+
+    return "\n\n".join([
+        f"{samples} выборок за {seconds:g} с (каждые {interval * 1000:g} мс)",
+        table("Сами по себе (вершина стека)", own),
+        table("Включая вызванные", total),
+    ]) + "\n"
+
+
+# ---- HTTP ----
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, registry: Registry):
+        self.registry = registry
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(self.registry.render())
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Для проверок хостинга и внешних пингов, которые не дают сервису уснуть"""
+
+    def initialize(self, ready: Callable[[], bool]):
+        self.ready = ready
+
+    def get(self):
+        ready = self.ready()
+        self.set_status(200 if ready else 503)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({
+            "ready": ready,
+            "uptime": round(time.perf_counter() - BOOT.started, 3),
+            "boot": {k: round(v, 3) for k, v in {**BOOT.phases, **BOOT.events}.items()},
+        }))
+
+    head = get
+
+
+class _DebugHandler(tornado.web.RequestHandler):
+    def initialize(self, token: str, loop_thread: int):
+        self.token = token
+        self.loop_thread = loop_thread
+
+    def prepare(self):
+        token = self.get_query_argument("token", "")
+        if not hmac.compare_digest(token.encode(), self.token.encode()):
+            raise tornado.web.HTTPError(403)
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+
+
+class TasksHandler(_DebugHandler):
+    def get(self):
+        self.finish(dump_tasks())
+
+
+class ProfileHandler(_DebugHandler):
+    async def get(self):
+        try:
+            seconds = float(self.get_query_argument("seconds", "10"))
+            top = int(self.get_query_argument("top", "40"))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        # nan не проходит сравнение и тоже отклоняется
+        if not seconds > 0:
+            raise tornado.web.HTTPError(400)
+        seconds = min(seconds, 120)
+        top = max(top, 1)
+        report = await asyncio.to_thread(sample_profile, self.loop_thread, seconds, top=top)
+        self.finish(report)
+
+
+def metrics_routes(debug_token: Optional[str] = None, ready: Callable[[], bool] = lambda: True,
+                   registry: Registry = REGISTRY) -> list:
+    """Маршруты tornado для сервера webhook; вызывать из потока цикла событий"""
+    routes = [
+        (r"/metrics", MetricsHandler, {"registry": registry}),
+        (r"/healthz", HealthHandler, {"ready": ready}),
+    ]
+    if debug_token:
+        args = {"token": debug_token, "loop_thread": threading.get_ident()}
+        routes += [
+            (r"/debug/tasks", TasksHandler, args),
+            (r"/debug/profile", ProfileHandler, args),
+        ]
+    return routes
@@ -0,0 +1,250 @@
+# rate_limiter.py — общий планировщик исходящих запросов к Bot API
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram import InputFile
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше — важнее
+PRIORITY_INTERACTIVE = 0  # правки сообщений (кнопки под ними)
+PRIORITY_TEXT = 1         # короткие сообщения, в том числе файлы по file_id
+PRIORITY_MEDIA = 2        # загрузки фото, голосовых и документов
+PRIORITY_BULK = 3         # рассылки и прочая фоновая отправка
+
+PRIORITY_NAMES = {
+    "interactive": PRIORITY_INTERACTIVE,
+    "text": PRIORITY_TEXT,
+    "media": PRIORITY_MEDIA,
+    "bulk": PRIORITY_BULK,
+}
+LANE_NAMES = {priority: name for name, priority in PRIORITY_NAMES.items()}
+
+SEND_QUEUED = Gauge("bot_send_queued", "Запросы, ждущие лимита отправки, по полосам", ("lane",))
+SEND_WAIT_SECONDS = Histogram(
+    "bot_send_wait_seconds", "Ожидание лимита отправки до начала запроса", ("lane",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+# Запросы, которые Telegram считает отправкой сообщений и ограничивает по частоте.
+# Остальные (answerCallbackQuery, getMe, …) идут мимо очереди сразу
+LIMITED_PREFIXES = ("send", "copyMessage", "forwardMessage", "editMessage")
+
+
+def _is_upload(value: Any) -> bool:
+    """Загружаемый файл: байты или путь для своего сервера Bot API, а не file_id"""
+    return isinstance(value, InputFile) or (isinstance(value, str) and value.startswith("file://"))
+
+
+def carries_files(data: Dict[str, Any]) -> bool:
+    for value in data.values():
+        for item in value if isinstance(value, (list, tuple)) else (value,):
+            # InputMedia альбома: файл в media и thumbnail
+            parts = (item, getattr(item, "media", None), getattr(item, "thumbnail", None))
+            if any(_is_upload(part) for part in parts):
+                return True
+    return False
+
+
+def request_priority(endpoint: str, data: Dict[str, Any]) -> int:
+    """Полоса по содержимому запроса: повторная отправка по file_id — короткий
+    запрос и идёт вместе с текстами, медленной полосой — только загрузки"""
+    if carries_files(data):
+        return PRIORITY_MEDIA
+    if endpoint.startswith("editMessage"):
+        return PRIORITY_INTERACTIVE
+    return PRIORITY_TEXT
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self) -> float:
+        """Сколько ждать до следующего токена (0 — можно отправлять сейчас)"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        # После паузы — один токен на повтор; за саму паузу токены не копятся,
+        # иначе по её окончании чат сразу получил бы целую пачку
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 1
+        self.updated = self.paused_until
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                self.take()
+                return
+            await asyncio.sleep(delay)
+
+
+class SendScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """Планировщик исходящих запросов с лимитами Telegram.
+
+    Сначала запрос ждёт токен своего чата (личный чат или группа), затем встаёт
+    в общую очередь с приоритетами, откуда раздаются глобальные токены.
+    RetryAfter приостанавливает чат (или всю отправку, если чата нет) и запрос
+    повторяется прозрачно для обработчика.
+
+    В rate_limit_args можно передать {"priority": "bulk"} или число.
+    """
+
+    def __init__(
+        self,
+        overall_rate: float = 30,
+        private_chat_rate: float = 1,
+        private_chat_burst: float = 3,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3,
+        max_retries: int = 5,
+    ):
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._private = (private_chat_rate, private_chat_burst)
+        self._group = (group_rate, group_burst)
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._max_retries = max_retries
+
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        # Статистика; время ожидания по полосам — в SEND_WAIT_SECONDS
+        self.retry_after_count = 0
+        self._queued: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES.values()}
+
+    async def initialize(self) -> None:
+        # Application и Updater оба инициализируют бота, а с ним и планировщик
+        if self._dispatcher:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, fut in self._queue:
+            fut.cancel()
+        self._queue.clear()
+
+    # ---- Статистика ----
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._queued.values())
+
+    # ---- Очередь ----
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate, burst = self._group if is_group else self._private
+            bucket = self._chats[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._overall.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, fut = heapq.heappop(self._queue)
+            if fut.done():
+                # Обработчик отменили, пока запрос стоял в очереди
+                continue
+            self._overall.take()
+            fut.set_result(None)
+
+    async def _acquire_overall(self, priority: int) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), fut))
+        self._wakeup.set()
+        await fut
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if not endpoint.startswith(LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority")
+        if priority is None:
+            priority = request_priority(endpoint, data)
+        priority = PRIORITY_NAMES.get(priority, priority)
+        chat_id = data.get("chat_id")
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        lane = LANE_NAMES.get(priority, str(priority))
+
+        retries = 0
+        while True:
+            started = time.monotonic()
+            self._queued[priority] = self._queued.get(priority, 0) + 1
+            SEND_QUEUED.set(self._queued[priority], lane=lane)
+            try:
+                if chat_bucket:
+                    await chat_bucket.acquire()
+                await self._acquire_overall(priority)
+            finally:
+                self._queued[priority] -= 1
+                SEND_QUEUED.set(self._queued[priority], lane=lane)
+            SEND_WAIT_SECONDS.observe(time.monotonic() - started, lane=lane)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retries += 1
+                self.retry_after_count += 1
+                seconds = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                if retries > self._max_retries:
+                    raise
+                logger.warning(
+                    "RetryAfter %ss для %s (чат %s), попытка %s", seconds, endpoint, chat_id, retries
+                )
+                (chat_bucket or self._overall).pause(seconds)
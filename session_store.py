@@ -0,0 +1,154 @@
+# session_store.py — сохранение прогресса по маршруту между перезапусками
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, MutableMapping, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionBackend:
+    """Интерфейс хранилища. Методы синхронные — SessionStore вызывает их в потоке."""
+
+    def load(self, chat_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def save_many(self, items: List[Tuple[int, str]]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteSessionBackend(SessionBackend):
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " chat_id INTEGER PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def load(self, chat_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sessions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, items: List[Tuple[int, str]]) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO sessions (chat_id, state, updated_at) VALUES (?, ?, ?)",
+                [(chat_id, state, now) for chat_id, state in items],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Не сериализуется: {type(value).__name__}")
+
+
+class SessionStore:
+    """Ленивое восстановление и отложенная пакетная запись состояний чатов.
+
+    restore() читает состояние чата из хранилища один раз — при первом апдейте
+    после перезапуска. mark_dirty() только запоминает чат; фоновая задача раз
+    в flush_interval секунд сохраняет изменившиеся состояния одной транзакцией,
+    так что обработчики никогда не ждут диска.
+    """
+
+    def __init__(self, backend: SessionBackend, keys: Iterable[str], flush_interval: float = 2.0):
+        self.backend = backend
+        self.keys = tuple(keys)
+        self.flush_interval = flush_interval
+        self._restored: Set[int] = set()
+        self._dirty: Dict[int, MutableMapping] = {}
+        self._saved: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        # flush вызывается и фоновой задачей, и журналом доставки (см. bot.JOURNAL):
+        # записи идут по очереди, чтобы старое состояние не легло поверх нового
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def active(self) -> int:
+        """Сколько чатов восстановлено или начато в этом процессе"""
+        return len(self._restored)
+
+    def _encode(self, state: MutableMapping) -> str:
+        data = {k: state[k] for k in self.keys if k in state}
+        return json.dumps(data, default=_json_default, ensure_ascii=False, sort_keys=True)
+
+    async def restore(self, chat_id: int, state: MutableMapping) -> None:
+        if chat_id in self._restored:
+            return
+        self._restored.add(chat_id)
+        raw = await asyncio.to_thread(self.backend.load, chat_id)
+        if raw is None:
+            return
+        self._saved[chat_id] = raw
+        for key, value in json.loads(raw).items():
+            state.setdefault(key, value)
+
+    def mark_dirty(self, chat_id: int, state: MutableMapping) -> None:
+        self._restored.add(chat_id)
+        self._dirty[chat_id] = state
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        items = []
+        for chat_id, state in dirty.items():
+            raw = self._encode(state)
+            if self._saved.get(chat_id) != raw:
+                items.append((chat_id, raw))
+        if not items:
+            return
+        try:
+            await asyncio.to_thread(self.backend.save_many, items)
+        except Exception:
+            logger.exception("Не удалось сохранить %s сессий", len(items))
+            for chat_id, state in dirty.items():
+                self._dirty.setdefault(chat_id, state)
+            return
+        self._saved.update(items)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
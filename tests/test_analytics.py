@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+
+from analytics import EventLog, aggregate, iter_events
+
+
+def test_stop_during_write_waits_for_it(tmp_path):
+    log = EventLog(tmp_path, flush_interval=0.01)
+    original = log._write
+    started = threading.Event()
+    active = []
+    overlaps = []
+
+    def slow_write(lines):
+        if active:
+            overlaps.append(lines)
+        active.append(lines)
+        started.set()
+        time.sleep(0.1)
+        original(lines)
+        active.remove(lines)
+
+    log._write = slow_write
+
+    async def main():
+        log.track("start", 1)
+        await log.start()
+        await asyncio.to_thread(started.wait, 1)
+        # Фоновая задача отменяется посреди записи первой пачки
+        log.track("start", 2)
+        await log.stop()
+
+    asyncio.run(main())
+    assert overlaps == []
+    assert log.written == 2
+    assert aggregate(iter_events(tmp_path))["starts"]["start"] == 2
+
+
+def test_failed_write_is_logged_not_raised(tmp_path, caplog):
+    log = EventLog(tmp_path / "file-not-dir")
+    (tmp_path / "file-not-dir").write_text("")
+    log.track("start", 1)
+    asyncio.run(log.stop())
+    assert log.written == 0
+    assert "Не удалось записать 1 событий аналитики" in caplog.text
@@ -0,0 +1,54 @@
+import os
+
+import httpx
+
+from asset_store import AssetStore, MappedReader
+
+
+def test_large_file_is_mapped_and_read_without_copies(tmp_path):
+    path = tmp_path / "materials.pdf"
+    data = os.urandom(300_000)
+    path.write_bytes(data)
+    store = AssetStore(mmap_threshold=100_000)
+
+    reader = store.get(path)
+    assert isinstance(reader, MappedReader)
+    chunk = reader.read(65536)
+    assert isinstance(chunk, memoryview) and chunk == data[:65536]
+    assert reader.tell() == 65536
+    assert reader.read() == data[65536:]
+    assert reader.read(10) == b""
+    # У каждой загрузки своя позиция чтения
+    assert store.get(path).read(4) == data[:4]
+    assert store.hits == 1 and store.mapped_bytes == len(data)
+
+
+def test_mapped_reader_streams_through_httpx_multipart(tmp_path):
+    path = tmp_path / "materials.pdf"
+    data = os.urandom(200_000)
+    path.write_bytes(data)
+    reader = AssetStore(mmap_threshold=100_000).get(path)
+
+    request = httpx.Request("POST", "http://bot.api/", files={"document": ("materials.pdf", reader)})
+    body = b"".join(request.stream)
+    assert data in body
+    assert int(request.headers["Content-Length"]) == len(body)
+
+
+def test_small_file_is_cached_within_budget(tmp_path):
+    paths = []
+    for n in range(3):
+        paths.append(tmp_path / f"photo{n}.jpg")
+        paths[-1].write_bytes(bytes([n]) * 400)
+    store = AssetStore(budget_bytes=1000)
+
+    for path in paths:
+        assert store.get(path) == path.read_bytes()
+    # Третий файл вытеснил первый
+    assert store.resident_bytes == 800
+    store.get(paths[2])
+    store.get(paths[0])
+    assert (store.hits, store.misses) == (1, 4)
+
+    paths[2].write_bytes(b"x" * 10)
+    assert store.get(paths[2]) == b"x" * 10
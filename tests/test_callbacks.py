@@ -0,0 +1,127 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from callbacks import CALLBACK_DATA_LIMIT, SEP, Callback, decode_callback, encode_callback
+
+# bot читает окружение при импорте: база и файлы — во временном каталоге
+os.environ.setdefault("TELEGRAM_TOKEN", "1:test")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="tests-")
+import bot  # noqa: E402
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="module")
+def tour():
+    cwd = os.getcwd()
+    os.chdir(REPO)
+    try:
+        bot.load_tour()
+    finally:
+        os.chdir(cwd)
+    return bot.CURRENT_TOUR
+
+
+@pytest.mark.parametrize("action, idx, version", [
+    ("h", 0, "a13f68"),
+    ("y", 7, "a13f68"),
+    ("n", 12, "0123456789abcdef"),
+    ("h", 3, ""),
+])
+def test_round_trip(action, idx, version):
+    data = encode_callback(action, idx, version)
+    assert data == f"{action}:{idx}:{version}"
+    assert decode_callback(data) == Callback(action, idx, version)
+
+
+@pytest.mark.parametrize("data, expected", [
+    (None, Callback("")),
+    ("", Callback("")),
+    ("start_tour", Callback("start_tour")),
+    ("nav_next", Callback("nav_next")),
+    # Не кнопка точки: номер не число или частей не три
+    ("h:x:a13f68", Callback("h:x:a13f68")),
+    ("h:-1:a13f68", Callback("h:-1:a13f68")),
+    ("h:3", Callback("h:3")),
+    ("h:3:a:b", Callback("h:3:a:b")),
+])
+def test_decode_plain_and_malformed(data, expected):
+    assert decode_callback(data) == expected
+
+
+@pytest.mark.parametrize("version", [
+    "v" * (CALLBACK_DATA_LIMIT - len("h:1:") + 1),
+    # Лимит считается в байтах UTF-8, а не в символах
+    "ж" * 31,
+])
+def test_encode_rejects_payload_over_limit(version):
+    with pytest.raises(ValueError):
+        encode_callback("h", 1, version)
+
+
+def test_encode_accepts_payload_at_limit():
+    data = encode_callback("h", 1, "v" * (CALLBACK_DATA_LIMIT - len("h:1:")))
+    assert len(data.encode()) == CALLBACK_DATA_LIMIT
+
+
+def test_point_buttons_fit_for_every_point(tour):
+    for action in (bot.ACTION_IM_HERE, bot.ACTION_YES, bot.ACTION_NEXT):
+        data = encode_callback(action, len(tour.points) - 1, tour.version)
+        assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+        assert bot.CALLBACK_HANDLERS[decode_callback(data).action]
+
+
+def test_handler_actions_are_unambiguous():
+    # Действие с разделителем декодировалось бы как чужая кнопка точки
+    assert not any(SEP in action for action in bot.CALLBACK_HANDLERS)
+    # Кнопки из уже отправленных сообщений продолжают работать
+    for legacy in (bot.CB_IM_HERE, bot.CB_WANT_MORE, bot.CB_HEAR_VOICE_YES,
+                   bot.CB_NEXT, bot.CB_SKIP_AUDIO, bot.CB_HEAR_VOICE_NO):
+        assert legacy in bot.CALLBACK_HANDLERS
+
+
+def press(data: str, user_data=None):
+    """Нажатие кнопки через bot.on_callback; возвращает вызовы обработчика и ответы"""
+    calls = []
+
+    async def on_point(update, context, idx):
+        calls.append((idx, dict(context.user_data)))
+
+    query = SimpleNamespace(data=data, answer=mock.AsyncMock())
+    update = SimpleNamespace(callback_query=query, effective_chat=SimpleNamespace(id=1))
+    context = SimpleNamespace(user_data=dict(user_data or {}))
+    handlers = {action: on_point for action in bot.CALLBACK_HANDLERS}
+    with mock.patch.dict(bot.CALLBACK_HANDLERS, handlers):
+        asyncio.run(bot.on_callback(update, context))
+    return calls, query.answer.await_args_list
+
+
+def test_current_version_runs_handler(tour):
+    calls, answers = press(encode_callback(bot.ACTION_IM_HERE, 2, tour.version), {"version": "old"})
+    assert calls == [(2, {"version": tour.version})]
+    assert answers == [mock.call()]
+
+
+def test_stale_version_is_rejected(tour):
+    calls, answers = press(encode_callback(bot.ACTION_NEXT, 2, "gone00"), {"version": tour.version})
+    assert calls == []
+    assert answers == [mock.call(bot.STALE_BUTTON_TEXT, show_alert=True)]
+
+
+@pytest.mark.parametrize("data", ["unknown", "x:1:a13f68", ""])
+def test_unknown_action_is_only_answered(tour, data):
+    calls, answers = press(data)
+    assert calls == []
+    assert answers == [mock.call()]
+
+
+def test_legacy_button_uses_session_point(tour):
+    calls, answers = press(bot.CB_NEXT, {"idx": 4, "version": tour.version})
+    assert calls == [(None, {"idx": 4, "version": tour.version})]
+    assert answers == [mock.call()]
@@ -0,0 +1,189 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import delivery_journal
+from delivery_journal import Cursor, DeliveryJournal
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(delivery_journal, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def stored_rows(db_path):
+    with sqlite3.connect(str(db_path)) as db:
+        return dict(db.execute("SELECT chat_id, step FROM delivery_cursors").fetchall())
+
+
+def test_interrupted_delivery_survives_restart(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+
+    async def crash():
+        journal = DeliveryJournal(db_path)
+        journal.begin(1, Cursor("v1", "content", 3, low_data=True, group="G1"))
+        journal.advance(1, 2)
+        journal.begin(2, Cursor("v1", "intro", -1))
+        await journal.flush()
+        journal.advance(1, 4)
+        await journal.flush()
+        # Процесс умирает: stop() не вызывается, курсоры остаются в базе
+        journal.close()
+
+    async def restart():
+        journal = DeliveryJournal(db_path)
+        cursors = await journal.interrupted(max_age=3600)
+        journal.close()
+        return cursors
+
+    asyncio.run(crash())
+    cursors = asyncio.run(restart())
+    assert set(cursors) == {1, 2}
+    assert cursors[1] == Cursor("v1", "content", 3, 4, True, "G1", clock.now)
+    assert cursors[2].step == 0 and cursors[2].group is None
+
+
+def test_before_write_runs_before_cursors_are_written(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+    order = []
+
+    async def save_sessions():
+        # Курсоров на диске ещё нет: сессия попадает туда раньше них
+        order.append(("sessions", stored_rows(db_path)))
+
+    async def main():
+        journal = DeliveryJournal(db_path, before_write=save_sessions)
+        journal.begin(1, Cursor("v1", "content", 0))
+        await journal.flush()
+        order.append(("cursors", stored_rows(db_path)))
+        # Только удаление курсоров — сессии сбрасывать не нужно
+        journal.finish(1)
+        await journal.flush()
+        journal.close()
+
+    asyncio.run(main())
+    assert order == [("sessions", {}), ("cursors", {1: 0})]
+    assert stored_rows(db_path) == {}
+
+
+def test_finish_deletes_only_stored_rows(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+    writes = []
+
+    async def main():
+        journal = DeliveryJournal(db_path)
+        original = journal._write
+
+        def recording_write(upserts, deletes):
+            writes.append((upserts, deletes))
+            original(upserts, deletes)
+
+        journal._write = recording_write
+        # Доставка целиком между записями не трогает базу
+        journal.begin(1, Cursor("v1", "content", 0))
+        journal.advance(1, 3)
+        journal.finish(1)
+        await journal.flush()
+        assert writes == [] and journal.writes == 0
+
+        journal.begin(2, Cursor("v1", "content", 0))
+        await journal.flush()
+        journal.finish(2)
+        journal.finish(3)  # чата нет ни в памяти, ни в базе
+        await journal.flush()
+        journal.close()
+
+    asyncio.run(main())
+    assert [deletes for _, deletes in writes] == [[], [2]]
+    assert stored_rows(db_path) == {}
+
+
+def test_failed_write_keeps_cursors_dirty(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+
+    async def main():
+        journal = DeliveryJournal(db_path)
+        original = journal._write
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def flaky_write(upserts, deletes):
+            if failures:
+                raise failures.pop()
+            original(upserts, deletes)
+
+        journal._write = flaky_write
+        journal.begin(1, Cursor("v1", "content", 0))
+        await journal.flush()
+        assert journal.writes == 0 and stored_rows(db_path) == {}
+        # Следующая запись досылает то, что не удалось, вместе с новым
+        journal.advance(1, 2)
+        journal.begin(2, Cursor("v1", "intro", -1))
+        await journal.flush()
+        journal.close()
+        return journal.writes
+
+    assert asyncio.run(main()) == 1
+    assert stored_rows(db_path) == {1: 2, 2: 0}
+
+
+def test_failed_before_write_keeps_cursors_dirty(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+    failures = [OSError("disk full")]
+
+    async def save_sessions():
+        if failures:
+            raise failures.pop()
+
+    async def main():
+        journal = DeliveryJournal(db_path, before_write=save_sessions)
+        journal.begin(1, Cursor("v1", "content", 0))
+        await journal.flush()
+        assert stored_rows(db_path) == {}
+        await journal.flush()
+        journal.close()
+
+    asyncio.run(main())
+    assert stored_rows(db_path) == {1: 0}
+
+
+def test_interrupted_drops_stale_cursors(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+
+    async def main():
+        journal = DeliveryJournal(db_path)
+        journal.begin(1, Cursor("v1", "content", 0))
+        clock.now += 7200
+        journal.begin(2, Cursor("v1", "content", 1))
+        await journal.flush()
+        journal.close()
+
+        clock.now += 60
+        restarted = DeliveryJournal(db_path)
+        cursors = await restarted.interrupted(max_age=3600)
+        # Оставшийся курсор удаляется по finish(), хотя в этом процессе не писался
+        restarted.finish(2)
+        await restarted.flush()
+        restarted.close()
+        return cursors
+
+    assert list(asyncio.run(main())) == [2]
+    assert stored_rows(db_path) == {}
+
+
+def test_stop_flushes_pending_cursors(tmp_path, clock):
+    db_path = tmp_path / "journal.sqlite3"
+
+    async def main():
+        journal = DeliveryJournal(db_path, flush_interval=3600)
+        await journal.start()
+        journal.begin(1, Cursor("v1", "content", 0))
+        journal.advance(1, 5)
+        await journal.stop()
+        journal.close()
+
+    asyncio.run(main())
+    assert stored_rows(db_path) == {1: 5}
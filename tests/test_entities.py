@@ -0,0 +1,124 @@
+import pytest
+from telegram import MessageEntity
+
+from entities import (
+    CAPTION_LIMIT,
+    TEXT_LIMIT,
+    Formatted,
+    MarkupError,
+    parse_markdown,
+    split_formatted,
+    utf16_len,
+)
+
+
+def spans(formatted: Formatted):
+    return [(e.type, e.offset, e.length) for e in formatted.entities]
+
+
+def entity_text(formatted: Formatted, entity: MessageEntity) -> str:
+    """Текст под entity по смещениям UTF-16, как его выделит Telegram"""
+    raw = formatted.text.encode("utf-16-le")
+    return raw[entity.offset * 2:(entity.offset + entity.length) * 2].decode("utf-16-le")
+
+
+def test_escapes_are_plain_text():
+    f = parse_markdown(r"\*не жирный\* a\_b \[x] \`c\`")
+    assert f.text == "*не жирный* a_b [x] `c`"
+    assert f.entities == ()
+
+
+def test_markers_inside_entity_are_plain_text():
+    f = parse_markdown("*a_b* `c*d`")
+    assert f.text == "a_b c*d"
+    assert spans(f) == [(MessageEntity.BOLD, 0, 3), (MessageEntity.CODE, 4, 3)]
+
+
+def test_pre_block_with_language():
+    f = parse_markdown("```python\nprint(1)\n```")
+    assert f.text == "print(1)\n"
+    (pre,) = f.entities
+    assert (pre.type, pre.offset, pre.length, pre.language) == (MessageEntity.PRE, 0, 9, "python")
+
+
+def test_pre_block_without_language():
+    f = parse_markdown("до ```\nкод``` после")
+    assert f.text == "до код после"
+    (pre,) = f.entities
+    assert (pre.type, pre.offset, pre.length, pre.language) == (MessageEntity.PRE, 3, 3, None)
+
+
+def test_link():
+    f = parse_markdown("см. [сайт](https://example.com) и [бот](t.me/bot)")
+    assert f.text == "см. сайт и бот"
+    first, second = f.entities
+    assert (first.type, first.offset, first.length, first.url) == (
+        MessageEntity.TEXT_LINK, 4, 4, "https://example.com"
+    )
+    assert (second.offset, second.length, second.url) == (11, 3, "t.me/bot")
+
+
+@pytest.mark.parametrize("text", [
+    "*жирный",
+    "_курсив",
+    "`код",
+    "```py\nкод",
+    "[текст] без ссылки",
+    "[текст](https://example.com",
+    "[текст](не ссылка)",
+])
+def test_unclosed_or_broken_markup_raises(text):
+    with pytest.raises(MarkupError):
+        parse_markdown(text)
+
+
+def test_offsets_count_utf16_code_units():
+    f = parse_markdown("😀 *жир* _к_ 👩‍👩‍👧 [ссылка](https://example.com)")
+    assert f.text == "😀 жир к 👩‍👩‍👧 ссылка"
+    assert spans(f)[:2] == [(MessageEntity.BOLD, 3, 3), (MessageEntity.ITALIC, 7, 1)]
+    link = f.entities[2]
+    assert link.offset == 9 + utf16_len("👩‍👩‍👧 ")
+    assert [entity_text(f, e) for e in f.entities] == ["жир", "к", "ссылка"]
+
+
+def test_short_text_is_not_split():
+    f = parse_markdown("*коротко*")
+    assert split_formatted(f, TEXT_LIMIT, first_limit=CAPTION_LIMIT) == [f]
+
+
+def _assert_split_bold(source: Formatted, chunks, first_limit: int, limit: int):
+    assert len(chunks) >= 2
+    assert utf16_len(chunks[0].text) <= first_limit
+    assert all(utf16_len(c.text) <= limit for c in chunks[1:])
+    for chunk in chunks:
+        for e in chunk.entities:
+            assert 0 <= e.offset and e.offset + e.length <= utf16_len(chunk.text)
+    # Жирный кусок, разрезанный границей, продолжается в начале следующего сообщения
+    head, tail = chunks[0], chunks[1]
+    assert head.entities[-1].type == MessageEntity.BOLD
+    assert head.entities[-1].offset + head.entities[-1].length == utf16_len(head.text)
+    assert (tail.entities[0].type, tail.entities[0].offset) == (MessageEntity.BOLD, 0)
+    # Вместе куски дают исходный текст и исходное выделение (без пробелов на стыках)
+    bold = "".join(entity_text(c, e) for c in chunks for e in c.entities)
+    assert bold.replace(" ", "") == entity_text(source, source.entities[0]).replace(" ", "")
+    assert "".join(c.text for c in chunks).replace(" ", "") == source.text.replace(" ", "")
+
+
+def test_split_across_entity_at_caption_limit():
+    source = parse_markdown("а" * 1000 + " *" + "слово😀 " * 20 + "* хвост")
+    chunks = split_formatted(source, TEXT_LIMIT, first_limit=CAPTION_LIMIT)
+    assert len(chunks) == 2
+    _assert_split_bold(source, chunks, CAPTION_LIMIT, TEXT_LIMIT)
+
+
+def test_split_across_entity_at_text_limit():
+    source = parse_markdown("начало *" + "жирный😀 " * 600 + "* конец")
+    chunks = split_formatted(source, TEXT_LIMIT)
+    _assert_split_bold(source, chunks, TEXT_LIMIT, TEXT_LIMIT)
+
+
+def test_split_prefers_paragraph_boundary():
+    source = Formatted("а" * 3000 + "\n\n" + "б" * 3000)
+    first, second = split_formatted(source, TEXT_LIMIT)
+    assert first.text == "а" * 3000
+    assert second.text == "б" * 3000
@@ -0,0 +1,126 @@
+import math
+
+import pytest
+
+from geofence import EXIT_FACTOR, METERS_PER_DEGREE, Arrivals, Fence, GridIndex, distance_m
+
+# Красная площадь, зона 40 м
+FENCE = Fence(55.7539, 37.6208, 40)
+
+
+def shifted(fence: Fence, north_m: float, east_m: float):
+    """Точка в north_m метрах к северу и east_m к востоку от центра зоны"""
+    lat = fence.lat + north_m / METERS_PER_DEGREE
+    lon = fence.lon + east_m / (METERS_PER_DEGREE * math.cos(math.radians(fence.lat)))
+    return lat, lon
+
+
+def test_shifted_matches_distance():
+    assert distance_m(FENCE.lat, FENCE.lon, *shifted(FENCE, 30, 40)) == pytest.approx(50, abs=0.1)
+
+
+def test_enter_fires_once_while_inside():
+    arrivals = Arrivals()
+    fixes = [shifted(FENCE, 200, 0), shifted(FENCE, 100, 0), shifted(FENCE, 35, 0),
+             shifted(FENCE, 10, 5), (FENCE.lat, FENCE.lon), shifted(FENCE, -30, 10)]
+    fired = [arrivals.arrived(1, "p0", FENCE, lat, lon) for lat, lon in fixes]
+    assert fired == [False, False, True, False, False, False]
+    assert arrivals.triggered == 1
+
+
+def test_jitter_at_border_does_not_refire():
+    arrivals = Arrivals()
+    # Дрожание между радиусом входа и радиусом выхода
+    border = [shifted(FENCE, 38, 0), shifted(FENCE, 45, 0), shifted(FENCE, 39, 0),
+              shifted(FENCE, 55, 0), shifted(FENCE, 20, 0)]
+    fired = [arrivals.arrived(1, "p0", FENCE, lat, lon) for lat, lon in border]
+    assert fired == [True, False, False, False, False]
+
+
+def test_between_radii_from_outside_does_not_enter():
+    arrivals = Arrivals()
+    assert not arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, 0, 50))
+    assert not arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, 0, 45))
+    assert arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, 0, 39))
+
+
+def test_leave_past_exit_radius_and_return_fires_again():
+    arrivals = Arrivals()
+    exit_m = FENCE.radius * EXIT_FACTOR
+    assert arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, 0, 0))
+    assert not arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, exit_m + 5, 0))
+    # Вернулся, но ещё не в радиусе входа
+    assert not arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, exit_m - 5, 0))
+    assert arrivals.arrived(1, "p0", FENCE, *shifted(FENCE, 10, 0))
+    assert arrivals.triggered == 2
+
+
+def test_state_is_per_chat_and_per_point():
+    arrivals = Arrivals()
+    inside = shifted(FENCE, 5, 5)
+    assert arrivals.arrived(1, "p0", FENCE, *inside)
+    assert arrivals.arrived(2, "p0", FENCE, *inside)
+    # Следующая точка маршрута (или новая версия тура) — новый вход
+    assert arrivals.arrived(1, "p1", FENCE, *inside)
+    assert not arrivals.arrived(1, "p1", FENCE, *inside)
+    arrivals.forget(1)
+    assert arrivals.arrived(1, "p1", FENCE, *inside)
+
+
+def test_overflow_clears_state():
+    arrivals = Arrivals(max_chats=2)
+    inside = shifted(FENCE, 0, 0)
+    assert arrivals.arrived(1, "p0", FENCE, *inside)
+    assert arrivals.arrived(2, "p0", FENCE, *inside)
+    assert arrivals.arrived(3, "p0", FENCE, *inside)
+    # Состояние чата 1 сброшено вместе с остальными
+    assert arrivals.arrived(1, "p0", FENCE, *inside)
+
+
+def on_cell_corner(cell_m: float, lat: float, lon: float) -> Fence:
+    """Зона с центром точно на углу ячейки сетки рядом с (lat, lon)"""
+    lat_step = GridIndex([], cell_m=cell_m)._lat_step
+    lat = round(lat / lat_step) * lat_step
+    # Шаг по долготе сетка берёт по широте самой зоны
+    lon_step = GridIndex([Fence(lat, 0, 1)], cell_m=cell_m)._lon_step
+    return Fence(lat, round(lon / lon_step) * lon_step, 40)
+
+
+@pytest.mark.parametrize("lat, lon", [
+    (FENCE.lat, FENCE.lon),
+    # Южное и западное полушария: номера ячеек отрицательные
+    (-33.8568, 151.2153),
+    (40.6892, -74.0445),
+])
+def test_grid_covers_exit_radius_across_cell_boundaries(lat, lon):
+    fence = on_cell_corner(50, lat, lon)
+    index = GridIndex([fence], cell_m=50)
+    # Круг выхода (60 м) с центром на углу задевает по две ячейки в каждую сторону
+    assert len(index) == 16
+    reach = fence.radius * EXIT_FACTOR * 0.99
+    for step in range(36):
+        angle = math.radians(step * 10)
+        for r in (1, fence.radius, reach):
+            point = shifted(fence, r * math.cos(angle), r * math.sin(angle))
+            assert index.near(*point), (step, r)
+
+
+def test_grid_rejects_far_points():
+    index = GridIndex([FENCE], cell_m=250)
+    assert index.near(FENCE.lat, FENCE.lon)
+    for north, east in ((600, 0), (-600, 0), (0, 600), (0, -600), (1000, 1000)):
+        assert not index.near(*shifted(FENCE, north, east)), (north, east)
+
+
+def test_grid_of_several_fences():
+    other = Fence(*shifted(FENCE, 2000, 0), 30)
+    index = GridIndex([FENCE, other], cell_m=250)
+    assert index.near(*shifted(other, 0, 40))
+    assert index.near(*shifted(FENCE, -50, 0))
+    assert not index.near(*shifted(FENCE, 1000, 0))
+
+
+def test_empty_grid_is_never_near():
+    index = GridIndex([])
+    assert len(index) == 0
+    assert not index.near(FENCE.lat, FENCE.lon)
@@ -0,0 +1,48 @@
+from unittest import mock
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+import metrics
+
+TOKEN = "debug"
+
+
+class ProfileHandlerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = mock.patch.object(metrics, "sample_profile", self.fake_profile)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def fake_profile(self, thread_id, seconds, interval=0.005, top=40):
+        self.calls.append((seconds, top))
+        return "ok\n"
+
+    def get_app(self):
+        return tornado.web.Application(metrics.metrics_routes(TOKEN), log_function=lambda handler: None)
+
+    def profile(self, query: str):
+        return self.fetch(f"/debug/profile?token={TOKEN}&{query}")
+
+    def test_requires_token(self):
+        self.assertEqual(self.fetch("/debug/profile?token=wrong").code, 403)
+        self.assertEqual(self.calls, [])
+
+    def test_defaults(self):
+        response = self.profile("")
+        self.assertEqual((response.code, response.body), (200, b"ok\n"))
+        self.assertEqual(self.calls, [(10.0, 40)])
+
+    def test_rejects_bad_arguments(self):
+        for query in ("seconds=abc", "seconds=", "top=1.5", "seconds=0", "seconds=-1", "seconds=nan"):
+            with self.subTest(query=query):
+                self.assertEqual(self.profile(query).code, 400)
+        self.assertEqual(self.calls, [])
+
+    def test_clamps_arguments(self):
+        self.assertEqual(self.profile("seconds=500&top=0").code, 200)
+        self.assertEqual(self.profile("seconds=inf&top=-3").code, 200)
+        self.assertEqual(self.profile("seconds=0.5&top=5").code, 200)
+        self.assertEqual(self.calls, [(120, 1), (120, 1), (0.5, 5)])
@@ -0,0 +1,208 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import InputFile, InputMediaPhoto
+from telegram.error import RetryAfter
+
+import rate_limiter
+from rate_limiter import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_MEDIA,
+    PRIORITY_TEXT,
+    SendScheduler,
+    TokenBucket,
+    carries_files,
+    request_priority,
+)
+
+
+class VirtualClock:
+    """time.monotonic и asyncio.sleep для rate_limiter: паузы только сдвигают время"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.now += max(seconds, 0)
+        await asyncio.sleep(0)
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(rate_limiter, "asyncio", clock)
+    return clock
+
+
+@pytest.mark.parametrize("data, expected", [
+    ({"chat_id": 1, "text": "привет"}, False),
+    ({"chat_id": 1, "photo": "AgACAgIAAxkBAAI"}, False),
+    ({"chat_id": 1, "photo": InputFile(b"\x89PNG", filename="a.png")}, True),
+    ({"chat_id": 1, "voice": "file:///srv/assets/a.ogg"}, True),
+    ({"chat_id": 1, "media": [InputMediaPhoto("AgACAgIAAxkBAAI"), InputMediaPhoto("AgACAgIAAxkBAAJ")]}, False),
+    ({"chat_id": 1, "media": [InputMediaPhoto("AgACAgIAAxkBAAI"), InputMediaPhoto(b"\x89PNG")]}, True),
+    ({"chat_id": 1, "media": [InputMediaPhoto("file:///srv/assets/a.jpg")]}, True),
+])
+def test_carries_files(data, expected):
+    assert carries_files(data) is expected
+
+
+@pytest.mark.parametrize("endpoint, data, expected", [
+    ("sendMessage", {"text": "привет"}, PRIORITY_TEXT),
+    ("sendPhoto", {"photo": "AgACAgIAAxkBAAI"}, PRIORITY_TEXT),
+    ("sendPhoto", {"photo": InputFile(b"\x89PNG", filename="a.png")}, PRIORITY_MEDIA),
+    ("sendMediaGroup", {"media": [InputMediaPhoto(b"\x89PNG")]}, PRIORITY_MEDIA),
+    ("editMessageReplyMarkup", {"message_id": 1}, PRIORITY_INTERACTIVE),
+])
+def test_request_priority(endpoint, data, expected):
+    assert request_priority(endpoint, data) == expected
+
+
+def test_token_bucket_refills_and_pauses(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.idle
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.delay() == 0
+    bucket.pause(3)
+    assert bucket.delay() == pytest.approx(3)
+    clock.now += 3
+    # После паузы — один токен на повтор, пачка за время паузы не накопилась
+    assert bucket.delay() == 0
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 1
+    assert bucket.idle
+
+
+def run_scheduler(scheduler: SendScheduler, body):
+    async def main():
+        await scheduler.initialize()
+        try:
+            return await body()
+        finally:
+            await scheduler.shutdown()
+    return asyncio.run(main())
+
+
+def request(scheduler, callback, endpoint="sendMessage", data=None, priority=None):
+    return scheduler.process_request(
+        callback, (), {}, endpoint, {"chat_id": 1} if data is None else data,
+        {"priority": priority} if priority else None,
+    )
+
+
+def test_retry_after_pauses_chat_and_retries(clock):
+    scheduler = SendScheduler()
+    calls = []
+
+    async def callback():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise RetryAfter(2)
+        return "ok"
+
+    assert run_scheduler(scheduler, lambda: request(scheduler, callback)) == "ok"
+    assert scheduler.retry_after_count == 1
+    assert calls == [0, 2]
+    assert scheduler.queue_depth == 0
+
+
+def test_retry_after_without_chat_pauses_all_sending(clock):
+    scheduler = SendScheduler()
+    calls = []
+
+    async def callback():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise RetryAfter(5)
+        return True
+
+    run_scheduler(scheduler, lambda: request(scheduler, callback, data={}))
+    assert calls == [0, 5]
+
+
+def test_retry_after_reraised_after_max_retries(clock):
+    scheduler = SendScheduler(max_retries=2)
+    calls = []
+
+    async def callback():
+        calls.append(clock.now)
+        raise RetryAfter(1)
+
+    with pytest.raises(RetryAfter):
+        run_scheduler(scheduler, lambda: request(scheduler, callback))
+    assert len(calls) == 3
+    assert scheduler.retry_after_count == 3
+
+
+def test_unlimited_endpoint_skips_queue(clock):
+    scheduler = SendScheduler(overall_rate=1)
+
+    async def callback():
+        return True
+
+    async def body():
+        # Единственный общий токен занят, а ответ на нажатие всё равно уходит сразу
+        await request(scheduler, callback)
+        assert await request(scheduler, callback, endpoint="answerCallbackQuery", data={}) is True
+        return clock.now
+
+    assert run_scheduler(scheduler, body) == 0
+
+
+def test_higher_priority_lane_is_served_first(clock):
+    scheduler = SendScheduler(overall_rate=1)
+    order = []
+
+    def callback(name):
+        async def send():
+            order.append(name)
+        return send
+
+    async def body():
+        await request(scheduler, callback("first"))
+        await asyncio.gather(
+            request(scheduler, callback("bulk"), data={"chat_id": 2}, priority="bulk"),
+            request(scheduler, callback("media"), data={"chat_id": 3, "photo": InputFile(b"x", filename="a")},
+                    endpoint="sendPhoto"),
+            request(scheduler, callback("edit"), data={"chat_id": 4}, endpoint="editMessageReplyMarkup"),
+        )
+
+    run_scheduler(scheduler, body)
+    assert order == ["first", "edit", "media", "bulk"]
+
+
+def test_cancelled_request_does_not_take_a_token(clock):
+    scheduler = SendScheduler(overall_rate=1)
+    sent = []
+
+    def callback(name):
+        async def send():
+            sent.append((name, clock.now))
+        return send
+
+    async def body():
+        await request(scheduler, callback("first"))
+        cancelled = asyncio.ensure_future(request(scheduler, callback("cancelled"), data={"chat_id": 2}))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await request(scheduler, callback("next"), data={"chat_id": 3})
+        assert cancelled.cancelled()
+
+    run_scheduler(scheduler, body)
+    # Следующий запрос получает первый же токен, а не тот, что после отменённого
+    assert sent == [("first", 0), ("next", 1)]
+    assert scheduler.queue_depth == 0
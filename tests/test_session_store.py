@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from session_store import SessionBackend, SessionStore, SqliteSessionBackend
+
+KEYS = ("idx", "visited", "low_data")
+
+
+class MemoryBackend(SessionBackend):
+    """Хранилище в словаре; save_many может упасть заданное число раз,
+    а очередные записи — выполняться delays секунд"""
+
+    def __init__(self, fail: int = 0, delays: Tuple[float, ...] = ()):
+        self.rows: Dict[int, str] = {}
+        self.loads: List[int] = []
+        self.saves: List[List[Tuple[int, str]]] = []
+        self.fail = fail
+        self.delays = list(delays)
+        self._lock = threading.Lock()
+
+    def load(self, chat_id: int) -> Optional[str]:
+        self.loads.append(chat_id)
+        return self.rows.get(chat_id)
+
+    def save_many(self, items: List[Tuple[int, str]]) -> None:
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        with self._lock:
+            if self.fail:
+                self.fail -= 1
+                raise OSError("disk I/O error")
+            self.saves.append(items)
+            self.rows.update(items)
+
+
+def test_round_trip_through_sqlite(tmp_path):
+    db_path = tmp_path / "sessions.sqlite3"
+
+    async def before_restart():
+        store = SessionStore(SqliteSessionBackend(db_path), KEYS)
+        state = {"idx": 2, "visited": {1, 0}, "low_data": True, "message_ids": [5, 6]}
+        store.mark_dirty(42, state)
+        await store.flush()
+        state["idx"] = 3
+        store.mark_dirty(42, state)
+        await store.stop()
+        store.backend.close()
+
+    async def after_restart():
+        store = SessionStore(SqliteSessionBackend(db_path), KEYS)
+        state = {}
+        await store.restore(42, state)
+        empty = {}
+        await store.restore(7, empty)
+        store.backend.close()
+        return state, empty, store.active
+
+    asyncio.run(before_restart())
+    state, empty, active = asyncio.run(after_restart())
+    # Только ключи keys, множества — отсортированными списками
+    assert state == {"idx": 3, "visited": [0, 1], "low_data": True}
+    assert empty == {}
+    assert active == 2
+
+
+def test_restore_reads_once_and_keeps_newer_values():
+    backend = MemoryBackend()
+    backend.rows[1] = json.dumps({"idx": 4, "visited": [0, 1, 2, 3]})
+
+    async def main():
+        store = SessionStore(backend, KEYS)
+        state = {"idx": 0}
+        await store.restore(1, state)
+        state["visited"].append(4)
+        await store.restore(1, state)
+        # Чат, начатый в этом процессе, из хранилища не читается
+        store.mark_dirty(2, {"idx": 1})
+        await store.restore(2, {})
+        return state
+
+    state = asyncio.run(main())
+    assert state == {"idx": 0, "visited": [0, 1, 2, 3, 4]}
+    assert backend.loads == [1]
+
+
+def test_mark_dirty_writes_only_changed_states():
+    backend = MemoryBackend()
+
+    async def main():
+        store = SessionStore(backend, KEYS)
+        state = {"idx": 1}
+        store.mark_dirty(1, state)
+        store.mark_dirty(2, {"idx": 5})
+        await store.flush()
+        # Тот же state и изменения вне keys на диск не идут
+        state["message_ids"] = [9]
+        store.mark_dirty(1, state)
+        await store.flush()
+        state["idx"] = 2
+        store.mark_dirty(1, state)
+        await store.flush()
+
+    asyncio.run(main())
+    assert [sorted(chat for chat, _ in items) for items in backend.saves] == [[1, 2], [1]]
+    assert json.loads(backend.rows[1]) == {"idx": 2}
+
+
+def test_failed_flush_keeps_dirty_entries():
+    backend = MemoryBackend(fail=1)
+
+    async def main():
+        store = SessionStore(backend, KEYS)
+        old = {"idx": 1}
+        store.mark_dirty(1, old)
+        store.mark_dirty(2, {"idx": 7})
+        await store.flush()
+        assert backend.rows == {}
+        # Пока запись не удалась, чат успел получить новое состояние: оно и сохраняется
+        store.mark_dirty(1, {"idx": 2})
+        await store.flush()
+        await store.flush()
+
+    asyncio.run(main())
+    assert {chat: json.loads(raw) for chat, raw in backend.rows.items()} == {1: {"idx": 2}, 2: {"idx": 7}}
+    assert len(backend.saves) == 1
+
+
+def test_concurrent_flushes_do_not_reorder_writes():
+    # Первая запись медленнее второй: без очереди вторая легла бы раньше
+    backend = MemoryBackend(delays=(0.1, 0))
+
+    async def main():
+        store = SessionStore(backend, KEYS)
+        store.mark_dirty(1, {"idx": 1})
+        first = asyncio.create_task(store.flush())
+        await asyncio.sleep(0.01)
+        store.mark_dirty(1, {"idx": 2})
+        # Например, журнал доставки сбрасывает сессии, пока идёт фоновая запись
+        await asyncio.gather(first, store.flush())
+
+    asyncio.run(main())
+    assert [json.loads(items[0][1])["idx"] for items in backend.saves] == [1, 2]
+    assert json.loads(backend.rows[1]) == {"idx": 2}
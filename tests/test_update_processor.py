@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update
+
+from update_processor import ChatOrderedUpdateProcessor
+
+_ids = iter(range(1, 1 << 30))
+
+
+def message_update(chat_id: int, text: str) -> Update:
+    message = Message(next(_ids), datetime.now(timezone.utc), Chat(chat_id, Chat.PRIVATE), text=text)
+    return Update(next(_ids), message=message)
+
+
+def text_of(update: Update) -> str:
+    return update.message.text
+
+
+async def settle() -> None:
+    """Даёт запущенным задачам дойти до первого ожидания"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_one_chat_runs_in_order():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(4)
+        log = []
+        release = asyncio.Event()
+
+        async def first():
+            log.append("first:start")
+            await release.wait()
+            log.append("first:end")
+
+        async def second():
+            log.append("second")
+
+        tasks = [
+            asyncio.create_task(processor.do_process_update(message_update(1, "a"), first())),
+            asyncio.create_task(processor.do_process_update(message_update(1, "b"), second())),
+        ]
+        await settle()
+        assert log == ["first:start"]
+        assert processor.pending == 2
+        release.set()
+        await asyncio.gather(*tasks)
+        assert log == ["first:start", "first:end", "second"]
+        assert processor.pending == 0
+
+    asyncio.run(main())
+
+
+def test_different_chats_overlap():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(4)
+        other_started = asyncio.Event()
+
+        async def waits_for_other():
+            # Если чаты выполняются по очереди, второй не начнётся никогда
+            await asyncio.wait_for(other_started.wait(), 1)
+
+        async def other():
+            other_started.set()
+
+        await asyncio.gather(
+            processor.do_process_update(message_update(1, "a"), waits_for_other()),
+            processor.do_process_update(message_update(2, "a"), other()),
+        )
+
+    asyncio.run(main())
+
+
+def test_duplicate_tap_is_dropped():
+    async def main():
+        dropped = []
+
+        async def on_dropped(update):
+            dropped.append(text_of(update))
+
+        processor = ChatOrderedUpdateProcessor(4, action_key=text_of, on_dropped=on_dropped)
+        release = asyncio.Event()
+        ran = []
+
+        async def handler(name):
+            ran.append(name)
+            await release.wait()
+
+        first = asyncio.create_task(processor.do_process_update(message_update(1, "next"), handler("first")))
+        await settle()
+        duplicate = handler("duplicate")
+        await processor.do_process_update(message_update(1, "next"), duplicate)
+        # Другая кнопка того же чата и та же кнопка другого чата не отсеиваются
+        others = [
+            asyncio.create_task(processor.do_process_update(message_update(1, "menu"), handler("menu"))),
+            asyncio.create_task(processor.do_process_update(message_update(2, "next"), handler("chat2"))),
+        ]
+        await settle()
+        release.set()
+        await asyncio.gather(first, *others)
+
+        assert dropped == ["next"]
+        assert processor.duplicates == 1
+        assert ran == ["first", "chat2", "menu"]
+        assert duplicate.cr_frame is None  # корутина закрыта, а не брошена
+
+    asyncio.run(main())
+
+
+def test_preempt_cancels_running_and_waiting_entries():
+    async def main():
+        dropped = []
+
+        async def on_dropped(update):
+            dropped.append(text_of(update))
+
+        processor = ChatOrderedUpdateProcessor(
+            4, preempts=lambda u: text_of(u) == "menu", on_dropped=on_dropped
+        )
+        log = []
+
+        async def delivery():
+            log.append("delivery:start")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                log.append("delivery:cancelled")
+                raise
+
+        async def handler(name):
+            log.append(name)
+
+        running = asyncio.create_task(processor.do_process_update(message_update(1, "point"), delivery()))
+        await settle()
+        waiting = asyncio.create_task(processor.do_process_update(message_update(1, "next"), handler("next")))
+        await settle()
+        await processor.do_process_update(message_update(1, "menu"), handler("menu"))
+
+        # Вытесненные апдейты завершаются без исключения: отменён обработчик, а не _run
+        assert await running is None
+        assert await waiting is None
+        assert not running.cancelled()
+        assert log == ["delivery:start", "delivery:cancelled", "menu"]
+        assert dropped == ["next"]
+        assert processor.cancelled == 2
+        assert processor.active == 0 and processor.pending == 0
+
+    asyncio.run(main())
+
+
+def test_own_cancellation_propagates():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(4)
+        started = asyncio.Event()
+        cleaned = []
+
+        async def delivery():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            finally:
+                cleaned.append(True)
+
+        task = asyncio.create_task(processor.do_process_update(message_update(1, "a"), delivery()))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Обработчик отменён и завершён до того, как отмена дошла до вызывающего
+        assert cleaned == [True]
+        assert processor.active == 0 and processor.pending == 0
+
+    asyncio.run(main())
+
+
+def test_max_concurrent_updates_limits_running_handlers():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(2)
+        release = asyncio.Event()
+        peak = 0
+
+        async def handler():
+            nonlocal peak
+            peak = max(peak, processor.active)
+            await release.wait()
+
+        tasks = [
+            asyncio.create_task(processor.do_process_update(message_update(chat, "a"), handler()))
+            for chat in range(1, 6)
+        ]
+        await settle()
+        assert processor.active == 2
+        release.set()
+        await asyncio.gather(*tasks)
+        assert peak == 2
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import json
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from webhook import SECRET_HEADER, RecentIds, WebhookHandler
+
+SECRET = "s3cret"
+
+
+def test_recent_ids_forgets_oldest_beyond_window():
+    recent = RecentIds(size=2)
+    for update_id in (1, 2, 3):
+        assert not recent.seen(update_id)
+        recent.remember(update_id)
+    assert recent.seen(3) and recent.seen(2)
+    assert not recent.seen(1)
+    assert recent.duplicates == 2
+
+
+def test_recent_ids_seen_does_not_remember():
+    recent = RecentIds()
+    assert not recent.seen(5)
+    assert not recent.seen(5)
+    recent.remember(5)
+    recent.remember(5)
+    assert recent.seen(5)
+    assert recent.duplicates == 1
+
+
+class WebhookHandlerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.received = []
+        self.failures = 0
+        self.recent = RecentIds()
+        super().setUp()
+
+    def sink(self, body: bytes, data: dict) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("очередь недоступна")
+        self.received.append(data)
+
+    def get_app(self):
+        return tornado.web.Application(
+            [(r"/webhook/?", WebhookHandler, {"sink": self.sink, "secret": SECRET, "recent": self.recent})],
+            log_function=lambda handler: None,
+        )
+
+    def post(self, data, secret=SECRET):
+        headers = {"Content-Type": "application/json"}
+        if secret is not None:
+            headers[SECRET_HEADER] = secret
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        return self.fetch("/webhook", method="POST", body=body, headers=headers)
+
+    def test_accepts_update_with_secret(self):
+        response = self.post({"update_id": 1, "message": {"text": "привет"}})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.received, [{"update_id": 1, "message": {"text": "привет"}}])
+
+    def test_rejects_missing_or_wrong_secret(self):
+        self.assertEqual(self.post({"update_id": 1}, secret=None).code, 403)
+        self.assertEqual(self.post({"update_id": 1}, secret="s3cre").code, 403)
+        self.assertEqual(self.received, [])
+        # Отклонённый апдейт не считается принятым
+        self.assertEqual(self.post({"update_id": 1}).code, 200)
+        self.assertEqual(len(self.received), 1)
+
+    def test_rejects_malformed_body(self):
+        self.assertEqual(self.post(b"{not json").code, 400)
+        self.assertEqual(self.post([1, 2]).code, 400)
+        self.assertEqual(self.received, [])
+
+    def test_drops_repeated_update_id(self):
+        for _ in range(3):
+            self.assertEqual(self.post({"update_id": 7}).code, 200)
+        self.assertEqual(self.post({"update_id": 8}).code, 200)
+        self.assertEqual([d["update_id"] for d in self.received], [7, 8])
+        self.assertEqual(self.recent.duplicates, 2)
+
+    def test_update_is_remembered_only_after_sink_accepts_it(self):
+        self.failures = 1
+        with self.assertLogs("tornado.application", "ERROR"):
+            self.assertEqual(self.post({"update_id": 9}).code, 500)
+        # Повтор от Telegram после 500 не отсеивается, следующий — уже да
+        self.assertEqual(self.post({"update_id": 9}).code, 200)
+        self.assertEqual(self.post({"update_id": 9}).code, 200)
+        self.assertEqual(self.received, [{"update_id": 9}])
+        self.assertEqual(self.recent.duplicates, 1)
+
+    def test_update_without_id_is_not_deduplicated(self):
+        self.post({"message": {"text": "a"}})
+        self.post({"message": {"text": "a"}})
+        self.assertEqual(len(self.received), 2)
@@ -0,0 +1,201 @@
+# tour.py — компиляция описания точек маршрута в неизменяемую программу шагов
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from delivery import Op, media_op, pause_op, plan, text_op
+from geofence import Fence
+
+# Описание точки — словарь; содержимое — список шагов-словарей, тип шага
+# определяется ключом:
+#   {"photo": Path}                           — фото
+#   {"text": str}                             — текст (Markdown)
+#   {"voice": Path, "description": str}       — голосовое и подпись к нему
+#   {"pause": секунды}                        — пауза вместо стандартной (1 с)
+#   {"prompt": str, "yes": str, "no": str,    — вопрос с кнопками; "then" —
+#    "then": [шаги]}                            шаги ветки «да», «нет» ведёт к следующей точке
+# Навигация к точке задаётся ключами "navigation", "nav_photo",
+# "transition_text", "transition_audio"; кнопки навигации после содержимого
+# добавляются автоматически.
+
+DEFAULT_PAUSE = 1
+MISSING_PHOTO_PAUSE = 5
+LAST_POINT_PAUSE = 5
+
+DEFAULT_YES = "✅ Да"
+DEFAULT_NO = "➡️ Не сейчас"
+
+
+@dataclass(frozen=True)
+class Keyboards:
+    """Готовые клавиатуры, которые программа вставляет в сообщения.
+    Кнопки точки знают её номер, поэтому клавиатуры строятся для каждой точки."""
+    im_here: Callable[[int], Any]                 # im_here(idx)
+    nav: Callable[[int, bool], Any]               # nav(idx, is_last)
+    prompt: Callable[[int, str, str], Any]        # prompt(idx, yes_label, no_label)
+
+
+@dataclass(frozen=True)
+class PointProgram:
+    index: int
+    navigation: Optional[Tuple[Op, ...]]  # None — к точке не нужно идти (первая)
+    content: Tuple[Op, ...]
+    branch: Optional[Tuple[Op, ...]]      # ветка «да» после вопроса
+    has_prompt: bool
+
+
+@dataclass(frozen=True)
+class CompiledTour:
+    """Версия маршрута целиком. Сессия, начатая на одной версии, доходит
+    до конца на ней же, даже если файл маршрута тем временем обновили."""
+    version: str
+    points: Tuple[PointProgram, ...]
+    intro: Tuple[Op, ...]
+    final: Tuple[Op, ...]
+    content: Any                          # content.Content, из которого собрана версия
+    fences: Tuple[Optional[Fence], ...] = ()  # зона каждой точки, если заданы координаты
+
+
+def iter_paths(value: Any) -> Iterator[Path]:
+    """Все пути к файлам внутри описания точки"""
+    if isinstance(value, Path):
+        yield value
+    elif isinstance(value, Mapping):
+        for v in value.values():
+            yield from iter_paths(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from iter_paths(v)
+
+
+class _Builder:
+    def __init__(self, exists: Callable[[Optional[Path]], bool]):
+        self.exists = exists
+        self.ops: List[Op] = []
+
+    def pause(self, seconds: float) -> None:
+        # Явная пауза заменяет стандартную после предыдущего шага
+        if self.ops and self.ops[-1].kind == "pause":
+            self.ops[-1] = pause_op(seconds)
+        else:
+            self.ops.append(pause_op(seconds))
+
+    def send(self, op: Op, pause: float = DEFAULT_PAUSE) -> None:
+        self.ops.append(op)
+        if pause:
+            self.ops.append(pause_op(pause))
+
+    def step(self, step: Mapping) -> None:
+        if "photo" in step:
+            path = step["photo"]
+            if self.exists(path):
+                self.send(media_op("photo", path))
+            elif path:
+                self.send(text_op(f"⚠️ Фото не найдено: {path}"), MISSING_PHOTO_PAUSE)
+        elif "voice" in step:
+            path = step["voice"]
+            if self.exists(path):
+                self.send(media_op("voice", path))
+                if step.get("description"):
+                    self.send(text_op(step["description"], parse_mode="Markdown"))
+            elif path:
+                self.send(text_op(f"⚠️ Аудио не найдено: {path}"))
+        elif "text" in step:
+            self.send(text_op(step["text"], parse_mode="Markdown"))
+        elif "pause" in step:
+            self.pause(step["pause"])
+        else:
+            raise ValueError(f"Неизвестный шаг: {step!r}")
+
+
+def _nav_tail(builder: _Builder, keyboards: Keyboards, idx: int, is_last: bool) -> None:
+    if is_last:
+        builder.pause(LAST_POINT_PAUSE)
+        builder.send(
+            text_op(
+                "Это была последняя точка нашего маршрута, но у нас еще есть, что рассказать",
+                reply_markup=keyboards.nav(idx, True),
+            ),
+            pause=0,
+        )
+    else:
+        builder.send(text_op("👇 Навигация:", reply_markup=keyboards.nav(idx, False)), pause=0)
+
+
+def _compile_navigation(point: Mapping, idx: int, total: int, keyboards: Keyboards,
+                        exists: Callable[[Optional[Path]], bool]) -> Tuple[Op, ...]:
+    b = _Builder(exists)
+    progress = f"\n\n_Точка {idx + 1} из {total}_"
+    navigation_text = point.get("navigation", "📍 Следующая точка")
+    nav_photo = point.get("nav_photo")
+    if exists(nav_photo):
+        b.send(media_op("photo", nav_photo, caption=navigation_text + progress, parse_mode="Markdown"))
+    else:
+        b.send(text_op(navigation_text + progress, parse_mode="Markdown"))
+
+    if point.get("transition_text"):
+        b.send(text_op(point["transition_text"]))
+    # Переходное аудио необязательно: если файла нет, просто пропускаем
+    if exists(point.get("transition_audio")):
+        b.send(media_op("voice", point["transition_audio"]))
+
+    b.send(text_op("Дайте знать, когда доберетесь:", reply_markup=keyboards.im_here(idx)), pause=0)
+    return tuple(plan(b.ops, pacing=point.get("pacing", False)))
+
+
+def compile_point(point: Mapping, idx: int, total: int, keyboards: Keyboards,
+                  exists: Callable[[Optional[Path]], bool]) -> PointProgram:
+    is_last = idx == total - 1
+    pacing = point.get("pacing", False)
+
+    b = _Builder(exists)
+    prompt = None
+    for step in point.get("steps", ()):
+        if "prompt" in step:
+            prompt = step
+            break
+        b.step(step)
+
+    branch = None
+    if prompt:
+        b.send(
+            text_op(
+                prompt["prompt"],
+                reply_markup=keyboards.prompt(
+                    idx, prompt.get("yes", DEFAULT_YES), prompt.get("no", DEFAULT_NO)
+                ),
+            ),
+            pause=0,
+        )
+        bb = _Builder(exists)
+        for step in prompt.get("then", ()):
+            bb.step(step)
+        _nav_tail(bb, keyboards, idx, is_last)
+        branch = tuple(plan(bb.ops, pacing=pacing))
+    else:
+        _nav_tail(b, keyboards, idx, is_last)
+
+    navigation = None
+    if "navigation" in point:
+        navigation = _compile_navigation(point, idx, total, keyboards, exists)
+
+    return PointProgram(
+        index=idx,
+        navigation=navigation,
+        content=tuple(plan(b.ops, pacing=pacing)),
+        branch=branch,
+        has_prompt=prompt is not None,
+    )
+
+
+def point_fence(point: Mapping, default_radius: float) -> Optional[Fence]:
+    location = point.get("location")
+    if not location:
+        return None
+    return Fence(location["lat"], location["lon"], location.get("radius", default_radius))
+
+
+def compile_tour(points: Sequence[Mapping], keyboards: Keyboards,
+                 exists: Callable[[Optional[Path]], bool]) -> Tuple[PointProgram, ...]:
+    total = len(points)
+    return tuple(compile_point(p, i, total, keyboards, exists) for i, p in enumerate(points))
@@ -0,0 +1,142 @@
+# update_processor.py — параллельная обработка апдейтов разных чатов
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: object) -> Optional[int]:
+    if isinstance(update, Update) and update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class _Entry:
+    """Апдейт чата, который выполняется или ждёт своей очереди"""
+    __slots__ = ("key", "task", "dropped")
+
+    def __init__(self, key: Optional[Hashable]):
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = False
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Разные чаты обрабатываются одновременно, апдейты одного чата — строго по очереди.
+
+    max_concurrent_updates — сколько обработчиков реально выполняется одновременно,
+    max_pending_updates — сколько апдейтов может ждать в очередях всех чатов вместе.
+    Апдейт, ждущий свой чат, не занимает слот выполнения, поэтому один «медленный»
+    чат с очередью нажатий не тормозит остальных.
+
+    Защита от повторных нажатий:
+    action_key(update) — ключ действия (например, callback_data); апдейт с тем же
+    ключом, что уже выполняется или ждёт в этом чате, не выполняется;
+    preempts(update) — True, если апдейт отменяет всё, что выполняется и ждёт
+    в чате (например, «В меню» посреди доставки точки);
+    on_dropped(update) — вызывается для каждого невыполненного апдейта
+    (например, чтобы ответить на callback_query).
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        max_pending_updates: int = 1024,
+        action_key: Optional[Callable[[object], Optional[Hashable]]] = None,
+        preempts: Optional[Callable[[object], bool]] = None,
+        on_dropped: Optional[Callable[[object], Awaitable[Any]]] = None,
+    ):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._action_key = action_key
+        self._preempts = preempts
+        self._on_dropped = on_dropped
+        # chat_id -> замок-очередь и апдейты этого чата в обработке/ожидании
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_entries: Dict[int, List[_Entry]] = {}
+        self.active = 0
+        self.duplicates = 0
+        self.cancelled = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(entries) for entries in self._chat_entries.values())
+
+    async def _run(self, coroutine: Awaitable[Any], entry: Optional[_Entry] = None) -> None:
+        async with self._running:
+            self.active += 1
+            try:
+                if entry is None:
+                    await coroutine
+                    return
+                # Отдельная задача, чтобы её можно было отменить, не трогая нашу.
+                # wait, а не await: отмена нашей задачи не уходит в entry.task сама,
+                # поэтому её не спутать с отменой вытесненного обработчика
+                entry.task = asyncio.ensure_future(coroutine)
+                try:
+                    await asyncio.wait((entry.task,))
+                except asyncio.CancelledError:
+                    entry.task.cancel()
+                    await asyncio.wait((entry.task,))
+                    raise
+                if entry.task.cancelled() and entry.dropped:
+                    return
+                await entry.task
+            finally:
+                self.active -= 1
+
+    async def _drop(self, update: object, coroutine: Awaitable[Any]) -> None:
+        coroutine.close()
+        if self._on_dropped:
+            try:
+                await self._on_dropped(update)
+            except Exception:
+                logger.exception("Ошибка при пропуске апдейта")
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            await self._run(coroutine)
+            return
+
+        entries = self._chat_entries.get(chat_id, [])
+        key = self._action_key(update) if self._action_key else None
+        if key is not None and any(e.key == key and not e.dropped for e in entries):
+            # Повторное нажатие, пока первое ещё обрабатывается
+            self.duplicates += 1
+            await self._drop(update, coroutine)
+            return
+        if self._preempts and entries and self._preempts(update):
+            for e in entries:
+                if not e.dropped:
+                    e.dropped = True
+                    self.cancelled += 1
+                    if e.task:
+                        e.task.cancel()
+
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        entry = _Entry(key)
+        self._chat_entries.setdefault(chat_id, entries).append(entry)
+        try:
+            async with lock:
+                if entry.dropped:
+                    await self._drop(update, coroutine)
+                else:
+                    await self._run(coroutine, entry)
+        finally:
+            entries.remove(entry)
+            if not entries:
+                del self._chat_entries[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,96 @@
+# webhook.py — приём апдейтов от Telegram: проверка секрета, отсев повторов, мгновенный ответ
+#
+# Обработчик ничего не ждёт: апдейт проверяется, отдаётся в очередь (sink)
+# и Telegram сразу получает 200, сколько бы ни длилась доставка точки.
+import hmac
+import json
+import logging
+from collections import deque
+from typing import Callable, Deque, Optional, Sequence, Set
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# sink(body, data): сырое тело запроса и разобранный JSON
+Sink = Callable[[bytes, dict], None]
+
+
+class RecentIds:
+    """Окно последних update_id: Telegram повторяет апдейт, если не дождался ответа"""
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self._order: Deque[int] = deque()
+        self._ids: Set[int] = set()
+        self.duplicates = 0
+
+    def seen(self, update_id: int) -> bool:
+        """True — апдейт уже принят раньше"""
+        if update_id in self._ids:
+            self.duplicates += 1
+            return True
+        return False
+
+    def remember(self, update_id: int) -> None:
+        """Запоминает принятый апдейт; вызывать только после того, как sink его взял"""
+        if update_id in self._ids:
+            return
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, sink: Sink, secret: Optional[str], recent: RecentIds):
+        self.sink = sink
+        self.secret = secret
+        self.recent = recent
+
+    def post(self):
+        if self.secret:
+            token = self.request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token.encode(), self.secret.encode()):
+                logger.warning("Запрос без верного секрета от %s", self.request.remote_ip)
+                raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if not isinstance(data, dict):
+            raise tornado.web.HTTPError(400)
+
+        update_id = data.get("update_id")
+        if isinstance(update_id, int) and self.recent.seen(update_id):
+            logger.debug("Повтор апдейта %s пропущен", update_id)
+            return
+        # Если sink упал, Telegram получит 500 и повторит апдейт — повтор
+        # не должен быть отсеян, поэтому id запоминается только после sink
+        self.sink(self.request.body, data)
+        if isinstance(update_id, int):
+            self.recent.remember(update_id)
+
+    def log_exception(self, typ, value, tb):
+        # 403/400 уже залогированы выше, трассировка не нужна
+        if not isinstance(value, tornado.web.HTTPError):
+            super().log_exception(typ, value, tb)
+
+
+def start_webhook_server(sink: Sink, listen: str, port: int, url_path: str,
+                         secret: Optional[str] = None,
+                         recent: Optional[RecentIds] = None,
+                         extra_routes: Sequence = ()) -> HTTPServer:
+    """extra_routes — другие страницы на том же порту (например, /metrics)"""
+    web_app = tornado.web.Application(
+        [(rf"/{url_path}/?", WebhookHandler,
+          {"sink": sink, "secret": secret, "recent": recent or RecentIds()}),
+         *extra_routes],
+        log_function=lambda handler: None,
+    )
+    server = HTTPServer(web_app)
+    server.listen(port, listen)
+    return server